@@ -15,7 +15,9 @@ import numpy as np
 from nifti_mrs import nifti_mrs
 from nifti_mrs import create_nmrs
 from nifti_mrs import tools
+from nifti_mrs import validator
 import fsl_mrs.core as core
+from fsl_mrs.utils import nifti_compression
 
 
 def gen_nifti_mrs(*args, **kwargs):
@@ -99,6 +101,34 @@ class NIFTI_MRS(nifti_mrs.NIFTI_MRS):
         """
         super().__init__(*args, **kwargs)
 
+    def save(self, filepath, compression_method=None):
+        """Save NIfTI-MRS to file.
+
+        :param filepath: Name and path of save location.
+            The extension is set to match the compression (.nii for 'none', otherwise .nii.gz).
+        :type filepath: str or pathlib.Path
+        :param compression_method: Compression method, one of gzip, none, fast or threaded.
+            Defaults to the current setting (see fsl_mrs.utils.nifti_compression).
+        :type compression_method: str, optional
+        :return: Path of saved file
+        :rtype: pathlib.Path
+        """
+        method = nifti_compression.get_compression(compression_method)
+        filepath = nifti_compression.output_filename(filepath, method)
+        if method == 'gzip':
+            super().save(filepath)
+            return filepath
+
+        # Other methods serialise the image directly, bypassing the temporary file and reload of Image.save
+        self._save_hdr_ext()
+        validator.validate_nifti_mrs(self.image)
+        if self.image.saveState:
+            nib_img = self.image.nibImage
+        else:
+            nib_img = type(self.image.nibImage)(self.image.data, affine=None, header=self.image.header)
+        nifti_compression.write_nifti_bytes(nib_img.to_bytes(), filepath, method)
+        return filepath
+
     def copy(self, remove_dim=None):
         """Return a copy of this image, optionally with a dimension removed.
 
@@ -7,13 +7,14 @@
 import copy
 import warnings
 import json
+from functools import cached_property
 
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from pathlib import Path
 
-from fsl_mrs.utils.misc import calculate_lap_cov, gradient
+from fsl_mrs.utils.misc import calculate_lap_cov
 from fsl_mrs.utils.plotting import plot_general_corr
 
 
@@ -797,31 +798,40 @@ class dynRes_newton(dynRes):
         else:
             super().__init__(samples[np.newaxis, :], dyn, init)
 
-        # Calculate covariance, correlation and uncertainty
-        data = np.asarray(dyn.data).flatten()
+        # Covariance, correlation and uncertainties are calculated on first access and cached.
 
-        # Dynamic (free) parameters
-        self._cov_free = calculate_lap_cov(self.x, dyn.full_fwd, data)
-        crlb_dyn = np.diagonal(self._cov_free)
+    @cached_property
+    def _cov_free(self):
+        """Free parameter covariance from the Fisher information matrix.
+
+        Uses the analytic Jacobian of the full dynamic model, evaluated once at the solution.
+        """
+        data = np.asarray(self._dyn.data).flatten()
+        return calculate_lap_cov(
+            self.x,
+            self._dyn.full_fwd,
+            data,
+            grad=self._dyn.full_jac(self.x))
+
+    @cached_property
+    def _std_free(self):
+        with warnings.catch_warnings():
+            warnings.filterwarnings('ignore', r'invalid value encountered in sqrt')
+            return np.sqrt(np.diagonal(self._cov_free))
+
+    @cached_property
+    def _corr_free(self):
+        return self._cov_free / (self._std_free[:, np.newaxis] * self._std_free[np.newaxis, :])
+
+    @cached_property
+    def _std_mapped(self):
+        """Mapped parameter uncertainties (mapped parameters x time points),
+        propagated from the free parameter covariance using the free to mapped Jacobian."""
+        grad = self._dyn.vm.free_to_mapped_grad(self.x)
+        var = np.einsum('tmf,fg,tmg->mt', grad, self._cov_free, grad)
         with warnings.catch_warnings():
             warnings.filterwarnings('ignore', r'invalid value encountered in sqrt')
-            self._std_free = np.sqrt(crlb_dyn)
-        self._corr_free = self._cov_free / (self._std_free[:, np.newaxis] * self._std_free[np.newaxis, :])
-
-        # Mapped parameters
-        # import pdb; pdb.set_trace()
-        p = dyn.vm.free_to_mapped(self.x)
-        self._mapped_params = dyn.vm.mapped_to_dict(p)
-        # Mapped parameters covariance etc.
-        grad_all = np.transpose(gradient(self.x, dyn.vm.free_to_mapped), (2, 0, 1))
-        nt = dyn.vm.ntimes
-        nf = len(self.x)
-        std = np.zeros((dyn.vm.nmapped, nt))
-        for idx in range(dyn.vm.nmapped):
-            grad = np.reshape(np.array([grad_all[idx, ll, kk] for ll in range(nf) for kk in range(nt)]), (nf, nt)).T
-            s_tmp = np.sqrt(np.diag(grad @ self._cov_free @ grad.T))
-            std[idx, :] = np.array(s_tmp).T
-        self._std_mapped = std
+            return np.sqrt(var)
 
     @property
     def reslist(self):
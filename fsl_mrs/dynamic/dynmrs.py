@@ -560,6 +560,23 @@ class dynMRS(object):
             fwd[time_index, :] = self.forward[time_index](p)
         return fwd.flatten()
 
+    def full_jac(self, x):
+        """Return the Jacobian of the flattened full model (see full_fwd) with respect to the free parameters.
+
+        The per-time-point model Jacobians are stacked and combined with the
+        free to mapped Jacobian in a single batched product.
+
+        :param x: Free parameters
+        :type x: numpy.ndarray
+        :return: Jacobian, shape free parameters x (time points * points)
+        :rtype: numpy.ndarray
+        """
+        mapped = self.vm.free_to_mapped(x)
+        dfdmapped = np.stack(
+            [self.gradient[time_index](mapped[time_index, :]) for time_index in range(self.vm.ntimes)])
+        dmappeddfree = self.vm.free_to_mapped_grad(x)
+        return np.matmul(dfdmapped, dmappeddfree).reshape(-1, self.vm.nfree).T
+
     def form_FitRes(self, x, method):
         """Create list of FitRes object"""
         if method.lower() == 'mh':
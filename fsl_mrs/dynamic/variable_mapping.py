@@ -510,6 +510,42 @@ class VariableMapping(object):
 
         return mapped_params
 
+    def free_to_mapped_grad(self, p):
+        """
+        Jacobian of the free to mapped parameter transform
+        fixed params have unit gradient at all times
+        variable params have unit gradient at their own time point
+        dynamic params use the gradient function of the dyn model
+
+        Parameters
+        ----------
+        p : 1D array
+        Returns
+        -------
+        3D array (time X mapped params X free params)
+        """
+        if (p.size != self.nfree):
+            raise ValueError(
+                'Input free params does not have expected number of entries.'
+                f' Found {p.size}, expected {self.nfree}')
+
+        grad = np.zeros((self.ntimes, self.nmapped, self.nfree))
+        for index, mp_obj in enumerate(self._mapped_params):
+            if mp_obj.param_type == 'fixed':
+                grad[:, index, mp_obj.free_indices] = 1
+            elif mp_obj.param_type == 'variable':
+                grad[np.arange(self.ntimes), index, mp_obj.free_indices] = 1
+            elif mp_obj.param_type == 'dynamic':
+                grad_fcn = self.get_gradient_fcn(mp_obj)
+                mp_grad = grad_fcn(p[mp_obj.free_indices], self.time_variable)
+                grad[:, index, mp_obj.free_indices] = np.asarray(list(mp_grad), dtype=float).T
+            else:
+                raise ConfigFileError(
+                    f"Unknown parameter mode ({mp_obj.param_type}) in configuration "
+                    "- should be one of 'fixed', 'variable', {'dynamic'}")
+
+        return grad
+
     def print_free(self, x):
         """
         Print free params and their names
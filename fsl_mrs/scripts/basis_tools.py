@@ -50,10 +50,12 @@ def main():
     convertparser = sp.add_parser(
         'convert',
         help='Convert LCModel or jMRUI formated basis to FSL format.')
-    convertparser.add_argument('input', type=Path,
-                               help='Input basis file or folder')
+    convertparser.add_argument('input', type=Path, nargs='+',
+                               help='Input basis file(s) or folder(s)')
     convertparser.add_argument('output', type=Path,
-                               help='Output fsl formatted folder, will be created if needed.')
+                               help='Output fsl formatted folder, will be created if needed. '
+                                    'If multiple inputs are given, each converted basis is placed in a '
+                                    'folder of the input name within this folder.')
     convertparser.add_argument('--bandwidth', type=float, default=None,
                                help='Required for LCModel RAW format only: spectral bandwidth in Hz.')
     convertparser.add_argument('--fieldstrength', type=float, default=None,
@@ -62,8 +64,28 @@ def main():
                                help='Remove LCModel reference peak.')
     convertparser.add_argument('--hlsvd', action="store_true",
                                help='Use HLSVD peak removal, rather than zeroing.')
+    convertparser.add_argument('--workers', type=int, default=None,
+                               help='Number of processes used to convert multiple inputs, defaults to os.cpu_count().')
     convertparser.set_defaults(func=convert)
 
+    # Compile tool - single binary file for fast loading
+    compileparser = sp.add_parser(
+        'compile',
+        help='Compile a basis set to a single binary file for faster loading.',
+        description='Compile a basis set to a single binary (.fslbasis) file. '
+                    'If saved to the default location the compiled basis is used automatically '
+                    'whenever the basis is loaded, until the source basis files are modified. '
+                    'The compiled file can also be passed directly in place of the basis.')
+    compileparser.add_argument('file', type=Path, nargs='+',
+                               help='Basis file(s) or folder(s)')
+    compileparser.add_argument('--output', type=Path, default=None,
+                               help='Output file, only valid for a single input. '
+                                    'Defaults to basis.fslbasis in a basis folder, '
+                                    'or the basis file name with a .fslbasis suffix.')
+    compileparser.add_argument('--workers', type=int, default=None,
+                               help='Number of processes used to compile multiple inputs, defaults to os.cpu_count().')
+    compileparser.set_defaults(func=compile_basis)
+
     # Add tool - add a json formatted fid to a basis set
     addparser = sp.add_parser(
         'add',
@@ -257,35 +279,86 @@ def convert(args):
     :param args: Argparse interpreted arguments
     :type args: Namespace
     """
+    from functools import partial
+
+    if len(args.input) == 1:
+        outputs = [args.output]
+    else:
+        outputs = [args.output / inpath.stem for inpath in args.input]
+        if len(set(outputs)) < len(outputs):
+            raise ValueError('Multiple inputs have the same name, convert these separately.')
+
+    convert_func = partial(
+        _convert_single,
+        bandwidth=args.bandwidth,
+        fieldstrength=args.fieldstrength,
+        remove_reference=args.remove_reference,
+        hlsvd=args.hlsvd)
+    _run_pool(convert_func, list(zip(args.input, outputs)), args.workers)
+
+
+def _convert_single(inpath, outpath, bandwidth=None, fieldstrength=None, remove_reference=False, hlsvd=False):
+    """Convert a single lcm/jmrui basis set to fsl format."""
     from fsl_mrs.utils import basis_tools
     from fsl_mrs.utils.mrs_io import read_basis
     from fsl_mrs.utils.constants import GYRO_MAG_RATIO
 
-    if args.input.is_file():
-        basis_tools.convert_lcm_basis(args.input, args.output)
-    elif args.input.is_dir()\
-            and (len(list(args.input.glob('*.raw'))) > 0 or len(list(args.input.glob('*.RAW'))) > 0):
+    if inpath.is_file():
+        basis_tools.convert_lcm_basis(inpath, outpath)
+    elif inpath.is_dir()\
+            and (len(list(inpath.glob('*.raw'))) > 0 or len(list(inpath.glob('*.RAW'))) > 0):
         basis_tools.convert_lcm_raw_basis(
-            args.input,
-            args.bandwidth,
-            args.fieldstrength * GYRO_MAG_RATIO['1H'],
-            args.output)
-    elif args.input.is_dir()\
-            and len(list(args.input.glob('*.txt'))) > 0:
+            inpath,
+            bandwidth,
+            fieldstrength * GYRO_MAG_RATIO['1H'],
+            outpath)
+    elif inpath.is_dir()\
+            and len(list(inpath.glob('*.txt'))) > 0:
         basis_tools.convert_jmrui_basis(
-            args.input,
-            args.output)
+            inpath,
+            outpath)
 
-    if args.remove_reference:
+    if remove_reference:
         # TODO sort this conjugation mess out.
-        basis = read_basis(args.output)
+        basis = read_basis(outpath)
         basis = basis_tools.conjugate_basis(basis)
         basis = basis_tools.remove_peak(
             basis,
             (-.2, .2),
             all=True,
-            use_hlsvd=args.hlsvd)
-        basis_tools.conjugate_basis(basis).save(args.output, overwrite=True)
+            use_hlsvd=hlsvd)
+        basis_tools.conjugate_basis(basis).save(outpath, overwrite=True)
+
+
+def compile_basis(args):
+    """Compile basis to binary format
+    :param args: Argparse interpreted arguments
+    :type args: Namespace
+    """
+    from fsl_mrs.utils.mrs_io import compile_basis
+
+    if args.output is not None and len(args.file) > 1:
+        raise ValueError('--output can only be used with a single input.')
+
+    for out in _run_pool(compile_basis, [(file, args.output) for file in args.file], args.workers):
+        print(f'Compiled basis saved to {out}.')
+
+
+def _run_pool(func, arg_list, workers=None):
+    """Call func for each tuple of arguments, using a process pool if there is more than one.
+
+    :param func: Function to run (must be picklable)
+    :param arg_list: List of argument tuples
+    :param workers: Number of processes, defaults to None (os.cpu_count())
+    :return: List of outputs
+    """
+    if len(arg_list) == 1 or workers == 1:
+        return [func(*fargs) for fargs in arg_list]
+
+    import os
+    import multiprocessing as mp
+    with mp.Pool(min(workers or os.cpu_count(), len(arg_list))) as pool:
+        return pool.starmap(func, arg_list)
 
 
 def add(args):
@@ -32,9 +32,10 @@ def main():
 
     # REQUIRED ARGUMENTS
     required.add_argument('--data',
-                          required=True, nargs='+', type=Path, metavar='<FILE> or <DIRS>',
+                          required=False, nargs='+', type=Path, metavar='<FILE> or <DIRS>',
                           action=DataAction,
-                          help='File containing list of results direcotries, or list of result directories.')
+                          help='File containing list of results direcotries, or list of result directories. '
+                               'May be omitted if --index is given, to use all dynamic results in the index.')
     required.add_argument('--output',
                           required=True, type=Path, metavar='<str>',
                           help='output folder')
@@ -51,6 +52,9 @@ def main():
     fl_contrast_args.add_argument('--reference-contrast', type=str,
                                   help='Divide all concentration betas and contrasts by this contrast. '
                                        'Applied after custom first level contrasts created.')
+    fl_contrast_args.add_argument('--reference-method', type=str, default='delta', choices=['delta', 'montecarlo'],
+                                  help="Calculation of the scaled covariance for --reference-contrast: "
+                                       "'delta' method (default) or 'montecarlo' sampling.")
 
     # HIGHER-LEVEL / GROUP CONTRAST ARGUMENTS
     ga_contrast_args.add_argument('--hl-design', type=Path, metavar='<FILE>',
@@ -63,8 +67,17 @@ def main():
                                   help='Names assigned to each contrast specified by hl-contrasts option')
     ga_contrast_args.add_argument('--hl-ftests', type=Path, metavar='<FILE>',
                                   help='FSL VEST file defining higher-level/group f-tests')
+    ga_contrast_args.add_argument('--hl-backend', type=str, default='native', choices=['native', 'flameo'],
+                                  help="Group analysis implementation: 'native' (in-process, default) "
+                                       "or 'flameo' (requires FSL, reference for validation).")
+    ga_contrast_args.add_argument('--hl-runmode', type=str, default='flame1', choices=['flame1', 'ols', 'fe'],
+                                  help="Group estimator: 'flame1' mixed effects (default), "
+                                       "'ols' ordinary least squares, or 'fe' fixed effects.")
 
     # ADDITIONAL OPTIONAL ARGUMENTS
+    optional.add_argument('--index', type=Path, metavar='<FILE>',
+                          help='Read results via this results index file, '
+                               'created or updated with any new or changed results directories.')
     optional.add_argument('--report', action="store_true",
                           help='output html report')
     optional.add_argument('--verbose', action="store_true",
@@ -76,6 +89,8 @@ def main():
 
     # Parse command-line arguments
     args = p.parse_args()
+    if args.data is None and args.index is None:
+        p.error('the following arguments are required: --data (or --index)')
 
     # ######################################################
     # DO THE IMPORTS AFTER PARSING TO SPEED UP HELP DISPLAY
@@ -87,6 +102,7 @@ def main():
     import pandas as pd
 
     import fsl_mrs.utils.fmrs_tools as fmrs
+    from fsl_mrs.utils.results_index import ResultsIndex
     from fsl.data.vest import loadVestFile
     # import datetime
     # ######################################################
@@ -141,6 +157,17 @@ def main():
         for con in contrasts:
             print(con.name)
 
+    # Load or update the results index
+    if args.index is not None:
+        index = ResultsIndex(args.index)
+        if args.data is None:
+            index.refresh(verbose=args.verbose)
+            args.data = index.folders(kind='dynamic')
+        else:
+            index.update(args.data, verbose=args.verbose)
+    else:
+        index = None
+
     # Do the work
     copes = []
     varcopes = []
@@ -155,14 +182,16 @@ def main():
             dd,
             contrasts=contrasts,
             metabolites_to_combine=args.combine,
-            output_dir=current_output)
+            output_dir=current_output,
+            index=index)
 
         # 2. Concentration parameter scaling
         if args.reference_contrast is not None:
             _, _, df, _ = fmrs.fmrs_internal_reference(
                 current_output,
                 args.reference_contrast,
-                output_dir=current_output)
+                output_dir=current_output,
+                method=args.reference_method)
 
         copes.append(df['mean'].to_numpy())
         varcopes.append(df['sd'].pow(2).to_numpy())
@@ -171,7 +200,7 @@ def main():
     copes = np.stack(copes)
     varcopes = np.stack(varcopes)
 
-    # 3. Pass to the FLAMEO wrapper
+    # 3. Group analysis, native GLM or the FLAMEO wrapper
 
     # Process second level matrices.
     if args.hl_design is not None:
@@ -194,14 +223,25 @@ def main():
     else:
         ftests_mat = None
 
-    p, z, out_cope, out_varcope, f = fmrs.flameo_wrapper(
-        copes,
-        varcopes,
-        design_mat=design_mat,
-        contrast_mat=contrast_mat,
-        covariance_mat=covariance_mat,
-        ftests=ftests_mat,
-        verbose=args.verbose)
+    if args.hl_backend == 'flameo':
+        p, z, out_cope, out_varcope, f = fmrs.flameo_wrapper(
+            copes,
+            varcopes,
+            design_mat=design_mat,
+            contrast_mat=contrast_mat,
+            covariance_mat=covariance_mat,
+            ftests=ftests_mat,
+            verbose=args.verbose,
+            runmode=args.hl_runmode)
+    else:
+        p, z, out_cope, out_varcope, f = fmrs.group_glm(
+            copes,
+            varcopes,
+            design_mat=design_mat,
+            contrast_mat=contrast_mat,
+            covariance_mat=covariance_mat,
+            ftests=ftests_mat,
+            runmode=args.hl_runmode)
 
     # Save main results
     # 1. Form output dataframe
@@ -81,6 +81,15 @@ def main():
                           help='structural image (for report)')
     optional.add_argument('--report', action="store_true",
                           help='output html report')
+    optional.add_argument('--light-report', action="store_true",
+                          help='Create a light html report: figures are stored compactly, the plotly library is '
+                               'loaded from a shared local copy and optional panels are omitted.')
+    optional.add_argument('--report-assets', type=str, default=None, metavar='DIR',
+                          help='Location of the plotly library shared by light reports. '
+                               'Defaults to the output folder.')
+    optional.add_argument('--report-panels', type=str, nargs='+', default=None,
+                          choices=['uncertainty', 'basis', 'metabs', 'correlations'],
+                          help='Optional report panels to include. Defaults to all, or none for light reports.')
     optional.add_argument('--verbose', action="store_true",
                           help='Print verbose info')
     optional.add_argument('--overwrite', action="store_true",
@@ -103,11 +112,33 @@ def main():
         nargs=3,
         metavar=('X', 'Y', 'Z'),
         help='Spatial index of an MRSI grid to fit. Ignored if single voxel. Defaults to all voxels.')
+    optional.add_argument(
+        '--parallel',
+        type=str,
+        default='fsl_sub',
+        choices=['fsl_sub', 'off', 'local'],
+        help="Control MRSI parallelisation. Ignored if single voxel. Set to: "
+             "'fsl_sub' (default), 'off', or 'local'. "
+             "'fsl_sub' submits one job per voxel, "
+             "'off' fits voxels serially in this process, "
+             "'local' distributes voxels over local CPUs. "
+             "With 'off' and 'local' data, basis and configuration are loaded once "
+             "and results are written directly to NIfTI images.")
+    optional.add_argument(
+        '--parallel-workers',
+        type=int,
+        default=None,
+        help="Number of local workers to use with '--parallel local'.")
     optional.add_argument(
         '--fslsub-queue',
         type=str,
         default=None,
         help='Specify the queue that MRSI subtasks should be submitted to.')
+    optional.add_argument('--compression', type=str, default=None,
+                          choices=['gzip', 'none', 'fast', 'threaded'],
+                          help='Compression of NIfTI outputs: gzip (default), none (uncompressed .nii), '
+                               'fast (fastest available gzip) or threaded (multi-threaded gzip). '
+                               'The default can be set with the FSLMRS_COMPRESSION environment variable.')
     optional.add_argument(
         '--merge_spatial',
         action="store_true",
@@ -118,6 +149,10 @@ def main():
     # Parse command-line arguments
     args = p.parse_args()
 
+    # Set compression of NIfTI outputs
+    from fsl_mrs.utils import nifti_compression
+    nifti_compression.set_compression(args.compression)
+
     if args.merge_spatial:
         merge_mrsi_results(args)
         return
@@ -135,7 +170,6 @@ def main():
     from fsl_mrs.utils import mrs_io
     from fsl_mrs.utils import report
     from fsl_mrs.utils import plotting
-    from fsl_mrs.utils import misc
     import datetime
     # ######################################################
     if not args.verbose:
@@ -183,7 +217,13 @@ def main():
     verbose_print(f'data tags  : {data.dim_tags}')
 
     is_mrsi = np.prod(data.shape[:3]) > 1
-    if is_mrsi and args.spatial_index is None:
+    if is_mrsi and args.spatial_index is None and args.parallel in ('off', 'local'):
+        # MRSI and no index specified, fit all voxels in this process
+        verbose_print('Data is MRSI, fitting voxels in-process.')
+        fit_mrsi_in_process(args, data, out_dir, verbose_print)
+        return
+
+    elif is_mrsi and args.spatial_index is None:
         # MRSI and no index specified
         verbose_print('Data is MRSI, spawning per-voxel fitting jobs.')
         import fsl_sub
@@ -244,40 +284,14 @@ def main():
         mrs.check_Basis(repair=True)
 
     # Get dynmrs time variables
-    def load_tvar_file(fp):
-        if fp.suffix in ['.csv', ]:
-            return np.loadtxt(fp, delimiter=',')
-        else:
-            return np.loadtxt(fp)
-
-    if len(args.time_variables) == 1:
-        time_variables = load_tvar_file(args.time_variables[0])
-    else:
-        time_variables = [load_tvar_file(v) for v in args.time_variables]
+    time_variables = load_time_variables(args.time_variables)
 
     # Do the fitting here
     verbose_print('--->> Start fitting\n\n')
     start = time.time()
 
-    # Parse metabolite groups
-    metab_groups = misc.parse_metab_groups(mrslist[0], args.metab_groups)
-
     # Fitting Arguments
-    Fitargs = {'ppmlim': args.ppmlim,
-               'baseline': args.baseline,
-               'baseline_order': args.baseline_order,
-               'metab_groups': metab_groups,
-               }
-
-    # Choose fitting lineshape model
-    if args.lorentzian and args.free_shift:
-        Fitargs['model'] = 'free_shift_lorentzian'
-    elif args.lorentzian:
-        Fitargs['model'] = 'lorentzian'
-    elif args.free_shift:
-        Fitargs['model'] = 'free_shift'
-    else:
-        Fitargs['model'] = 'voigt'
+    Fitargs = form_fit_args(args, mrslist[0])
 
     # Now create a dynmrs object
     # This is the main class that knows how to map between
@@ -347,13 +361,13 @@ def main():
         pred_data = pred_data.reshape((1, 1, 1) + pred_data.shape)
 
         # Create NIfTI-MRS
-        from fsl_mrs.core.nifti_mrs import create_nmrs
+        from fsl_mrs.core.nifti_mrs import gen_nifti_mrs
         # If this is going to be merged don't worry about getting the affine right.
         if is_mrsi:
             affine = None
         else:
             affine = data.voxToWorldMat
-        pred = create_nmrs.gen_nifti_mrs(
+        pred = gen_nifti_mrs(
             pred_data,
             data.dwelltime,
             data.spectrometer_frequency[0],
@@ -382,7 +396,251 @@ def main():
             configfile=args.dyn_config,
             tvarfiles=t_varFiles,
             date=datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
-            location_fig=location_fig)
+            location_fig=location_fig,
+            light=args.light_report,
+            assets=args.report_assets,
+            panels=args.report_panels)
+
+    verbose_print('\n\n\nDone.')
+
+
+def load_time_variables(tvar_files):
+    """Load the dynamic time variables from file(s).
+
+    :param tvar_files: List of paths to .csv or numpy readable text files
+    :type tvar_files: list of pathlib.Path
+    :return: Single time variable array, or list of arrays if multiple files
+    :rtype: numpy.ndarray or list
+    """
+    import numpy as np
+
+    def load_tvar_file(fp):
+        if fp.suffix in ['.csv', ]:
+            return np.loadtxt(fp, delimiter=',')
+        else:
+            return np.loadtxt(fp)
+
+    if len(tvar_files) == 1:
+        return load_tvar_file(tvar_files[0])
+    else:
+        return [load_tvar_file(v) for v in tvar_files]
+
+
+def form_fit_args(args, mrs):
+    """Form the dynMRS fitting arguments from the command line arguments.
+
+    :param args: Argparse arguments object
+    :param mrs: MRS object used to interpret the metabolite groups
+    :type mrs: fsl_mrs.core.MRS
+    :return: Fitting arguments to pass to dynMRS
+    :rtype: dict
+    """
+    from fsl_mrs.utils import misc
+
+    # Parse metabolite groups
+    metab_groups = misc.parse_metab_groups(mrs, args.metab_groups)
+
+    Fitargs = {'ppmlim': args.ppmlim,
+               'baseline': args.baseline,
+               'baseline_order': args.baseline_order,
+               'metab_groups': metab_groups,
+               }
+
+    # Choose fitting lineshape model
+    if args.lorentzian and args.free_shift:
+        Fitargs['model'] = 'free_shift_lorentzian'
+    elif args.lorentzian:
+        Fitargs['model'] = 'lorentzian'
+    elif args.free_shift:
+        Fitargs['model'] = 'free_shift'
+    else:
+        Fitargs['model'] = 'voigt'
+
+    return Fitargs
+
+
+def fit_voxel(fids, basis, mrs_kwargs, time_variables, config_file, fit_args, save_fit=False):
+    """Run the dynamic fit of a single MRSI voxel.
+
+    :param fids: Voxel FIDs, shape points x time points
+    :type fids: numpy.ndarray
+    :param basis: Basis object shared between voxels
+    :type basis: fsl_mrs.core.basis.Basis
+    :param mrs_kwargs: Acquisition information ('bw', 'cf', 'nucleus') used to construct MRS objects
+    :type mrs_kwargs: dict
+    :param time_variables: Dynamic time variables
+    :param config_file: Path to the dynamic configuration file
+    :param fit_args: Fitting arguments passed to dynMRS
+    :type fit_args: dict
+    :param save_fit: Also return the predicted fit, defaults to False
+    :type save_fit: bool, optional
+    :return: Free parameter mean and standard deviation, mapped parameter mean and standard deviation,
+        and the prediction (or None), as numpy arrays.
+    :rtype: tuple
+    """
+    import numpy as np
+    from fsl_mrs.core import MRS
+    from fsl_mrs.dynamic import dynMRS
+
+    mrslist = [MRS(FID=fid, basis=basis, **mrs_kwargs) for fid in fids.T]
+    for mrs in mrslist:
+        mrs.check_Basis(repair=True)
+
+    dyn = dynMRS(
+        mrslist,
+        time_variables,
+        config_file=config_file,
+        rescale=False,
+        **fit_args)
+    dyn_res = dyn.fit(init=dyn.initialise())
+
+    if save_fit:
+        pred = np.stack([res.pred for res in dyn_res.reslist]).T
+    else:
+        pred = None
+
+    return (dyn_res.x,
+            dyn_res.std_free.to_numpy(),
+            dyn_res.dataframe_mapped.to_numpy(),
+            dyn_res.std_mapped.to_numpy(),
+            pred)
+
+
+def fit_mrsi_in_process(args, data, out_dir, verbose_print):
+    """Fit all MRSI voxels in this process, either serially or over local workers.
+
+    Data, basis, time variables and configuration are loaded once and
+    per-voxel results are written into preallocated arrays which are saved as NIfTI images:
+    free parameter means (mean/) and variances (var/), mapped parameter means (mapped_mean/)
+    and variances (mapped_var/), and optionally the fit (fit.nii.gz).
+
+    :param args: Argparse arguments object
+    :param data: MRSI NIfTI-MRS data
+    :type data: fsl_mrs.core.nifti_mrs.NIFTI_MRS
+    :param out_dir: Output directory
+    :type out_dir: pathlib.Path
+    :param verbose_print: Printing function
+    """
+    import json
+    from functools import partial
+    import numpy as np
+    import nibabel as nib
+    from fsl.data.image import Image
+    from fsl_mrs.utils import mrs_io, nifti_compression
+    from fsl_mrs.dynamic import dynMRS
+
+    basis = mrs_io.read_basis(args.basis)
+    time_variables = load_time_variables(args.time_variables)
+
+    tmp_mrsi = data.mrs()[0]
+    if args.spatial_mask is not None:
+        tmp_mrsi.set_mask(
+            Image(args.spatial_mask)[:])
+    indices = [tuple(idx) for idx in tmp_mrsi.get_indicies_in_order()]
+
+    # Ensure that rescaling is consistent across voxels
+    mrsi_data_scale_factor = 100.0 / np.linalg.norm(data[:])
+    fid_data = data[:] * mrsi_data_scale_factor
+    fid_data = fid_data.reshape(fid_data.shape[:4] + (-1, ))
+
+    mrs_kwargs = {
+        'bw': data.bandwidth,
+        'cf': data.spectrometer_frequency[0],
+        'nucleus': data.nucleus[0]}
+
+    # Form a template dynamic object from the first voxel
+    # to check the configuration and size the output arrays
+    template_list = data.mrs(basis=basis, spatial_index=indices[0])
+    for mrs in template_list:
+        mrs.check_Basis(repair=True)
+    Fitargs = form_fit_args(args, template_list[0])
+    template = dynMRS(
+        template_list,
+        time_variables,
+        config_file=args.dyn_config,
+        rescale=False,
+        **Fitargs)
+    free_names = template.free_names
+    mapped_names = template.mapped_names
+    ntimes = template.vm.ntimes
+
+    verbose_print(f'Fitting {len(indices)} voxels.')
+    func = partial(
+        fit_voxel,
+        mrs_kwargs=mrs_kwargs,
+        time_variables=time_variables,
+        config_file=args.dyn_config,
+        fit_args=Fitargs,
+        save_fit=args.save_fit)
+
+    if args.parallel == 'off':
+        from tqdm import tqdm
+        results = [func(fid_data[idx], basis) for idx in tqdm(indices)]
+    else:
+        import multiprocessing as mp
+        from dask.distributed import Client, progress
+        if args.parallel_workers:
+            n_workers = args.parallel_workers
+        else:
+            n_workers = mp.cpu_count() - 1
+        verbose_print(f'    Parallelising over {n_workers} workers ')
+        client = Client(n_workers=n_workers)
+        basis_future = client.scatter(basis, broadcast=True)
+        result_futures = client.map(
+            func,
+            [fid_data[idx] for idx in indices],
+            basis=basis_future)
+        progress(result_futures, notebook=False)
+        results = client.gather(result_futures)
+        client.close()
+
+    # Write results into preallocated arrays
+    spatial_shape = data.shape[:3]
+    free_mean = np.zeros(spatial_shape + (len(free_names), ), dtype=float)
+    free_var = np.zeros_like(free_mean)
+    mapped_mean = np.zeros(spatial_shape + (ntimes, len(mapped_names)), dtype=float)
+    mapped_var = np.zeros_like(mapped_mean)
+    if args.save_fit:
+        pred_data = np.zeros(fid_data.shape, dtype=data[:].dtype)
+    for idx, (xf, sf, xm, sm, pred) in zip(indices, results):
+        free_mean[idx] = xf
+        free_var[idx] = sf ** 2
+        mapped_mean[idx] = xm
+        mapped_var[idx] = sm ** 2
+        if args.save_fit:
+            pred_data[idx] = pred / mrsi_data_scale_factor
+
+    verbose_print(f'--->> Saving output files to {str(out_dir)}\n')
+
+    def save_param_images(arr, names, folder):
+        folder.mkdir(exist_ok=True)
+        for pdx, param in enumerate(names):
+            nifti_compression.save_nifti(
+                nib.Nifti1Image(arr[..., pdx], data.voxToWorldMat),
+                folder / f'{param}.nii.gz')
+
+    save_param_images(free_mean, free_names, out_dir / 'mean')
+    save_param_images(free_var, free_names, out_dir / 'var')
+    save_param_images(mapped_mean, mapped_names, out_dir / 'mapped_mean')
+    save_param_images(mapped_var, mapped_names, out_dir / 'mapped_var')
+
+    if args.save_fit:
+        from fsl_mrs.core.nifti_mrs import gen_nifti_mrs
+        pred = gen_nifti_mrs(
+            pred_data.reshape(data.shape),
+            data.dwelltime,
+            data.spectrometer_frequency[0],
+            nucleus=data.nucleus[0],
+            dim_tags=data.dim_tags,
+            affine=data.voxToWorldMat)
+        pred.save(out_dir / 'fit.nii.gz')
+
+    # Save chosen arguments
+    with open(out_dir / "options.txt", "w") as f:
+        var_print = {key: str(val) if isinstance(val, Path) else val
+                     for key, val in vars(args).items()}
+        var_print['time_variables'] = [str(val) for val in args.time_variables]
+        f.write(json.dumps(var_print))
 
     verbose_print('\n\n\nDone.')
 
@@ -392,8 +650,8 @@ def merge_mrsi_results(args):
 
     :param args: Argparse arguments object
     """
-    from fsl_mrs.utils import mrs_io
-    from fsl.data.image import Image
+    from fsl_mrs.utils import mrs_io, nifti_compression
+    import nibabel as nib
     import numpy as np
     import pandas as pd
 
@@ -419,40 +677,36 @@ def merge_mrsi_results(args):
     var_df = pd.DataFrame.from_dict(var_data).T
 
     # Now save to NIfTI images
-    def empty_img():
-        return Image(
-            np.zeros(original_data.shape[:3], dtype=float),
-            xform=original_data.voxToWorldMat)
-
     def form_img(df, key):
-        cimg = empty_img()
+        cimg = np.zeros(original_data.shape[:3], dtype=float)
         for idx, val in df[key].items():
             idx = [int(x) for x in idx.split('_')]
             cimg[idx[0], idx[1], idx[2]] = val
 
-        return cimg
+        return nib.Nifti1Image(cimg, original_data.voxToWorldMat)
 
     out_dir_mean = indiv_path / '..' / 'mean'
     out_dir_mean.mkdir(exist_ok=True)
     for param in mean_df:
-        form_img(mean_df, param).save(out_dir_mean / f'{param}.nii.gz')
+        nifti_compression.save_nifti(form_img(mean_df, param), out_dir_mean / f'{param}.nii.gz')
 
     out_dir_var = indiv_path / '..' / 'var'
     out_dir_var.mkdir(exist_ok=True)
     for param in var_df:
-        form_img(var_df, param).save(out_dir_var / f'{param}.nii.gz')
+        nifti_compression.save_nifti(form_img(var_df, param), out_dir_var / f'{param}.nii.gz')
 
     # Combine the fits to a single MRSI object
     if args.save_fit:
-        from fsl_mrs.core.nifti_mrs import create_nmrs
+        from fsl_mrs.core.nifti_mrs import gen_nifti_mrs
         pred_data = np.zeros_like(original_data[:])
-        for pp in indiv_path.rglob('fit.nii.gz'):
+        fit_files = list(indiv_path.rglob('fit.nii.gz')) + list(indiv_path.rglob('fit.nii'))
+        for pp in fit_files:
             cdata = mrs_io.read_FID(pp)
             idx_str = pp.parent.stem
             idx = tuple([int(x) for x in idx_str.split('_')]) + (Ellipsis, )
             pred_data[idx] = cdata[0, 0, 0, :, :]
 
-        pred = create_nmrs.gen_nifti_mrs(
+        pred = gen_nifti_mrs(
             pred_data,
             original_data.dwelltime,
             original_data.spectrometer_frequency[0],
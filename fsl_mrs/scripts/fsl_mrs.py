@@ -165,6 +165,18 @@ def main():
                           help='Additional scaling modifier for external water referencing.')
     optional.add_argument('--report', action="store_true",
                           help='output html report')
+    optional.add_argument('--light-report', action="store_true",
+                          help='Create a light html report: figures are stored compactly, the plotly library is '
+                               'loaded from a shared local copy and optional panels are omitted.')
+    optional.add_argument('--report-assets', type=str, default=None, metavar='DIR',
+                          help='Location of the plotly library shared by light reports. '
+                               'Defaults to the output folder.')
+    optional.add_argument('--report-panels', type=str, nargs='+', default=None,
+                          choices=['uncertainty', 'basis', 'metabs', 'correlations'],
+                          help='Optional report panels to include. Defaults to all, or none for light reports.')
+    optional.add_argument('--defer-report', action="store_true",
+                          help='Save html report content without rendering. '
+                               'Render later with "fsl_mrs_proc render-reports --output <output>".')
     optional.add_argument('--verbose', action="store_true",
                           help='spit out verbose info')
     optional.add_argument('--overwrite', action="store_true",
@@ -471,15 +483,21 @@ def main():
 
     # Create interactive HTML report
     if args.report:
-        report.create_svs_report(
-            mrs,
-            res,
-            filename=args.output / 'report.html',
-            fidfile=args.data,
-            basisfile=args.basis,
-            h2ofile=args.h2o,
-            date=datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
-            location_fig=location_fig)
+        from contextlib import nullcontext
+        from fsl_mrs.utils.preproc.reporting import deferred_reports
+        with deferred_reports(record_dir=args.output) if args.defer_report else nullcontext():
+            report.create_svs_report(
+                mrs,
+                res,
+                filename=args.output / 'report.html',
+                fidfile=args.data,
+                basisfile=args.basis,
+                h2ofile=args.h2o,
+                date=datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
+                location_fig=location_fig,
+                light=args.light_report,
+                assets=args.report_assets,
+                panels=args.report_panels)
 
     verboseprint('\n\n\nDone.')
 
@@ -90,6 +90,20 @@ def main():
                           help='overwrite existing output folder')
     optional.add_argument('--report', action="store_true",
                           help='Generate report in output folder')
+    optional.add_argument('--report-workers', type=int, default=0, metavar='<int>',
+                          help='Render report figures in this many background processes, '
+                               'processed data is saved before the report is complete.')
+    optional.add_argument('--defer-reports', action="store_true",
+                          help='Save report content without rendering. '
+                               'Render later with "fsl_mrs_proc render-reports --output <output>".')
+    optional.add_argument('--workers', type=int, default=1, metavar='<int>',
+                          help='Number of processes used for processing steps which '
+                               'can be run in parallel (e.g. HLSVD). Default = 1.')
+    optional.add_argument('--compression', type=str, default=None,
+                          choices=['gzip', 'none', 'fast', 'threaded'],
+                          help='Compression of NIfTI outputs: gzip (default), none (uncompressed .nii), '
+                               'fast (fastest available gzip) or threaded (multi-threaded gzip). '
+                               'The default can be set with the FSLMRS_COMPRESSION environment variable.')
     optional.add('--config', required=False, is_config_file=True,
                  help='configuration file')
 
@@ -117,6 +131,7 @@ def main():
     from fsl_mrs.utils.preproc import nifti_mrs_proc
     from fsl_mrs.utils import plotting
     from fsl_mrs.utils import mrs_io
+    from fsl_mrs.utils import nifti_compression
     # ######################################################
 
     # Check if output folder exists
@@ -148,6 +163,17 @@ def main():
         # Will suppress report generation
         report_dir = None
 
+    # Take report rendering off the critical path if requested
+    report_capture = None
+    if args.report and (args.defer_reports or args.report_workers > 0):
+        from fsl_mrs.utils.preproc.reporting import begin_deferred_reports
+        report_capture = begin_deferred_reports(
+            workers=args.report_workers,
+            record_dir=args.output if args.defer_reports else None)
+
+    nifti_mrs_proc.set_workers(args.workers)
+    nifti_compression.set_compression(args.compression)
+
     # ######  Do the work #######
     verbose_print('Load the data....')
 
@@ -400,7 +426,17 @@ def main():
     final_wref.save(op.join(args.output, 'wref'))
 
     # Produce full html report
-    if args.report:
+    if args.report and report_capture is not None:
+        # Merge once background (or later deferred) rendering is complete
+        from fsl_mrs.utils.preproc.reporting import merge_report_directory, end_deferred_reports
+        verbose_print('Create report')
+        report_capture.submit(
+            merge_report_directory,
+            args.output,
+            op.join(args.output, 'metab'),
+            final=True)
+        end_deferred_reports()
+    elif args.report:
         import subprocess
         import glob
         verbose_print('Create report')
@@ -410,9 +446,9 @@ def main():
                          '-o', args.output,
                          '--delete'] + htmlfiles)
 
-        if args.t1 is not None:
-            fig = plotting.plot_world_orient(args.t1, args.data)
-            fig.savefig(op.join(args.output, 'voxel_location.png'))
+    if args.report and args.t1 is not None:
+        fig = plotting.plot_world_orient(args.t1, args.data)
+        fig.savefig(op.join(args.output, 'voxel_location.png'))
 
 
 if __name__ == '__main__':
@@ -144,6 +144,32 @@ def main():
     alignDparser.set_defaults(func=aligndiff)
     add_common_args(alignDparser)
 
+    # Model based alignment subcommand - frequency/phase alignment by spectral fitting
+    modalignparser = sp.add_parser('model-align', add_help=False,
+                                   help='Align FIDs by fitting a shared spectral model.')
+    modalign_group = modalignparser.add_argument_group('Model align arguments')
+    modalign_group.add_argument('--file', type=str, required=True,
+                                help='File to align, must have a single non-singleton higher dimension.')
+    modalign_group.add_argument('--basis', type=str, required=True, nargs='+',
+                                help='Basis spectra to fit. Either one basis, '
+                                     'or one per element of the dimension to align.')
+    modalign_group.add_argument('--ppm', type=float, nargs=2,
+                                metavar=('<lower-limit>', '<upper-limit>'),
+                                default=(0.2, 4.2),
+                                help='ppm limits of fitting window'
+                                     ' (default=0.2->4.2)')
+    modalign_group.add_argument('--model', type=str, default='voigt',
+                                choices=['voigt', 'lorentzian'],
+                                help='Spectral fitting model, default = voigt.')
+    modalign_group.add_argument('--baseline', type=str, default='poly, 1',
+                                help='Baseline option, as for fsl_mrs. Default = "poly, 1".')
+    modalign_group.add_argument('--apodize', type=float, default=0,
+                                help='Apodize data (Hz) for fitting only. Default = 0 (off).')
+    modalign_group.add_argument('--full-fit', action="store_true",
+                                help='Use full dynamic fitting rather than the faster shift and phase fit.')
+    modalignparser.set_defaults(func=model_align)
+    add_common_args(modalignparser)
+
     # ECC subcommand - eddy current correction
     eccparser = sp.add_parser('ecc', add_help=False,
                               help='Eddy current correction')
@@ -167,6 +193,11 @@ def main():
                              help='ppm limits of removal window.'
                                   ' Defaults to 4.5 to 4.8 ppm.'
                                   ' Includes (4.65 ppm) shift to TMS reference.')
+    hlsvd_group.add_argument('--hankel-size', type=int, default=None,
+                             help='Number of rows of the HLSVD Hankel matrix.'
+                                  ' Defaults to half the FID length.')
+    hlsvd_group.add_argument('--sparse', action="store_true",
+                             help='Use the sparse HLSVD decomposition.')
     hlsvdparser.set_defaults(func=remove)
     add_common_args(hlsvdparser)
 
@@ -183,6 +214,11 @@ def main():
     model_group.add_argument('--components', type=int,
                              default=5,
                              help='Number of components to model.')
+    model_group.add_argument('--hankel-size', type=int, default=None,
+                             help='Number of rows of the HLSVD Hankel matrix.'
+                                  ' Defaults to half the FID length.')
+    model_group.add_argument('--sparse', action="store_true",
+                             help='Use the sparse HLSVD decomposition.')
     modelparser.set_defaults(func=model)
     add_common_args(modelparser)
 
@@ -297,6 +333,9 @@ def main():
                              help='ppm limits of alignment window')
     phase_group.add_argument('--hlsvd', action="store_true",
                              help='Remove peaks outside the search area')
+    phase_group.add_argument('--hlsvd-single', action="store_true",
+                             help='With --hlsvd, remove peaks above and below the search area'
+                                  ' using a single decomposition rather than two successive passes.')
     phase_group.add_argument('--use_avg', action="store_true",
                              help='Use the average of higher dimensions to calculate phase.')
     phaseparser.set_defaults(func=phase)
@@ -392,9 +431,40 @@ def main():
                           help='Mask file, NIfTI formated, only align on voxels selected.')
     ml_group.add_argument('--beta', type=float, default=1E-5,
                           help='Regularisation scaling, default = 1E-5. Adjust to scale lipid removal strength')
+    ml_group.add_argument('--rank', type=int, default=None,
+                          help='Truncate the lipid basis to this number of principal components.'
+                               ' Default is no truncation.')
     ml_group.set_defaults(func=mrsi_lipid)
     add_common_args(mlipidparser)
 
+    # pipeline - run a recipe of processing steps in memory
+    pipelineparser = sp.add_parser(
+        'pipeline',
+        add_help=False,
+        help='Run a recipe of processing steps without writing intermediate files.')
+    pipe_group = pipelineparser.add_argument_group('Pipeline arguments')
+    pipe_group.add_argument('recipe', type=Path,
+                            help='YAML (or JSON) recipe listing the nifti_mrs_proc steps to run.')
+    pipe_group.add_argument('--file', type=str, required=True,
+                            help='File to process.')
+    pipelineparser.set_defaults(func=pipeline)
+    add_common_args(pipelineparser)
+
+    # render-reports - render reports deferred by --defer-reports
+    renderparser = sp.add_parser(
+        'render-reports',
+        add_help=False,
+        help='Render HTML reports saved for later by --defer-reports.')
+    render_group = renderparser.add_argument_group('Render arguments')
+    render_group.add_argument('--output', type=str, required=True,
+                              help='Output folder containing deferred report records.')
+    render_group.add_argument('--report-workers', type=int, default=1,
+                              help='Number of processes used to render reports.')
+    render_group.add_argument('--verbose', action="store_true",
+                              help='spit out verbose info')
+    render_group.add_argument('-h', '--help', action='help',
+                              help='show this help message and exit')
+
     # Parse command-line arguments
     args = p.parse_args()
 
@@ -402,6 +472,13 @@ def main():
     if args.verbose:
         splash(logo='mrs')
 
+    if args.subcommand == 'render-reports':
+        from fsl_mrs.utils.preproc.reporting import render_report_records
+        nrecords = render_report_records(args.output, workers=args.report_workers)
+        if args.verbose:
+            print(f'Rendered {nrecords} report(s) in {args.output}.')
+        return
+
     # Parse file arguments
     datafiles, reffiles = parsefilearguments(args)
 
@@ -424,6 +501,23 @@ def main():
     else:
         args.generateReports = None
 
+    # Take report rendering off the critical path if requested
+    defer_reports = args.generateReports is not None\
+        and (args.defer_reports or args.report_workers > 0)
+    if defer_reports:
+        from fsl_mrs.utils.preproc.reporting import begin_deferred_reports
+        begin_deferred_reports(
+            workers=args.report_workers,
+            record_dir=args.output if args.defer_reports else None)
+
+    # Set number of processes used by nifti_mrs_proc functions
+    from fsl_mrs.utils.preproc import nifti_mrs_proc
+    nifti_mrs_proc.set_workers(args.workers)
+
+    # Set compression of NIfTI outputs
+    from fsl_mrs.utils import nifti_compression
+    nifti_compression.set_compression(args.compression)
+
     # Call function - pass dict like view of args
     #  for compatibility with other modules
     dataout = args.func(dataList, vars(args))
@@ -436,6 +530,11 @@ def main():
     # Write data
     writeData(dataout, args)
 
+    # Wait for any background report rendering
+    if defer_reports:
+        from fsl_mrs.utils.preproc.reporting import end_deferred_reports
+        end_deferred_reports()
+
     # Output any additional arguments
     if additionalOutputs is not None:
         print(additionalOutputs)
@@ -469,6 +568,19 @@ def add_common_args(p):
     #                            ' Specify as indices counting from 0.')
     optional.add_argument('--allreports', action="store_true",
                           help='Generate reports for all inputs.')
+    optional.add_argument('--report-workers', type=int, default=0, metavar='<int>',
+                          help='Render reports in this many background processes, '
+                               'data is written before rendering completes.')
+    optional.add_argument('--defer-reports', action="store_true",
+                          help='Save report content without rendering. '
+                               'Render later with "fsl_mrs_proc render-reports --output <output>".')
+    optional.add_argument('--workers', type=int, default=1, metavar='<int>',
+                          help='Number of processes used to process independent voxels/indices. Default = 1.')
+    optional.add_argument('--compression', type=str, default=None,
+                          choices=['gzip', 'none', 'fast', 'threaded'],
+                          help='Compression of NIfTI outputs: gzip (default), none (uncompressed .nii), '
+                               'fast (fastest available gzip) or threaded (multi-threaded gzip). '
+                               'The default can be set with the FSLMRS_COMPRESSION environment variable.')
     # optional.add_argument('--conjugate', action="store_true",
     #                       help='apply conjugate to FID')
     optional.add_argument('--filename', type=str, metavar='<str>',
@@ -617,6 +729,37 @@ def align(dataobj, args):
     return datacontainer(aligned, dataobj.datafilename)
 
 
+def model_align(dataobj, args):
+    from fsl_mrs.utils.preproc import dyn_based_proc as dproc
+    from fsl_mrs.utils.mrs_io import read_basis
+
+    basis = [read_basis(bb) for bb in args['basis']]
+    if len(basis) == 1:
+        basis = basis[0]
+
+    fitargs = {'ppmlim': tuple(args['ppm']),
+               'baseline': args['baseline'],
+               'model': args['model']}
+    aligned, eps, phi, _ = dproc.align_by_dynamic_fit(
+        dataobj.data,
+        basis,
+        fitargs=fitargs,
+        verbose=args['verbose'],
+        apodize_hz=args['apodize'],
+        fast=not args['full_fit'])
+
+    if args['generateReports']:
+        dproc.align_by_dynamic_fit_report(
+            dataobj.data,
+            aligned,
+            eps,
+            phi,
+            ppmlim=fitargs['ppmlim'],
+            html=args['generateReports'])
+
+    return datacontainer(aligned, dataobj.datafilename)
+
+
 def aligndiff(dataobj, args):
     from fsl_mrs.utils.preproc import nifti_mrs_proc as preproc
 
@@ -651,6 +794,8 @@ def remove(dataobj, args):
 
     corrected = preproc.remove_peaks(dataobj.data,
                                      limits=args['ppm'],
+                                     hankel_size=args['hankel_size'],
+                                     sparse_algo=args['sparse'],
                                      report=args['generateReports'],
                                      report_all=args['allreports'])
 
@@ -663,6 +808,8 @@ def model(dataobj, args):
     modelled = preproc.hlsvd_model_peaks(dataobj.data,
                                          limits=args['ppm'],
                                          components=args['components'],
+                                         hankel_size=args['hankel_size'],
+                                         sparse_algo=args['sparse'],
                                          report=args['generateReports'],
                                          report_all=args['allreports'])
 
@@ -770,6 +917,7 @@ def phase(dataobj, args):
                                    args['ppm'],
                                    hlsvd=args['hlsvd'],
                                    use_avg=args['use_avg'],
+                                   hlsvd_refine=not args['hlsvd_single'],
                                    report=args['generateReports'],
                                    report_all=args['allreports'])
 
@@ -839,7 +987,9 @@ def conj(dataobj, args):
 
 def mrsi_align(dataobj, args):
     '''Function that applys frequency and/or phase correction to mrsi.'''
+    import nibabel as nib
     from fsl_mrs.utils.preproc import mrsi
+    from fsl_mrs.utils import nifti_compression
 
     if dataobj.data.shape[:3] == (1, 1, 1):
         raise ValueError('mrsi-align is not suitable for single voxel data.')
@@ -862,7 +1012,9 @@ def mrsi_align(dataobj, args):
             mask=mask,
             zpad_factor=args['zpad'])
         if args['save_params']:
-            shifts.save(op.join(args['output'], fname + '_shifts_hz.nii.gz'))
+            nifti_compression.save_nifti(
+                nib.Nifti1Image(shifts.data, shifts.voxToWorldMat),
+                op.join(args['output'], fname + '_shifts_hz.nii.gz'))
 
     if args['phase_correct']:
         data, phs = mrsi.mrsi_phase_corr(
@@ -870,7 +1022,9 @@ def mrsi_align(dataobj, args):
             mask=mask,
             ppmlim=args['ppm'])
         if args['save_params']:
-            phs.save(op.join(args['output'], fname + '_phase_deg.nii.gz'))
+            nifti_compression.save_nifti(
+                nib.Nifti1Image(phs.data, phs.voxToWorldMat),
+                op.join(args['output'], fname + '_phase_deg.nii.gz'))
 
     return datacontainer(data, dataobj.datafilename)
 
@@ -886,10 +1040,29 @@ def mrsi_lipid(dataobj, args):
         mrsi.lipid_removal_l2(
             dataobj.data,
             args['beta'],
-            lipid_mask=args['mask']),
+            lipid_mask=args['mask'],
+            rank=args['rank']),
         dataobj.datafilename)
 
 
+def pipeline(dataobj, args):
+    '''Run a recipe of nifti_mrs_proc steps on in-memory data.'''
+    from fsl_mrs.utils.preproc.pipeline import Pipeline
+
+    pipe = Pipeline.from_recipe(args['recipe'])
+    if args['verbose']:
+        print(pipe)
+
+    processed = pipe.run(
+        dataobj.data,
+        output=args['output'],
+        report=args['generateReports'],
+        report_all=args['allreports'],
+        verbose=args['verbose'])
+
+    return datacontainer(processed, dataobj.datafilename)
+
+
 def _float_or_array_arg(x):
     '''Return either a float or array loaded from a nifti image'''
     try:
@@ -1,4 +1,3 @@
-import json
 from copy import deepcopy
 from pathlib import Path
 from sys import stdout
@@ -22,6 +21,7 @@ from fsl_mrs.utils import results
 from fsl_mrs.utils import mrs_io
 from fsl_mrs.utils import misc
 from fsl_mrs.utils import plotting
+from fsl_mrs.utils.results_index import ResultsIndex, find_results
 from fsl_mrs.utils.baseline import Baseline
 
 
@@ -32,18 +32,23 @@ def main():
 
     parser.add_argument(
         'input_type',
-        choices=['dir', 'list'],
+        choices=['dir', 'list', 'index'],
         help='Select between input type')
     parser.add_argument(
         'input',
         type=Path,
         metavar='DIR or FILE',
-        help='Directory containing individual results directories '
-             'or Text file containing line-separated list of results directories.')
+        help='Directory containing individual results directories, '
+             'Text file containing line-separated list of results directories, '
+             'or results index file created with --index.')
 
     # ADDITONAL OPTIONAL ARGUMENTS
     parser.add_argument('-v', '--verbose',
                         required=False, action="store_true")
+    parser.add_argument('--index',
+                        required=False, type=Path, metavar='FILE',
+                        help='Store results in (or update) this index file. '
+                             'Subsequent launches only re-read new or changed results.')
     parser.add_argument('-p', '--port',
                         required=False,
                         type=int,
@@ -64,49 +69,51 @@ def main():
     1. The concentration.csv files
     2. The qc.csv files
     3. Load the all_parameters.csv and regenerate mrs/results objects
+    All tables are read via a results index, held in memory unless --index is specified.
     '''
 
     verbose = args.verbose
-    # Deal with the two inputs.
-    res_dir = []
-    if args.input_type == 'dir':
-        for fp in args.input.rglob('concentrations.csv'):
-            res_dir.append(fp.parent)
+    if args.input_type == 'index':
+        index = ResultsIndex(args.input)
+        index.refresh(verbose=verbose)
+        res_dir = index.folders(kind='svs')
     else:
-        with open(args.input) as fp:
-            res_dir = fp.read().splitlines()
-            res_dir = [Path(dir) for dir in res_dir]
+        index = ResultsIndex(':memory:' if args.index is None else args.index)
+        # Deal with the two inputs.
+        res_dir = []
+        if args.input_type == 'dir':
+            res_dir = find_results(args.input, kind='svs')
+        else:
+            with open(args.input) as fp:
+                res_dir = fp.read().splitlines()
+                res_dir = [Path(dir) for dir in res_dir]
+
+        # Check for duplicate names
+        # list(dict.fromkeys(x)) finds unique values preserving order
+        if len(list(dict.fromkeys(res_dir))) < len(res_dir):
+            raise ValueError('Input directories must not be duplicated.')
+
+        if verbose:
+            print('Updating results index.')
+        index.update(res_dir, verbose=verbose)
 
-    # Check for duplicate names
-    # list(dict.fromkeys(x)) finds unique values preserving order
-    if len(list(dict.fromkeys(res_dir))) < len(res_dir):
-        raise ValueError('Input directories must not be duplicated.')
+    if len(res_dir) == 0:
+        raise ValueError('No fsl_mrs results found.')
 
     # Look for common paths of the path
-    common_path = Path(op.commonpath(res_dir))
+    common_path = Path(op.commonpath([fp.resolve() for fp in res_dir]))
     # Form path names out of the remaining paths after anything common is removed
-    fit_names = [str(cpath.relative_to(common_path)) for cpath in res_dir]
+    fit_names = [str(cpath.resolve().relative_to(common_path)) for cpath in res_dir]
 
     # 1. Concentration.csv
     if verbose:
         print('Loading concentration data.')
-    all_conc = []
-    for fp in res_dir:
-        all_conc.append(pd.read_csv(fp / 'concentrations.csv', index_col=0, header=[0, 1]))
-    conc_df = pd.concat(all_conc, keys=fit_names, names=['dataset', 'Metabolite'])
-    col = conc_df.columns
-    col.names = [None, None]
-    conc_df.columns = col
-    conc_df = conc_df.reorder_levels(['Metabolite', 'dataset'], axis=0).sort_index()
+    conc_df = index.concentrations(res_dir, names=fit_names)
 
     # 2. qc.csv
     if verbose:
         print('Loading QC data.')
-    all_qc = []
-    for fp in res_dir:
-        all_qc.append(pd.read_csv(fp / 'qc.csv', index_col=0, header=0))
-    qc_df = pd.concat(all_qc, keys=fit_names, names=['dataset', 'Metabolite'])
-    qc_df = qc_df.reorder_levels(['Metabolite', 'dataset'], axis=0).sort_index()
+    qc_df = index.qc(res_dir, names=fit_names)
 
     # 3. Load the all_parameters.csv and regenerate mrs/results objects
     if verbose:
@@ -115,11 +122,10 @@ def main():
     res_store = {}
     n_data = len(res_dir)
     for idx, (fp, name) in enumerate(zip(res_dir, fit_names)):
-        param_df = pd.read_csv(fp / 'all_parameters.csv')
+        param_df = index.table('parameters', fp)
 
         # Read options.txt
-        with open(fp / 'options.txt', "r") as f:
-            orig_args = json.loads(f.readline())
+        orig_args = index.options(fp)
 
         # Load data into mrs object
         if (fp / 'data.nii.gz').exists():
@@ -118,10 +118,27 @@ def main():
                                ' No effect without setting --wref_metabolite.')
     optional.add_argument('--h2o_scale', type=float, default=1.0,
                           help='Additional scaling modifier for external water referencing.')
+    optional.add_argument('--voxelwise_quant', action="store_true",
+                          help='Fit the water reference of each voxel alongside its metabolite fit,'
+                               ' rather than fitting all water references together after fitting.')
     optional.add_argument('--report', action="store_true",
                           help='output html report')
+    optional.add_argument('--light-report', action="store_true",
+                          help='Create a light html report: figures are stored compactly, the plotly library is '
+                               'loaded from a shared local copy and optional panels are omitted.')
+    optional.add_argument('--report-assets', type=str, default=None, metavar='DIR',
+                          help='Location of the plotly library shared by light reports. '
+                               'Defaults to the output folder.')
+    optional.add_argument('--report-panels', type=str, nargs='+', default=None,
+                          choices=['uncertainty', 'basis', 'metabs', 'correlations'],
+                          help='Optional report panels to include. Defaults to all, or none for light reports.')
     optional.add_argument('--output_correlations', action="store_true",
                           help='Output correlation matricies for each fit.')
+    optional.add_argument('--compression', type=str, default=None,
+                          choices=['gzip', 'none', 'fast', 'threaded'],
+                          help='Compression of NIfTI outputs: gzip (default), none (uncompressed .nii), '
+                               'fast (fastest available gzip) or threaded (multi-threaded gzip). '
+                               'The default can be set with the FSLMRS_COMPRESSION environment variable.')
     optional.add_argument('--verbose', action="store_true",
                           help='spit out verbose info')
     optional.add_argument('--overwrite', action="store_true",
@@ -179,9 +196,11 @@ def main():
     from functools import partial
     import multiprocessing as mp
     from dask.distributed import Client, progress
-    from fsl_mrs.utils import misc, mrs_io
+    from fsl_mrs.utils import misc, mrs_io, nifti_compression
     # ######################################################
 
+    nifti_compression.set_compression(args.compression)
+
     # Check if output folder exists
     overwrite = args.overwrite
     if os.path.exists(args.output):
@@ -331,10 +350,17 @@ def main():
             fidfile=args.data,
             basisfile=args.basis,
             h2ofile=args.h2o,
-            date=datetime.datetime.now().strftime("%Y-%m-%d %H:%M"))
+            date=datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
+            light=args.light_report,
+            assets=args.report_assets,
+            panels=args.report_panels)
 
     warnings.filterwarnings("ignore")
-    func = partial(runvoxel, args=args, Fitargs=Fitargs, echotime=echotime, repetition_time=repetition_time)
+    # Water quantification of all voxels is run together after fitting
+    batch_quant = H2O is not None and echotime is not None and repetition_time is not None\
+        and not args.voxelwise_quant
+    func = partial(runvoxel, args=args, Fitargs=Fitargs, echotime=echotime, repetition_time=repetition_time,
+                   batch_quant=batch_quant)
 
     if args.parallel == "off" or args.single_proc:
         # client = Client(n_workers=1, threads_per_worker=1)
@@ -369,6 +395,10 @@ def main():
     else:
         raise ValueError("--parallel should be 'off', 'local', 'cluster'.")
 
+    if batch_quant:
+        verboseprint('--->> Water quantification\n')
+        batch_quantify(mrsi, results, args, echotime, repetition_time)
+
     # Save output files
     verboseprint(f'--->> Saving output files to {args.output}\n')
 
@@ -411,7 +441,7 @@ def main():
             NIFTI_MRS(data, header=mrsi_data.header).save(fname)
         else:
             img = nib.Nifti1Image(data, mrsi_data.voxToWorldMat)
-            nib.save(img, fname)
+            nifti_compression.save_nifti(img, fname)
 
     metabs = results[0][0].metabs
     for scale in scalings:
@@ -580,13 +610,13 @@ def main():
             1005,  # NIFTI_INTENT_SYMMATRIX
             params=(corr_list[0].shape[0], ),
             name='MRS fit correlation matrix')
-        nib.save(corr_img, file_nm)
+        nifti_compression.save_nifti(corr_img, file_nm)
 
     verboseprint('\n\n\nDone.')
 
 
-def runvoxel(mrs_in, args, Fitargs, echotime, repetition_time):
-    from fsl_mrs.utils import fitting, quantify
+def runvoxel(mrs_in, args, Fitargs, echotime, repetition_time, batch_quant=False):
+    from fsl_mrs.utils import fitting
 
     mrs, index, tissue_seg = mrs_in
     try:
@@ -605,25 +635,13 @@ def runvoxel(mrs_in, args, Fitargs, echotime, repetition_time):
                     ' no absolute quantification will be performed.',
                     UserWarning)
             res.calculateConcScaling(mrs, internal_reference=args.internal_ref, verbose=args.verbose)
+        elif batch_quant:
+            # Water scaling is calculated for all voxels together by batch_quantify
+            res.calculateConcScaling(mrs, internal_reference=args.internal_ref, verbose=args.verbose)
         else:
-            # Form quantification information
-            q_info = quantify.QuantificationInfo(
-                echotime,
-                repetition_time,
-                mrs.names,
-                mrs.centralFrequency / 1E6,
-                water_ref_metab=args.wref_metabolite,
-                water_ref_metab_protons=args.ref_protons,
-                water_ref_metab_limits=args.ref_int_limits)
-
-            if tissue_seg:
-                q_info.set_fractions(tissue_seg)
-            if args.h2o_scale:
-                q_info.add_corr = args.h2o_scale
-
             res.calculateConcScaling(
                 mrs,
-                quant_info=q_info,
+                quant_info=form_quant_info(mrs, tissue_seg, args, echotime, repetition_time),
                 internal_reference=args.internal_ref,
                 verbose=args.verbose)
         # Combine metabolites.
@@ -636,6 +654,55 @@ def runvoxel(mrs_in, args, Fitargs, echotime, repetition_time):
     return res, index
 
 
+def form_quant_info(mrs, tissue_seg, args, echotime, repetition_time):
+    """Form quantification information for a voxel"""
+    from fsl_mrs.utils import quantify
+    q_info = quantify.QuantificationInfo(
+        echotime,
+        repetition_time,
+        mrs.names,
+        mrs.centralFrequency / 1E6,
+        water_ref_metab=args.wref_metabolite,
+        water_ref_metab_protons=args.ref_protons,
+        water_ref_metab_limits=args.ref_int_limits)
+
+    if tissue_seg:
+        q_info.set_fractions(tissue_seg)
+    if args.h2o_scale:
+        q_info.add_corr = args.h2o_scale
+    return q_info
+
+
+def batch_quantify(mrsi, results, args, echotime, repetition_time):
+    """Water scaling of all voxel results, fitting the water references together."""
+    from fsl_mrs.utils import quantify
+
+    mrs_list = []
+    q_info_list = []
+    for _, index in results:
+        mrs = mrsi.mrs_by_index(index)
+        tissue_seg = mrsi.seg_by_index(index) if mrsi.tissue_seg_loaded else None
+        mrs_list.append(mrs)
+        q_info_list.append(form_quant_info(mrs, tissue_seg, args, echotime, repetition_time))
+
+    molality, molarity, ref_info = quantify.quantifyWaterBatch(
+        mrs_list,
+        [res for res, _ in results],
+        q_info_list,
+        verbose=args.verbose)
+
+    for (res, index), mrs, q_info, scaling in zip(results, mrs_list, q_info_list, zip(molality, molarity, ref_info)):
+        try:
+            res.calculateConcScaling(
+                mrs,
+                quant_info=q_info,
+                internal_reference=args.internal_ref,
+                water_scaling=scaling)
+        except Exception as exc:
+            print(f'Exception ({exc}) occured in index {index}.')
+            raise exc
+
+
 def str_or_int_arg(x):
     try:
         return int(x)
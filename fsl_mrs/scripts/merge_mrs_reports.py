@@ -10,10 +10,6 @@
 
 # Quick imports
 import argparse
-from bs4 import BeautifulSoup
-import copy
-import os.path as op
-from os import remove
 
 
 def main():
@@ -48,37 +44,12 @@ def main():
     # Parse command-line arguments
     args = parser.parse_args()
 
-    # Sort files by filename
-    files = sorted(args.files)
-
-    soups = []
-    for f in files:
-        with open(f) as fp:
-            soups.append(BeautifulSoup(fp, features="html.parser"))
-
-    # Append other body elements to the first.
-    # Only use the second element of the bodies.
-    # WTC: Not sure why (1st and 3rd are just newlines)
-    outsoup = copy.deepcopy(soups[0])
-    for ss in soups[1:]:
-        toappend = ss.body.contents[1]
-        toappend.header.clear()
-        outsoup.body.append(toappend)
-
-    description = args.description
-    outsoup.body.header.h1.string = f"Combined report for {description}"
-    outsoup.body.header.p.string = "Combined using merge_mrs_reports." \
-                                   " Part of the FSL-MRS package."
-
-    outfile = op.join(args.output, args.filename)
-    with open(outfile, 'w') as fout:
-        fout.write(str(outsoup))
-    if op.exists(outfile) and op.getsize(outfile) > 0:
-        if args.delete:
-            for htmlfile in files:
-                remove(htmlfile)
-    else:
-        raise IOError('Merged file not written successfully.')
+    from fsl_mrs.utils.preproc.reporting import merge_reports
+    merge_reports(args.files,
+                  args.description,
+                  output=args.output,
+                  filename=args.filename,
+                  delete=args.delete)
 
 
 if __name__ == '__main__':
@@ -163,6 +163,37 @@ def test_dynMRS_fit(fixed_ratio_mrs):
     assert np.allclose(concs, [1, 1, 1, 1], atol=0.1)
 
 
+def test_full_jac(fixed_ratio_mrs):
+    mrs_list = fixed_ratio_mrs
+
+    dyn_obj = dyn.dynMRS(
+        mrs_list,
+        [0, 1],
+        'fsl_mrs/tests/testdata/dynamic/simple_linear_model.py',
+        model='lorentzian',
+        baseline_order=0,
+        metab_groups=[0, 0],
+        rescale=False)
+    x = dyn_obj.vm.mapped_to_free(dyn_obj.initialise(indiv_init=None)['x'])
+
+    def fwd(x):
+        mapped = dyn_obj.vm.free_to_mapped(x)
+        return np.concatenate([dyn_obj.forward[t](mapped[t]) for t in range(dyn_obj.vm.ntimes)])
+
+    num_jac = []
+    for idx in range(x.size):
+        step = 1E-6 * max(1, abs(x[idx]))
+        xu, xl = x.copy(), x.copy()
+        xu[idx] += step
+        xl[idx] -= step
+        num_jac.append((fwd(xu) - fwd(xl)) / (2 * step))
+    num_jac = np.asarray(num_jac)
+
+    jac = dyn_obj.full_jac(x)
+    assert jac.shape == num_jac.shape
+    assert np.allclose(jac, num_jac, rtol=1E-4, atol=1E-6 * np.abs(num_jac).max())
+
+
 def test_dynMRS_fit_mcmc(fixed_ratio_mrs):
     mrs_list = fixed_ratio_mrs
 
@@ -142,3 +142,18 @@ def test_get_fcns(vm_obj):
     assert vm_obj.get_init_fcn(vm_obj.mapped_parameters[1]).__name__ == 'default_init'
 
 # TO DO test mapped_to_free
+
+
+def test_free_to_mapped_grad(vm_obj):
+    from fsl_mrs.utils.misc import gradient
+    params = np.asarray([
+        1,
+        1, 0, 1,
+        1, 1,
+        1, 1, 1, 1, 1, 1], dtype=float)
+
+    grad = vm_obj.free_to_mapped_grad(params)
+    assert grad.shape == (vm_obj.ntimes, vm_obj.nmapped, vm_obj.nfree)
+
+    num_grad = np.transpose(gradient(params, vm_obj.free_to_mapped), (1, 2, 0))
+    assert np.allclose(grad, num_grad, atol=1E-5)
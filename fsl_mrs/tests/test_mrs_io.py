@@ -165,3 +165,76 @@ def test_load_symlink(tmp_path):
     import os.path as op
     assert op.islink(tmp_path / 'test1.nii')
     assert mrsio.read_FID(tmp_path / 'test1.nii').shape == (1, 1, 1, 4096)
+
+
+def test_compiled_basis(tmp_path):
+    """Test compilation and (memory-mapped) loading of a binary basis."""
+    from fsl_mrs.utils.mrs_io import basis_cache
+
+    rng = np.random.default_rng(0)
+    hdrs = [{'centralFrequency': 123.2E6, 'bandwidth': 4000, 'dwelltime': 1 / 4000, 'fwhm': None}] * 3
+    fids = rng.normal(size=(1024, 3)) + 1j * rng.normal(size=(1024, 3))
+    Basis(fids, ['a', 'b', 'c'], hdrs).save(tmp_path / 'basis')
+    ref = mrsio.read_basis(tmp_path / 'basis')
+
+    out = mrsio.compile_basis(tmp_path / 'basis')
+    assert out == tmp_path / 'basis' / 'basis.fslbasis'
+
+    # Compiled basis used in place of source
+    compiled = mrsio.read_basis(tmp_path / 'basis')
+    assert isinstance(compiled._raw_fids, np.memmap)
+    assert compiled.names == ref.names
+    assert np.array_equal(compiled.original_basis_array, ref.original_basis_array)
+    assert compiled.original_dwell == ref.original_dwell
+    assert compiled.cf == ref.cf
+
+    # Or loaded directly
+    direct = Basis.from_file(out)
+    assert np.array_equal(direct.original_basis_array, ref.original_basis_array)
+
+    # In memory changes don't modify the file
+    compiled._raw_fids[:, 0] = 0
+    assert np.array_equal(mrsio.read_basis(out).original_basis_array, ref.original_basis_array)
+
+    # Modifying the source invalidates the compiled basis
+    Basis(fids[:, :1] * 2, ['a'], hdrs[:1]).save(tmp_path / 'basis', overwrite=True)
+    assert not isinstance(mrsio.read_basis(tmp_path / 'basis')._raw_fids, np.memmap)
+    assert not isinstance(mrsio.read_basis(out)._raw_fids, np.memmap)
+    assert np.allclose(mrsio.read_basis(out).original_basis_array[:, 0], 2 * ref.original_basis_array[:, 0])
+
+    # Not a compiled basis
+    (tmp_path / 'bad.fslbasis').write_bytes(b'not a basis')
+    with pytest.raises(basis_cache.CompiledBasisError):
+        mrsio.read_basis(tmp_path / 'bad.fslbasis')
+
+
+def test_text_parser_cache(tmp_path):
+    """Test the binary cache of the LCModel and jMRUI text format parsers."""
+    from fsl_mrs.utils.mrs_io import lcm_io, jmrui_io
+
+    rng = np.random.default_rng(0)
+    fid = rng.normal(size=512) + 1j * rng.normal(size=512)
+
+    with open(tmp_path / 'test.RAW', 'w') as fp:
+        lcm_io.writeLCMSection(fp, 'SEQPAR', {'hzpppm': 123.2, 'dwellTime': 2.5E-4, 'echot': 30.0})
+        lcm_io.writeLCMSection(fp, 'NMID', {'FMTDAT': '(2E16.6)'})
+        for val in fid:
+            fp.write(f'{val.real:16.6E}{val.imag:16.6E}\n')
+    jmrui_io.writejMRUItxt(tmp_path / 'test.txt', [fid, 2 * fid], {'dwelltime': 2.5E-4, 'centralFrequency': 123.2})
+
+    for read, file in zip((lcm_io.readLCModelRaw, jmrui_io.readjMRUItxt), ('test.RAW', 'test.txt')):
+        data, hdr = read(tmp_path / file)
+        assert np.allclose(np.atleast_2d(data)[0], fid.conj() if file == 'test.RAW' else fid)
+        assert hdr['dwelltime'] == 2.5E-4
+
+        cached_data, cached_hdr = read(tmp_path / file, cache=True)
+        assert (tmp_path / (file + '.fslcache')).is_file()
+        cached_data, cached_hdr = read(tmp_path / file, cache=True)
+        assert np.array_equal(cached_data, data)
+        assert cached_hdr == hdr
+
+    # Cache is not used once the source changes
+    with open(tmp_path / 'test.RAW', 'a') as fp:
+        fp.write(f'{1.0:16.6E}{1.0:16.6E}\n')
+    data, _ = lcm_io.readLCModelRaw(tmp_path / 'test.RAW', cache=True)
+    assert data.size == 513
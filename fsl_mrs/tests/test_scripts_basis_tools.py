@@ -45,6 +45,18 @@ def test_convert_lcmbasis(tmp_path):
     assert (tmp_path / 'new' / 'NAA.json').is_file()
 
 
+def test_convert_multiple(tmp_path):
+    mmbasis = testsPath.parent / 'mmbasis' / 'oldBasisSets'
+    subprocess.check_call(['basis_tools', 'convert',
+                           str(mmbasis / 'PRESS_3T_30ms.BASIS'),
+                           str(mmbasis / 'STEAM_7T_11ms.BASIS'),
+                           str(tmp_path / 'new'),
+                           '--workers', '2'])
+
+    assert (tmp_path / 'new' / 'PRESS_3T_30ms' / 'NAA.json').is_file()
+    assert (tmp_path / 'new' / 'STEAM_7T_11ms' / 'NAA.json').is_file()
+
+
 def test_convert_raw(tmp_path):
     subprocess.check_call(['basis_tools', 'convert',
                            str(raw),
@@ -189,3 +201,13 @@ def test_remove_hlsvd(tmp_path):
     assert (out_loc / 'NAA.json').is_file()
 
 # TO DO: Add tests fro shift_all
+
+
+def test_compile(tmp_path):
+    copytree(jmrui, tmp_path / 'jmrui')
+    subprocess.check_call(['basis_tools', 'compile', str(tmp_path / 'jmrui')])
+    assert (tmp_path / 'jmrui' / 'basis.fslbasis').is_file()
+
+    subprocess.check_call(['basis_tools', 'compile', str(jmrui),
+                           '--output', str(tmp_path / 'out.fslbasis')])
+    subprocess.check_call(['basis_tools', 'info', str(tmp_path / 'out.fslbasis')])
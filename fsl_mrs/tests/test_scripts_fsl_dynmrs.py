@@ -135,3 +135,73 @@ def test_dynmrs_models(fixed_ratio_data, tmp_path):
     assert (tmp_path / 'lorentzianfs' / 'dyn_results.csv').exists()
     run(gen_cmd('fs') + ['--free_shift',])
     assert (tmp_path / 'fs' / 'dyn_results.csv').exists()
+
+
+@pytest.fixture
+def fixed_ratio_mrsi_data(tmp_path, fixed_ratio_data):
+    from fsl_mrs.utils.mrs_io import read_FID
+    svs = read_FID(fixed_ratio_data[0])
+    data = np.tile(svs[:], (2, 1, 1, 1, 1))
+    nmrs = gen_nifti_mrs(
+        data,
+        svs.dwelltime,
+        svs.spectrometer_frequency[0],
+        dim_tags=['DIM_DYN', None, None],
+        no_conj=True)
+
+    data_path = tmp_path / 'mrsi_data.nii.gz'
+    nmrs.save(data_path)
+    return data_path, fixed_ratio_data[1], fixed_ratio_data[2]
+
+
+def test_dynmrs_mrsi_in_process(fixed_ratio_mrsi_data, tmp_path):
+    data_str = str(fixed_ratio_mrsi_data[0])
+    basis_str = str(fixed_ratio_mrsi_data[1])
+    tv_str = str(fixed_ratio_mrsi_data[2])
+    model_str = str(model_path)
+
+    run(['fsl_dynmrs',
+         '--data', data_str,
+         '--basis', basis_str,
+         '--dyn_config', model_str,
+         '--time_variables', tv_str,
+         '--baseline_order', '0',
+         '--output', str(tmp_path / 'dyn_res'),
+         '--parallel', 'off',
+         '--save-fit'])
+
+    out = tmp_path / 'dyn_res'
+    assert (out / 'options.txt').exists()
+    assert (out / 'fit.nii.gz').exists()
+    assert not (out / 'voxels').exists()
+    for fldr in ('mean', 'var', 'mapped_mean', 'mapped_var'):
+        assert (out / fldr).is_dir()
+        assert len(list((out / fldr).glob('*.nii.gz'))) > 0
+
+    from fsl.data.image import Image
+    from fsl_mrs.utils.mrs_io import read_FID
+    for img in (out / 'mean').glob('*.nii.gz'):
+        vals = Image(img)[:]
+        assert vals.shape[:3] == (2, 1, 1)
+        assert np.allclose(vals[0], vals[1])
+    assert read_FID(out / 'fit.nii.gz').shape == read_FID(fixed_ratio_mrsi_data[0]).shape
+
+
+def test_dynmrs_compression(fixed_ratio_mrsi_data, tmp_path):
+    run(['fsl_dynmrs',
+         '--data', str(fixed_ratio_mrsi_data[0]),
+         '--basis', str(fixed_ratio_mrsi_data[1]),
+         '--dyn_config', str(model_path),
+         '--time_variables', str(fixed_ratio_mrsi_data[2]),
+         '--baseline_order', '0',
+         '--output', str(tmp_path / 'dyn_res'),
+         '--parallel', 'off',
+         '--save-fit',
+         '--compression', 'none'])
+
+    out = tmp_path / 'dyn_res'
+    assert (out / 'fit.nii').exists()
+    assert not (out / 'fit.nii.gz').exists()
+    for fldr in ('mean', 'var', 'mapped_mean', 'mapped_var'):
+        assert len(list((out / fldr).glob('*.nii'))) > 0
+        assert len(list((out / fldr).glob('*.nii.gz'))) == 0
@@ -28,3 +28,36 @@ def test_merge_mrs_reports(tmp_path):
                            '--delete'] + htmlfiles)
 
     assert (tmp_path / 'test.html').exists()
+
+
+def test_merge_plotly_deduplicated(tmp_path):
+    """Reports embedding the plotly library should only include it once when merged."""
+    import plotly.graph_objects as go
+    from plotly.offline import plot
+    from fsl_mrs.utils.preproc.reporting import singleReport, figgroup
+
+    fig = go.Figure(go.Scatter(y=[0, 1, 0]))
+    for idx in range(4):
+        inline = plot(fig, output_type='div', include_plotlyjs=True)
+        cdn = plot(fig, output_type='div', include_plotlyjs='cdn')
+        singleReport(
+            tmp_path / f'report_{idx}.html',
+            f'operation_{idx}',
+            'header info',
+            [figgroup(fig=inline, name='inline'), figgroup(fig=cdn, name='cdn')])
+
+    htmlfiles = [str(f) for f in tmp_path.glob('report_*.html')]
+    subprocess.check_call(['merge_mrs_reports',
+                           '-d', 'test',
+                           '-f', 'test.html',
+                           '-o', str(tmp_path)] + htmlfiles)
+
+    with open(tmp_path / 'test.html') as fp:
+        merged = fp.read()
+    assert merged.count('* plotly.js v') == 1
+    assert merged.count('https://cdn.plot.ly/plotly-latest.min.js') == 1
+    assert merged.count('class="plotly-graph-div"') == 8
+    assert all(f'<h2>operation_{idx}</h2>' in merged for idx in range(4))
+    assert merged.count('<header') == 1
+    assert 'Combined report for test' in merged
+    assert not (tmp_path / 'test.html.part').exists()
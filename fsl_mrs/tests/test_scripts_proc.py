@@ -9,6 +9,7 @@ algorithms in nifti_mrs_proc.py
 Copyright Will Clarke, University of Oxford, 2021'''
 
 import pytest
+import os
 import os.path as op
 import subprocess
 import warnings
@@ -1201,3 +1202,116 @@ def test_mrsi_lipid(svs_data, mrsi_data, tmp_path):
         capture_output=True)
 
     assert (tmp_path / 'tmp.nii.gz').exists()
+
+
+def test_pipeline(svs_data, mrsi_data, tmp_path):
+    svsfile, mrsifile, svsdata, mrsidata = splitdata(svs_data, mrsi_data)
+
+    recipe = tmp_path / 'recipe.yaml'
+    recipe.write_text(
+        'steps:\n'
+        '  - align:\n'
+        '      dim: DIM_DYN\n'
+        '      ppmlim: [0.2, 4.2]\n'
+        '  - average:\n'
+        '      dim: DIM_DYN\n'
+        '      save: averaged\n'
+        '  - phase_correct:\n'
+        '      ppmlim: [2.8, 3.2]\n')
+
+    for dfile, data, name in zip((svsfile, mrsifile), (svsdata, mrsidata), ('svs', 'mrsi')):
+        _ = subprocess.run(
+            ['fsl_mrs_proc',
+             'pipeline', recipe,
+             '--file', dfile,
+             '--output', tmp_path / name,
+             '--filename', 'tmp',
+             '-r'],
+            check=True,
+            capture_output=True)
+
+        # Compare against step by step run
+        directRun = preproc.align(data, 'DIM_DYN', ppmlim=(0.2, 4.2))
+        directRun = preproc.average(directRun, 'DIM_DYN')
+        assert np.allclose(read_FID(tmp_path / name / 'averaged.nii.gz')[:], directRun[:])
+        directRun = preproc.phase_correct(directRun, (2.8, 3.2))
+
+        out = read_FID(tmp_path / name / 'tmp.nii.gz')
+        assert np.allclose(out[:], directRun[:])
+        assert [pp['Method'] for pp in out.hdr_ext['ProcessingApplied']] \
+            == [pp['Method'] for pp in directRun.hdr_ext['ProcessingApplied']]
+        assert len(list((tmp_path / name).glob('report*.html'))) == 3
+
+
+def test_deferred_reports(svs_data, tmp_path):
+    svsfile, svsdata = svs_data
+
+    # Background rendering, reports complete on exit
+    _ = subprocess.run(
+        ['fsl_mrs_proc',
+         'phase',
+         '--file', svsfile,
+         '--output', tmp_path / 'background',
+         '--ppm', '0', '4',
+         '--filename', 'tmp',
+         '-r',
+         '--report-workers', '2'],
+        check=True,
+        capture_output=True)
+    assert (tmp_path / 'background' / 'tmp.nii.gz').exists()
+    assert len(list((tmp_path / 'background').glob('report*.html'))) == 1
+
+    # Deferred, reports rendered in a separate step
+    _ = subprocess.run(
+        ['fsl_mrs_proc',
+         'phase',
+         '--file', svsfile,
+         '--output', tmp_path / 'deferred',
+         '--ppm', '0', '4',
+         '--filename', 'tmp',
+         '-r',
+         '--defer-reports'],
+        check=True,
+        capture_output=True)
+    assert (tmp_path / 'deferred' / 'tmp.nii.gz').exists()
+    assert len(list((tmp_path / 'deferred').glob('report*.html'))) == 0
+    assert len(list((tmp_path / 'deferred').glob('report_record_*.pkl'))) == 1
+
+    _ = subprocess.run(
+        ['fsl_mrs_proc',
+         'render-reports',
+         '--output', tmp_path / 'deferred'],
+        check=True,
+        capture_output=True)
+    assert len(list((tmp_path / 'deferred').glob('report*.html'))) == 1
+    assert len(list((tmp_path / 'deferred').glob('report_record_*.pkl'))) == 0
+
+
+def test_compression(svs_data, tmp_path):
+    """Test the --compression option and environment default"""
+    svsfile, svsdata = svs_data
+
+    subprocess.check_call(['fsl_mrs_proc',
+                           'average',
+                           '--file', svsfile,
+                           '--dim', 'DIM_DYN',
+                           '--output', tmp_path,
+                           '--filename', 'tmp',
+                           '--compression', 'none'])
+    assert (tmp_path / 'tmp.nii').is_file()
+    assert not (tmp_path / 'tmp.nii.gz').exists()
+
+    env = os.environ.copy()
+    env['FSLMRS_COMPRESSION'] = 'threaded'
+    subprocess.check_call(['fsl_mrs_proc',
+                           'average',
+                           '--file', svsfile,
+                           '--dim', 'DIM_DYN',
+                           '--output', tmp_path,
+                           '--filename', 'tmp2'],
+                          env=env)
+
+    directRun = preproc.average(svsdata, 'DIM_DYN')
+    for fname in ('tmp.nii', 'tmp2.nii.gz'):
+        data = read_FID(tmp_path / fname)
+        assert np.allclose(data[:], directRun[:])
@@ -5,6 +5,8 @@ Test functions that appear in utils.fmrs_tools.flame module
 Copyright Will Clarke, University of Oxford, 2022"""
 
 import numpy as np
+import pytest
+import scipy.stats
 
 from fsl_mrs.utils.fmrs_tools import flame
 
@@ -130,3 +132,97 @@ def test_with_ftests():
     assert isinstance(f, dict)
     assert tuple(f.keys()) == ('f-stat', 'zf-stat', 'p')
     assert f['f-stat'].shape == (2, 2)
+
+
+def test_group_glm():
+    # Reproduce the flameo results of test_flameo_wrapper
+    cope = np.ones((10, 2))
+    varcope = 1E-5 * np.ones((10, 2))
+    p, z, out_cope, out_varcope, f = flame.group_glm(cope, varcope)
+
+    assert (p < 1E-5).all()
+    assert np.allclose(z, 10.107995)
+    assert np.allclose(out_cope, 1)
+    assert np.allclose(out_varcope, 1E-6)
+    assert f is None
+
+    cope = np.concatenate((np.ones((10, 2)), [0, 2] * np.ones((10, 2))))
+    varcope = 1E-5 * np.ones((20, 2))
+    desmat = np.block([[np.ones((10, 1)), np.zeros((10, 1))], [np.zeros((10, 1)), np.ones((10, 1))]])
+    conmat = np.array([[1, -1], [-1, 1], [1, 0], [0, 1], [0.5, 0.5]])
+    fmat = np.array([[0, 0, 1, 1, 0], [0, 0, 0, 0, 1]])
+
+    p, z, out_cope, out_varcope, f = flame.group_glm(
+        cope, varcope, design_mat=desmat, contrast_mat=conmat, covariance_mat=np.ones((20, 1)), ftests=fmat)
+
+    ztrue = np.array([
+        [13.486302, -13.486302],
+        [-13.486302, 13.486302],
+        [13.938844, 13.938844],
+        [0.0, 14.802881],
+        [13.486302, 14.874]])
+    oc_true = np.array([
+        [1., -1.],
+        [-1., 1.],
+        [1., 1.],
+        [0., 2.],
+        [0.5, 1.5]])
+    assert np.allclose(z, ztrue)
+    assert np.allclose(out_cope, oc_true)
+    assert np.allclose(out_varcope[0], 2E-6)
+    assert tuple(f.keys()) == ('f-stat', 'zf-stat', 'p')
+    assert f['f-stat'].shape == (2, 2)
+    # Single contrast F-test is the square of the t statistic
+    assert np.allclose(f['f-stat'][1], (out_cope[4] / np.sqrt(out_varcope[4]))**2)
+
+
+def test_group_glm_modes():
+    rng = np.random.default_rng(0)
+    nsub, nparams = 16, 20
+    desmat = np.stack((np.ones(nsub), rng.normal(size=nsub)), axis=1)
+    varcope = rng.uniform(0.1, 1, (nsub, nparams))
+    between = rng.uniform(0, 2, nparams)
+    cope = 1 + rng.normal(size=(nsub, nparams)) * np.sqrt(varcope + between)
+
+    # OLS matches a standard one sample t-test
+    p, z, out_cope, _, f = flame.group_glm(cope, varcope, runmode='ols', ftests=np.ones((1, 1)))
+    ttest = scipy.stats.ttest_1samp(cope, 0)
+    assert np.allclose(out_cope, cope.mean(axis=0))
+    assert np.allclose(f['f-stat'], ttest.statistic**2)
+    assert np.allclose(f['p'], ttest.pvalue)
+
+    # Fixed effects is the inverse-variance weighted mean
+    _, z, out_cope, out_varcope, _ = flame.group_glm(cope, varcope, runmode='fe')
+    weights = 1 / varcope
+    assert np.allclose(out_cope, (weights * cope).sum(axis=0) / weights.sum(axis=0))
+    assert np.allclose(out_varcope, 1 / weights.sum(axis=0))
+    assert np.allclose(z, out_cope / np.sqrt(out_varcope))
+
+    # Mixed effects, between-subject variance maximises the marginal likelihood
+    groups = np.repeat([1, 2], nsub // 2)
+    s2 = flame._flame1_variances(cope, varcope, desmat, np.ones(nsub))
+    assert (s2 >= 0).all()
+    for scale in (0.9, 1.1):
+        assert (flame._neg_log_marginal(cope, varcope + s2, desmat)
+                <= flame._neg_log_marginal(cope, varcope + scale * s2, desmat) + 1E-9).all()
+
+    p, z, out_cope, out_varcope, _ = flame.group_glm(
+        cope, varcope, design_mat=desmat, contrast_mat=np.eye(2), covariance_mat=groups)
+    assert z.shape == (2, nparams)
+    # Mixed effects variance is never smaller than the fixed effects variance
+    _, _, _, fe_varcope, _ = flame.group_glm(cope, varcope, design_mat=desmat, contrast_mat=np.eye(2), runmode='fe')
+    assert (out_varcope >= fe_varcope - 1E-12).all()
+
+    # A reference scaled to itself has unit value and zero variance in every subject
+    ref_cope = np.concatenate((np.ones((nsub, 1)), cope[:, :1]), axis=1)
+    ref_varcope = np.concatenate((np.zeros((nsub, 1)), varcope[:, :1]), axis=1)
+    for mode in ('flame1', 'ols'):
+        p, z, out_cope, out_varcope, _ = flame.group_glm(ref_cope, ref_varcope, runmode=mode)
+        for out in (p, z, out_cope, out_varcope):
+            assert np.isfinite(out).all()
+        assert np.isclose(out_cope[0, 0], 1)
+
+    with pytest.raises(ValueError):
+        flame.group_glm(cope, varcope, runmode='flame2')
+    with pytest.raises(ValueError):
+        flame.group_glm(cope, varcope, contrast_mat=np.eye(2))
@@ -8,6 +8,7 @@ from pathlib import Path
 
 import pytest
 import numpy as np
+import pandas as pd
 
 import fsl_mrs.utils.fmrs_tools.scalings as scalings
 import fsl_mrs.utils.fmrs_tools.utils as util
@@ -32,3 +33,47 @@ def test_internal_ref(tmp_path):
     scaled = out[0]['conc_NAA_beta3']
     comp_val = comp[0]['conc_NAA_beta3'] / comp[0]['conc_Cr_beta3']
     assert np.isclose(scaled, comp_val)
+
+
+def write_results(folder):
+    """Write a minimal set of dynamic fitting results with correlated parameters"""
+    params = ['conc_Cr_beta0', 'conc_NAA_beta0', 'conc_NAA_beta1', 'gamma_0']
+    values = pd.DataFrame([[2.0, 4.0, 1.0, 10.0]], columns=params)
+    sd = np.array([0.05, 0.08, 0.04, 0.5])
+    corr = np.eye(4)
+    corr[0, 1] = corr[1, 0] = 0.3
+    cov = pd.DataFrame(corr * np.outer(sd, sd), index=params, columns=params)
+    folder.mkdir()
+    values.to_csv(folder / 'dyn_results.csv')
+    cov.to_csv(folder / 'dyn_cov.csv')
+    return values, cov
+
+
+def test_internal_ref_covariance(tmp_path):
+    values, cov = write_results(tmp_path / 'res')
+
+    scaled, scaled_cov, summary, _ = scalings.fmrs_internal_reference(tmp_path / 'res', 'conc_Cr_beta0')
+    assert np.isclose(scaled['conc_NAA_beta0'].iloc[0], 2.0)
+    assert np.isclose(scaled['gamma_0'].iloc[0], 10.0)
+
+    # Analytic first-order variance of a ratio
+    a, b = 4.0, 2.0
+    var_a, var_b, cov_ab = cov.iloc[1, 1], cov.iloc[0, 0], cov.iloc[0, 1]
+    var_ratio = (a / b)**2 * (var_a / a**2 + var_b / b**2 - 2 * cov_ab / (a * b))
+    assert np.isclose(scaled_cov.loc['conc_NAA_beta0', 'conc_NAA_beta0'], var_ratio)
+    assert np.isclose(scaled_cov.loc['conc_Cr_beta0', 'conc_Cr_beta0'], 0)
+    assert np.isclose(scaled_cov.loc['gamma_0', 'gamma_0'], 0.25)
+    assert np.isclose(summary.loc['conc_NAA_beta0', 'sd'], np.sqrt(var_ratio))
+
+    # Monte Carlo estimate is reproducible with a seed and agrees with the delta method
+    mc_1 = scalings.fmrs_internal_reference(tmp_path / 'res', 'conc_Cr_beta0', method='montecarlo', seed=1)[1]
+    mc_2 = scalings.fmrs_internal_reference(tmp_path / 'res', 'conc_Cr_beta0', method='montecarlo', seed=1)[1]
+    assert np.allclose(mc_1.to_numpy(), mc_2.to_numpy())
+    assert np.allclose(
+        np.sqrt(np.diag(mc_1)), np.sqrt(np.diag(scaled_cov)), rtol=5E-2)
+
+    with pytest.warns(UserWarning):
+        scalings.fmrs_internal_reference(
+            tmp_path / 'res', 'conc_Cr_beta0', method='montecarlo', samples=1E3, chunk_size=1E3, seed=1)
+    with pytest.raises(ValueError):
+        scalings.fmrs_internal_reference(tmp_path / 'res', 'conc_Cr_beta0', method='sampling')
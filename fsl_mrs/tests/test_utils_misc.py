@@ -250,3 +250,9 @@ def test_detect_conjugation():
             FIDs.T,
             headers['ppmaxis'],
             (0, -4))
+
+
+def test_thread_map():
+    assert misc.thread_map(lambda x: x**2, range(10)) == [x**2 for x in range(10)]
+    assert misc.thread_map(lambda x: x**2, range(10), workers=1) == [x**2 for x in range(10)]
+    assert misc.thread_map(lambda x: x, []) == []
@@ -0,0 +1,88 @@
+'''FSL-MRS test script
+
+Test selectable compression of NIfTI outputs
+
+Copyright (C) 2026 University of Oxford'''
+import gzip
+from pathlib import Path
+
+import pytest
+import numpy as np
+import nibabel as nib
+
+from fsl_mrs.core.nifti_mrs import gen_nifti_mrs
+from fsl_mrs.utils.mrs_io import read_FID
+from fsl_mrs.utils import nifti_compression
+
+
+@pytest.fixture(autouse=True)
+def reset_compression(monkeypatch):
+    monkeypatch.delenv(nifti_compression.COMPRESSION_ENV_VAR, raising=False)
+    nifti_compression.set_compression(None)
+    yield
+    nifti_compression.set_compression(None)
+
+
+def test_get_compression(monkeypatch):
+    assert nifti_compression.get_compression() == 'gzip'
+
+    monkeypatch.setenv(nifti_compression.COMPRESSION_ENV_VAR, 'none')
+    assert nifti_compression.get_compression() == 'none'
+
+    nifti_compression.set_compression('fast')
+    assert nifti_compression.get_compression() == 'fast'
+    assert nifti_compression.get_compression('threaded') == 'threaded'
+
+    with pytest.raises(ValueError):
+        nifti_compression.set_compression('bzip2')
+
+
+def test_output_filename():
+    out = nifti_compression.output_filename
+    assert out('dir/test.nii.gz', 'none') == Path('dir/test.nii')
+    assert out('dir/test', 'none') == Path('dir/test.nii')
+    assert out('dir/test.nii', 'fast') == Path('dir/test.nii.gz')
+    assert out('dir/test', 'threaded') == Path('dir/test.nii.gz')
+    # Default method retains an explicit uncompressed extension
+    assert out('dir/test.nii', 'gzip') == Path('dir/test.nii')
+    assert out('dir/test.nii.gz', 'gzip') == Path('dir/test.nii.gz')
+
+
+@pytest.mark.parametrize('method', nifti_compression.COMPRESSION_METHODS)
+def test_save_nifti(tmp_path, method, monkeypatch):
+    # Small blocks to test multi-member output of threaded compression
+    monkeypatch.setattr(nifti_compression, '_BLOCK_SIZE', 1000)
+
+    data = np.random.default_rng(1).normal(size=(4, 5, 6))
+    img = nib.Nifti1Image(data, np.eye(4))
+    img.header.set_intent(1005, params=(3, ), name='test')
+
+    out = nifti_compression.save_nifti(img, tmp_path / 'test.nii.gz', method)
+    assert out.is_file()
+    assert out.name == ('test.nii' if method == 'none' else 'test.nii.gz')
+
+    loaded = nib.load(out)
+    assert np.allclose(loaded.get_fdata(), data)
+    assert loaded.header.get_intent()[0] == 'symmetric matrix'
+
+    if method != 'none':
+        with gzip.open(out) as fp:
+            assert fp.read() == img.to_bytes()
+
+
+@pytest.mark.parametrize('method', nifti_compression.COMPRESSION_METHODS)
+def test_nifti_mrs_save(tmp_path, method, monkeypatch):
+    monkeypatch.setattr(nifti_compression, '_BLOCK_SIZE', 1000)
+
+    data = np.random.default_rng(1).normal(size=(1, 1, 1, 512, 4))\
+        + 1j * np.random.default_rng(2).normal(size=(1, 1, 1, 512, 4))
+    nmrs = gen_nifti_mrs(data.astype(np.complex64), 1 / 2000, 123.2, dim_tags=['DIM_DYN', None, None])
+
+    nifti_compression.set_compression(method)
+    out = nmrs.save(tmp_path / 'test')
+    assert out.name == ('test.nii' if method == 'none' else 'test.nii.gz')
+
+    loaded = read_FID(out)
+    assert np.allclose(loaded[:], nmrs[:])
+    assert loaded.hdr_ext == nmrs.hdr_ext
+    assert loaded.dim_tags == nmrs.dim_tags
@@ -12,7 +12,8 @@ import numpy as np
 
 from fsl_mrs.utils.preproc import nifti_mrs_proc as nproc
 from fsl_mrs.utils.mrs_io import read_FID
-from fsl_mrs.core.nifti_mrs import split
+from fsl_mrs.core.nifti_mrs import split, gen_nifti_mrs
+from fsl_mrs.utils.synthetic import syntheticFID
 from fsl_mrs import __version__
 
 
@@ -125,6 +126,43 @@ def test_aligndiff():
            'dim_diff=DIM_DYN, diff_type=add, target=None, ppmlim=(1.0, 4.0).'
 
 
+def test_parallel_workers():
+    # Multi-voxel data with coils, dynamics and edit dimensions
+    rng = np.random.default_rng(0)
+    fid, hdr = syntheticFID(points=256, chemicalshift=[2.0, 3.0, 3.2], amplitude=[1, 1, 1], noisecovariance=[[0]])
+    time = (np.arange(256) * hdr['dwelltime'])[:, None, None, None]
+    eps = rng.normal(scale=3, size=(2, 1, 1, 1, 1, 4, 2))
+    coils = rng.uniform(size=(1, 1, 1, 1, 3, 1, 1))
+    fids = fid[0][:, None, None, None] * np.exp(2j * np.pi * eps * time) * coils
+    fids = fids + 0.01 * (rng.normal(size=fids.shape) + 1j * rng.normal(size=fids.shape))
+    nmrs_obj = gen_nifti_mrs(
+        fids.astype(np.complex64),
+        hdr['dwelltime'],
+        hdr['centralFrequency'],
+        dim_tags=['DIM_COIL', 'DIM_DYN', 'DIM_EDIT'])
+
+    def run(workers):
+        combined = nproc.coilcombine(nmrs_obj, workers=workers)
+        return (
+            combined,
+            nproc.align(combined, 'DIM_DYN', ppmlim=(1.0, 4.0), workers=workers),
+            nproc.align(combined, 'DIM_DYN', ppmlim=(1.0, 4.0), window=2, workers=workers),
+            nproc.aligndiff(combined, 'DIM_DYN', 'DIM_EDIT', 'add', ppmlim=(1.0, 4.0), workers=workers))
+
+    for serial, parallel in zip(run(1), run(2)):
+        assert parallel.shape == serial.shape
+        assert np.allclose(parallel[:], serial[:])
+        assert parallel.hdr_ext['ProcessingApplied'][-1]['Details']\
+            == serial.hdr_ext['ProcessingApplied'][-1]['Details']
+
+    # Module default used when workers is not specified
+    nproc.set_workers(2)
+    try:
+        assert np.allclose(nproc.coilcombine(nmrs_obj)[:], run(1)[0][:])
+    finally:
+        nproc.set_workers(1)
+
+
 def test_ecc():
     nmrs_obj = read_FID(wrefc)
     nmrs_obj = nproc.average(nmrs_obj, 'DIM_DYN')
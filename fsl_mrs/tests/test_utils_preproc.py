@@ -5,6 +5,8 @@ Test utils.preproc functions
 Copyright Will Clarke, University of Oxford, 2021'''
 
 import fsl_mrs.utils.preproc as preproc
+from fsl_mrs.utils.preproc.align import align_FID, align_FID_diff
+from fsl_mrs.utils.preproc.general import get_target_FID, subtract
 import fsl_mrs.utils.synthetic as syn
 from fsl_mrs.utils.misc import FIDToSpec
 from fsl_mrs.core import MRS
@@ -42,6 +44,31 @@ def test_timeshift():
     assert np.allclose(shiftedFID, testFID2[0], atol=1E-1)
 
 
+def test_stacked_fids():
+    # Shifting, filtering and phasing functions operate along the last axis of stacked FIDs
+    rng = np.random.default_rng(0)
+    fids = rng.normal(size=(2, 3, 256)) + 1j * rng.normal(size=(2, 3, 256))
+    shifts = rng.normal(size=(2, 3)) * 10
+    dt = 1 / 4000
+
+    stacked_ts, _ = preproc.timeshift(fids, dt, 0.0005, -0.001, samples=200)
+    stacked_fs = preproc.freqshift(fids, dt, shifts)
+    stacked_pad = preproc.pad(fids, 10, 'first')
+    stacked_trunc = preproc.truncate(fids, 10, 'last')
+    stacked_apod = preproc.apodize(fids, dt, [10])
+    stacked_ref, ref_shift = preproc.shiftToRef(fids, 0.0, 4000, 123.2, ppmlim=(-2, 2))
+    assert ref_shift.shape == (2, 3)
+    for idx in np.ndindex(2, 3):
+        assert np.allclose(stacked_ts[idx], preproc.timeshift(fids[idx], dt, 0.0005, -0.001, samples=200)[0])
+        assert np.allclose(stacked_fs[idx], preproc.freqshift(fids[idx], dt, shifts[idx]))
+        assert np.allclose(stacked_pad[idx], preproc.pad(fids[idx], 10, 'first'))
+        assert np.allclose(stacked_trunc[idx], preproc.truncate(fids[idx], 10, 'last'))
+        assert np.allclose(stacked_apod[idx], preproc.apodize(fids[idx], dt, [10]))
+        single_ref, single_shift = preproc.shiftToRef(fids[idx], 0.0, 4000, 123.2, ppmlim=(-2, 2))
+        assert np.allclose(stacked_ref[idx], single_ref)
+        assert np.isclose(ref_shift[idx], single_shift)
+
+
 # Test combine_FIDs:
 # Test mean by calculating mean of anti phase signals
 # Test averaging using weights to zero signal
@@ -128,6 +155,43 @@ def test_phase_freq_align():
     assert np.max(np.abs(FIDToSpec(meanFID))) > 0.09
 
 
+def test_phase_freq_align_batch():
+    # Two groups of transients with known phase and frequency offsets
+    rng = np.random.default_rng(42)
+    shifts = rng.standard_normal((2, 6)) * 0.02
+    phases = rng.standard_normal((2, 6)) * 0.5
+    fids = np.zeros((2, 6, 2048), dtype=complex)
+    testHdrs = None
+    for idx in np.ndindex(shifts.shape):
+        testFIDs, testHdrs = syn.syntheticFID(amplitude=[1, 1],
+                                              chemicalshift=[2 + shifts[idx], 3 + shifts[idx]],
+                                              phase=[phases[idx], phases[idx]],
+                                              points=2048,
+                                              noisecovariance=[[1E-6]])
+        fids[idx] = testFIDs[0]
+
+    target = fids[:, 0, :]
+    aligned, phi, eps = preproc.phase_freq_align_batch(fids,
+                                                       testHdrs['bandwidth'],
+                                                       testHdrs['centralFrequency'],
+                                                       niter=1,
+                                                       ppmlim=(1.5, 3.5),
+                                                       shift=False,
+                                                       target=target)
+    assert aligned.shape == fids.shape
+    assert phi.shape == (2, 6)
+    assert np.allclose(phi, phases - phases[:, :1], atol=5E-2)
+    assert np.allclose(eps, (shifts - shifts[:, :1]) * testHdrs['centralFrequency'], atol=1E-2)
+
+    # Matches the previous per-transient alignment
+    for group, tgt, g_phi, g_eps in zip(fids, target, phi, eps):
+        mrs = MRS(FID=tgt, bw=testHdrs['bandwidth'], cf=testHdrs['centralFrequency'])
+        for fid, b_phi, b_eps in zip(group, g_phi, g_eps):
+            s_phi, s_eps = align_FID(mrs, fid, tgt, ppmlim=(1.5, 3.5), shift=False)
+            assert np.isclose(s_phi, b_phi, atol=1E-4)
+            assert np.isclose(s_eps, b_eps, atol=1E-3)
+
+
 def test_truncate():
     testFIDs, testHdrs = syn.syntheticFID()
     truncatedFID1 = preproc.truncate(testFIDs[0], 1, 'first')
@@ -209,6 +273,41 @@ def test_hlsvd():
     assert np.allclose(np.real(removedFID), np.real(onResFID), atol=1E-2, rtol=1E-2)
 
 
+# Test stacked hlsvd against single FID calls, and multiple limit sets
+def test_hlsvd_stack():
+    fids = []
+    for _ in range(4):
+        testFIDs, testHdrs = syn.syntheticFID(noisecovariance=[[1E-6]],
+                                              amplitude=[1.0, 1.0, 1.0],
+                                              chemicalshift=[-2, 0, 1],
+                                              points=512)
+        fids.append(testFIDs[0])
+    fids = np.asarray(fids).reshape(2, 2, -1)
+
+    removed = preproc.hlsvd_stack(fids,
+                                  testHdrs['dwelltime'],
+                                  testHdrs['centralFrequency'],
+                                  [-2.5, -1.5],
+                                  limitUnits='ppm',
+                                  workers=2)
+    assert removed.shape == fids.shape
+    for fid, rfid in zip(fids.reshape(4, -1), removed.reshape(4, -1)):
+        assert np.allclose(rfid, preproc.hlsvd(fid,
+                                               testHdrs['dwelltime'],
+                                               testHdrs['centralFrequency'],
+                                               [-2.5, -1.5],
+                                               limitUnits='ppm'))
+
+    # Remove two peaks with one decomposition
+    removed = preproc.hlsvd_stack(fids,
+                                  testHdrs['dwelltime'],
+                                  testHdrs['centralFrequency'],
+                                  [(-2.5, -1.5), (0.5, 1.5)],
+                                  limitUnits='ppm')
+    onResFID = np.exp(-testHdrs['inputopts']['damping'][1] * testHdrs['taxis'])
+    assert np.allclose(np.real(removed[1, 1]), np.real(onResFID), atol=1E-2, rtol=1E-2)
+
+
 # Test hlsvd modelling by 'denoising'
 def test_model_fid_hlsvd():
     # low noise
@@ -261,6 +360,46 @@ def test_phaseCorrect():
     assert np.isclose(phs, -np.pi / 2, atol=1E-2)
 
 
+def test_phaseCorrect_stack():
+    phases = np.linspace(-3, 3, 6).reshape(2, 3)
+    fids = np.zeros((2, 3, 2048), dtype=complex)
+    for idx in np.ndindex(phases.shape):
+        testFIDs, testHdrs = syn.syntheticFID(amplitude=[1.0, 0.5],
+                                              chemicalshift=[0.0, 2.0],
+                                              phase=[phases[idx], 0.0],
+                                              noisecovariance=[[1E-5]])
+        fids[idx] = testFIDs[0]
+
+    corrected, phs, pos = preproc.phaseCorrect_stack(fids,
+                                                     testHdrs['bandwidth'],
+                                                     testHdrs['centralFrequency'],
+                                                     ppmlim=(-0.5, 0.5),
+                                                     shift=False)
+    assert corrected.shape == fids.shape
+    assert phs.shape == (2, 3)
+    assert np.allclose(phs, -phases, atol=1E-2)
+
+    # Matches FID by FID processing
+    for idx in np.ndindex(phases.shape):
+        s_corr, s_phs, s_pos = preproc.phaseCorrect(fids[idx],
+                                                    testHdrs['bandwidth'],
+                                                    testHdrs['centralFrequency'],
+                                                    ppmlim=(-0.5, 0.5),
+                                                    shift=False)
+        assert np.allclose(corrected[idx], s_corr)
+        assert np.isclose(phs[idx], s_phs)
+        assert pos[idx] == s_pos
+
+    # Single HLSVD decomposition
+    _, phs, _ = preproc.phaseCorrect_stack(fids[0],
+                                           testHdrs['bandwidth'],
+                                           testHdrs['centralFrequency'],
+                                           ppmlim=(4.15, 5.15),
+                                           use_hlsvd=True,
+                                           hlsvd_refine=False)
+    assert np.allclose(phs, -phases[0], atol=1E-2)
+
+
 def test_add_subtract():
     mockFID = np.random.random(1024) + 1j * np.random.random(1024)
     testFID = preproc.add(mockFID.copy(), mockFID.copy())
@@ -310,6 +449,49 @@ def test_align_diff():
     assert np.allclose(phi, phs, atol=1E-0)
 
 
+def test_align_diff_batch():
+    rng = np.random.default_rng(7)
+    shift0 = rng.standard_normal((2, 5)) * 0.05
+    phs = rng.standard_normal((2, 5)) * 0.1 * np.pi
+    fids0 = np.zeros((2, 5, 2048), dtype=complex)
+    fids1 = np.zeros((2, 5, 2048), dtype=complex)
+    testHdrs = None
+    for idx in np.ndindex(shift0.shape):
+        testFIDs, testHdrs = syn.syntheticFID(
+            amplitude=[1, 1], chemicalshift=[-2 + shift0[idx], 3 + shift0[idx]], phase=[phs[idx] + np.pi, phs[idx]],
+            damping=[100, 100], points=2048, noisecovariance=[[1E-6]])
+        fids0[idx] = testFIDs[0]
+
+        testFIDs, testHdrs = syn.syntheticFID(
+            amplitude=[1, 1], chemicalshift=[-2, 3], phase=[0, 0],
+            damping=[100, 100], points=2048, noisecovariance=[[1E-6]])
+        fids1[idx] = testFIDs[0]
+
+    aligned0, _, phi, eps = preproc.phase_freq_align_diff_batch(fids0,
+                                                                fids1,
+                                                                testHdrs['bandwidth'],
+                                                                testHdrs['centralFrequency'],
+                                                                diffType='sub',
+                                                                shift=False,
+                                                                ppmlim=(-5, 5))
+    assert aligned0.shape == fids0.shape
+    assert phi.shape == (2, 5)
+    assert eps.shape == (2, 5)
+
+    # Matches the previous per-pair alignment to the difference spectrum nearest the group mean
+    for f0, f1, g_phi, g_eps in zip(fids0, fids1, phi, eps):
+        target = get_target_FID([subtract(b, a) for a, b in zip(f0, f1)], target='nearest_to_mean')
+        mrs = MRS(FID=f0[0], bw=testHdrs['bandwidth'], cf=testHdrs['centralFrequency'])
+        for fid0, fid1, b_phi, b_eps in zip(f0, f1, g_phi, g_eps):
+            _, s_phi, s_eps = align_FID_diff(mrs, fid0, fid1, target, diffType='sub', ppmlim=(-5, 5), shift=False)
+            assert np.isclose(s_phi, b_phi, atol=1E-3)
+            assert np.isclose(s_eps, b_eps, atol=1E-2)
+
+    # Relative offsets between transients are the injected phases and shifts
+    assert np.allclose(phi - phi[:, :1], phs - phs[:, :1], atol=5E-2)
+    assert np.allclose(eps - eps[:, :1], (shift0 - shift0[:, :1]) * testHdrs['centralFrequency'], atol=1E-1)
+
+
 def test_shiftToRef():
     testFIDs, testHdrs = syn.syntheticFID(
         amplitude=[1, 0], chemicalshift=[-2.1, 0], phase=[0, 0], points=1024, noisecovariance=[[1E-3]])
@@ -327,3 +509,27 @@ def test_shiftToRef():
     position = mrs.getAxes(axis='ppm')[maxindex]
 
     assert np.isclose(position, -2.0, atol=1E-1)
+
+
+def test_identifyUnlikeFIDs():
+    testFID, testHdrs = syn.syntheticFID(amplitude=[1.0, 1.0], noisecovariance=[[1E-4]], points=512)
+    bw = testHdrs['inputopts']['bandwidth']
+    cf = testHdrs['inputopts']['centralfrequency'] * 1E6
+
+    rng = np.random.default_rng(1)
+    fids = np.asarray(testFID[0])[None, :] * (1 + 0.02 * rng.standard_normal((50, 1)))
+    fids += 0.01 * (rng.standard_normal(fids.shape) + 1j * rng.standard_normal(fids.shape))
+    fids[[3, 17]] *= 5
+
+    for ppmlim in (None, (1.0, 4.0)):
+        good, bad, keep, remove, metric = preproc.identifyUnlikeFIDs(fids, bw, cf, ppmlim=ppmlim)
+        assert remove == [3, 17]
+        assert len(keep) == 48
+        assert len(metric) == 50
+        assert np.allclose(np.asarray(bad), fids[[3, 17]])
+        assert np.allclose(np.asarray(good), np.delete(fids, [3, 17], axis=0))
+
+        # List input gives the same result
+        out_list = preproc.identifyUnlikeFIDs(list(fids), bw, cf, ppmlim=ppmlim)
+        assert out_list[3] == remove
+        assert np.allclose(out_list[4], metric)
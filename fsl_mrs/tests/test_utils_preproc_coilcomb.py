@@ -163,6 +163,43 @@ def test_combine():
     assert np.allclose(amps.conj(), scaled_true_weights, atol=1E-1)
 
 
+def test_combine_stack():
+
+    cov = 1E-4 * np.asarray(
+        [[1, 0.4, 0.01],
+         [0.4, 0.9, 0.4],
+         [0.01, 0.4, 1.1]])
+
+    stack = []
+    for coil_weights in ([1 + 1j * 0, 0.6 + 1j * 0.2, 0.2 - 1j * 0.3],
+                         [0.8 + 1j * 0.2, 0.6 + 1j * 0.1, 0.5 - 1j * 0.5]):
+        fids, _ = syn.syntheticFID(
+            coilamps=np.abs(coil_weights),
+            coilphase=np.angle(coil_weights),
+            noisecovariance=cov,
+            bandwidth=1000,
+            points=1024,
+            chemicalshift=[-2, -3],
+            amplitude=[1, 1],
+            phase=[0, 0],
+            damping=[30, 30],
+            g=[0, 0],
+            nucleus='1H')
+        stack.append(np.asarray(fids).T)
+    stack = np.stack(stack)
+
+    comb_stack = combine.combine_FIDs_stack(stack, do_prewhiten=True, cov=cov)
+    assert comb_stack.shape == (2, 1024)
+    for fids, comb in zip(stack, comb_stack):
+        assert np.allclose(comb, combine.combine_FIDs(fids, 'svd', cov=cov, do_prewhiten=True))
+
+    comb_stack = combine.combine_FIDs_stack(stack)
+    for fids, comb in zip(stack, comb_stack):
+        assert np.allclose(comb, combine.combine_FIDs(fids, 'svd'))
+
+    assert np.allclose(combine.combine_FIDs_stack(stack[..., :1]), stack[..., 0])
+
+
 def test_single_coil_combine():
 
     fids, _ = syn.syntheticFID(
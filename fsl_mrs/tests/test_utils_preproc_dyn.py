@@ -6,6 +6,8 @@ Copyright Will Clarke, University of Oxford, 2021
 '''
 from pathlib import Path
 
+import numpy as np
+
 from fsl_mrs.utils.preproc import nifti_mrs_proc as nproc
 from fsl_mrs.utils.preproc import dyn_based_proc as dproc
 from fsl_mrs.utils.mrs_io import read_FID, read_basis
@@ -48,3 +50,30 @@ def test_dyn_align(tmp_path):
         == "fsl_mrs.utils.preproc.dyn_based_proc.align_by_dynamic_fit, "\
         "fitargs={'ppmlim': (0.2, 4.2), 'baseline_order': 1}."
     assert (tmp_path / 'align_report.html').is_file()
+
+
+def test_dyn_align_fast(tmp_path):
+    nmrs_obj = read_FID(metab)
+    nmrs_ref_obj = read_FID(wrefc)
+    nmrs_ref_obj = nproc.average(nmrs_ref_obj, 'DIM_DYN')
+
+    combined = nproc.coilcombine(nmrs_obj, reference=nmrs_ref_obj)
+
+    reduced_data, _ = split(combined, 'DIM_DYN', 4)
+
+    aligned_1 = nproc.align(reduced_data, 'DIM_DYN', ppmlim=(0.2, 4.2))
+
+    basis = btools.conjugate_basis(read_basis(basis_path))
+
+    fitargs = {'ppmlim': (0.2, 4.2), 'baseline_order': 1}
+    full = dproc.align_by_dynamic_fit(aligned_1, basis, fitargs=fitargs)
+    fast = dproc.align_by_dynamic_fit(aligned_1, basis, fitargs=fitargs, fast=True)
+
+    # Per-transient shifts and phases match the full dynamic fit
+    assert np.allclose(fast[1], full[1], atol=0.1)
+    assert np.allclose(fast[2], full[2], atol=0.02)
+    assert len(fast[3]) == 1
+
+    assert fast[0].hdr_ext['ProcessingApplied'][2]['Details']\
+        == "fsl_mrs.utils.preproc.dyn_based_proc.align_by_dynamic_fit, "\
+        "fitargs={'ppmlim': (0.2, 4.2), 'baseline_order': 1}, fast=True."
@@ -15,6 +15,7 @@ from fsl.data.image import Image
 from fsl_mrs.utils.preproc import mrsi
 from fsl_mrs.utils.mrs_io import read_FID
 from fsl_mrs.utils.synthetic import syntheticFID
+from fsl_mrs.utils.misc import FIDToSpec
 from fsl_mrs.core.nifti_mrs import create_nmrs
 
 
@@ -42,6 +43,15 @@ def test_xcorr_align(test_data):
     assert np.isclose(shifts[-1], -123.2 / 10, atol=1E0)
     assert sfids.shape == test_data.shape
 
+    # Without sub-point interpolation shifts are multiples of the padded resolution
+    _, shifts = mrsi.xcorr_align(test_data, 1 / 4000, interpolate=False)
+    resolution = 4000 / (2 * test_data.shape[1])
+    assert np.allclose(shifts / resolution, np.round(shifts / resolution))
+
+    # Interpolation improves precision
+    _, shifts = mrsi.xcorr_align(test_data, 1 / 4000, chunk_size=3)
+    assert np.isclose(shifts[-1] - shifts[0], -123.2 / 10, atol=1E-1)
+
 
 def test_phase_corr_max_real(test_data):
     pfids, phases = mrsi.phase_corr_max_real(test_data)
@@ -49,6 +59,13 @@ def test_phase_corr_max_real(test_data):
     assert np.allclose(np.abs(phases), [0, np.pi, 0, np.pi], atol=1E-1)
     assert pfids.shape == test_data.shape
 
+    # Closed form solution is the maximum of the summed real part
+    def real_sum(x):
+        return np.sum(FIDToSpec(x, axis=1)[:, 100:1000].real, axis=1)
+    pfids, phases = mrsi.phase_corr_max_real(test_data, limits=(100, 1000))
+    for dphs in (-1E-2, 1E-2):
+        assert np.all(real_sum(pfids) > real_sum(pfids * np.exp(1j * dphs)))
+
 
 # Integration tests for NIfTI-MRS objects
 testsPath = Path(__file__).parent
@@ -134,14 +151,6 @@ def lipid_test_data():
 def test_lipid_removal_l2(lipid_test_data):
     data, mask, basis = lipid_test_data
 
-    # Wrong shaped data
-    from fsl_mrs.core.nifti_mrs import merge, reorder
-    wrong_data = merge(
-        (reorder(data, ['DIM_DYN', None, None]), reorder(data, ['DIM_DYN', None, None])),
-        dimension='DIM_DYN')
-    with raises(ValueError):
-        mrsi.lipid_removal_l2(wrong_data, beta=1E-5, lipid_mask=mask, lipid_basis=None)
-
     # No mask or basis
     with raises(TypeError):
         mrsi.lipid_removal_l2(data)
@@ -167,3 +176,22 @@ def test_lipid_removal_l2(lipid_test_data):
 
     assert data_lipid_removed.shape == data.shape
     assert np.max(np.abs(data_lipid_removed[1, 1, 0, :])) < 10
+
+    # Matches the dense operator
+    lipid_inv = np.linalg.inv(np.eye(basis.shape[0]) + 1E-5 * (basis @ basis.T.conj()))
+    assert np.allclose(data_lipid_removed[:], np.einsum('ij,xyzj->xyzi', lipid_inv, data[:]))
+
+    # Truncated basis rank
+    with raises(ValueError):
+        mrsi.lipid_removal_l2(data, lipid_basis=basis, rank=0)
+    data_lipid_removed = mrsi.lipid_removal_l2(data, beta=1E-5, lipid_mask=mask, rank=1)
+    assert np.max(np.abs(data_lipid_removed[1, 1, 0, :])) < 10
+
+    # Higher dimensions
+    from fsl_mrs.core.nifti_mrs import merge, reorder
+    dyn_data = merge(
+        (reorder(data, ['DIM_DYN', None, None]), reorder(data, ['DIM_DYN', None, None])),
+        dimension='DIM_DYN')
+    dyn_lipid_removed = mrsi.lipid_removal_l2(dyn_data, beta=1E-5, lipid_basis=basis)
+    assert dyn_lipid_removed.shape == dyn_data.shape
+    assert np.allclose(dyn_lipid_removed[:, :, :, :, 1], mrsi.lipid_removal_l2(data, beta=1E-5, lipid_basis=basis)[:])
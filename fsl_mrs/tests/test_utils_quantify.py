@@ -254,3 +254,57 @@ def test_quantifyWater():
     assert np.allclose(res.getConc(scaling='internal'), 1.0)
     assert np.allclose(res.getConc(scaling='molarity'), 10.78, atol=3E-1)
     assert np.allclose(res.getConc(scaling='molality'), 10.78 * 1 / (0.6 * 0.78 + 0.4 * 0.65), atol=3E-1)
+
+
+def test_fit_water_refs():
+    t = np.arange(2048) / 4000
+    true_params = np.array([[4.0, 12.0, 5.0, 20.0, 0.1],
+                            [2.0, 0.0, 30.0, -50.0, -0.2],
+                            [10.0, 25.0, 0.0, 0.0, 0.0]])
+    fids = np.stack([quant._water_fid(t, *p) for p in true_params])
+
+    params = quant.fit_water_refs(t, fids)
+    assert np.allclose(params, true_params, atol=1E-4)
+
+
+def test_quantifyWaterBatch():
+    from fsl_mrs.utils.synthetic.synthetic_from_basis import syntheticFromBasisFile
+    from fsl_mrs.utils.synthetic import syntheticFID
+    basis_file = op.join(op.dirname(__file__), '../mmbasis/oldBasisSets/PRESS_3T_30ms.BASIS')
+    basis = mrsio.read_basis(basis_file)
+
+    np.random.seed(1)
+    mrs_list, res_list, q_list = [], [], []
+    for idx in range(3):
+        fid, mrs, _ = syntheticFromBasisFile(basis_file, noisecovariance=[[1E-4]], broadening=(8 + idx, 3),
+                                             points=2048, bandwidth=4000,
+                                             concentrations={'Mac': 3, 'Cr': 8 + idx})
+        water, _ = syntheticFID(noisecovariance=[[1E-2]], chemicalshift=[0.0], amplitude=[200 + 20 * idx],
+                                damping=[12 + idx], phase=[0.05 * idx], points=2048, bandwidth=4000,
+                                centralfrequency=mrs.centralFrequency / 1E6)
+        mrs.FID = fid.ravel()
+        mrs.H2O = np.asarray(water).ravel()
+        mrs.basis = basis
+        mrs.check_Basis(repair=True)
+        mrs.rescaleForFitting()
+        mrs_list.append(mrs)
+        res_list.append(fit_FSLModel(mrs, method='Newton', baseline_order=0))
+
+        q_info = quant.QuantificationInfo(0.03, 2.0, mrs.names, mrs.centralFrequency / 1E6)
+        if idx > 0:
+            q_info.set_fractions({'GM': 0.5, 'WM': 0.4, 'CSF': 0.1 * idx})
+        q_info.add_corr = 1 + 0.1 * idx
+        q_list.append(q_info)
+
+    molal, molar, ref_info = quant.quantifyWaterBatch(mrs_list, res_list, q_list)
+    for idx in range(3):
+        ref_molal, ref_molar, ref_ref_info = quant.quantifyWater(mrs_list[idx], res_list[idx], q_list[idx])
+        assert np.isclose(molal[idx], ref_molal, rtol=1E-3)
+        assert np.isclose(molar[idx], ref_molar, rtol=1E-3)
+        assert np.isclose(ref_info[idx]['metab_ref'].integral, ref_ref_info['metab_ref'].integral)
+        assert np.isclose(ref_info[idx]['water_ref'].integral, ref_ref_info['water_ref'].integral, rtol=1E-3)
+
+        # Results object accepts the precalculated scaling
+        res_list[idx].calculateConcScaling(mrs_list[idx], q_list[idx],
+                                           water_scaling=(molal[idx], molar[idx], ref_info[idx]))
+        assert np.isclose(res_list[idx].concScalings['molarity'], molar[idx])
@@ -4,3 +4,93 @@ Will Clarke, University of Oxford, March 2025
 """
 
 # Dynamic fitting report tested in fsl_mrs/tests/test_dynamic_dynmrs.py
+
+from pathlib import Path
+
+import numpy as np
+import plotly.graph_objects as go
+import pytest
+
+from fsl_mrs.utils import report
+from fsl_mrs.utils.synthetic.synthetic_from_basis import syntheticFromBasisFile
+from fsl_mrs.utils.fitting import fit_FSLModel
+
+basis_path = Path(__file__).parents[1] / 'mmbasis' / 'oldBasisSets' / 'PRESS_3T_30ms.BASIS'
+
+
+@pytest.fixture(scope='module')
+def svs_fit():
+    fids, mrs, _ = syntheticFromBasisFile(
+        str(basis_path),
+        noisecovariance=[[1E-3]],
+        broadening=(5, 5),
+        concentrations={'Mac': 2.0})
+    mrs.FID = fids
+    mrs.processForFitting()
+    res = fit_FSLModel(mrs, method='Newton', baseline='poly, 2')
+    return mrs, res
+
+
+def test_compact_figure():
+    y = np.linspace(0, 1, 100)
+    fig = go.Figure(go.Scatter(x=y, y=y))
+    fig.update_layout(
+        updatemenus=[dict(buttons=[dict(args=[{'y': [2 * y]}, [0]], method='restyle', label='a')])])
+    report.compact_figure(fig)
+
+    assert fig.data[0].y.dtype == np.float32
+    spec = fig.layout.updatemenus[0].buttons[0].args[0]['y'][0]
+    assert spec['dtype'] == 'f4'
+    import base64
+    assert np.allclose(np.frombuffer(base64.b64decode(spec['bdata']), dtype='<f4'), 2 * y)
+
+
+def test_include_panel():
+    assert report.include_panel('basis', False, None)
+    assert not report.include_panel('basis', True, None)
+    assert report.include_panel('basis', True, ['basis'])
+    assert not report.include_panel('metabs', False, ['basis'])
+
+
+def test_write_plotly_bundle(tmp_path):
+    bundle = report.write_plotly_bundle(tmp_path / 'assets')
+    assert bundle.is_file()
+    assert bundle.name.startswith('plotly-')
+    mtime = bundle.stat().st_mtime_ns
+    assert report.write_plotly_bundle(tmp_path / 'assets') == bundle
+    assert bundle.stat().st_mtime_ns == mtime
+
+
+def test_light_svs_report(tmp_path, svs_fit):
+    mrs, res = svs_fit
+
+    report.create_svs_report(mrs, res, tmp_path / 'full.html', 'fid', 'basis', None, 'date')
+    (tmp_path / 'sub').mkdir()
+    report.create_svs_report(
+        mrs, res, tmp_path / 'sub' / 'light.html', 'fid', 'basis', None, 'date',
+        light=True, assets=tmp_path / 'assets')
+    report.create_svs_report(
+        mrs, res, tmp_path / 'sub' / 'light_basis.html', 'fid', 'basis', None, 'date',
+        light=True, assets=tmp_path / 'assets', panels=['basis'])
+
+    with open(tmp_path / 'full.html') as fp:
+        full = fp.read()
+    with open(tmp_path / 'sub' / 'light.html') as fp:
+        light = fp.read()
+    with open(tmp_path / 'sub' / 'light_basis.html') as fp:
+        light_basis = fp.read()
+
+    # Single shared library
+    bundles = list((tmp_path / 'assets').glob('plotly-*.min.js'))
+    assert len(bundles) == 1
+    assert f'<script src="../assets/{bundles[0].name}"></script>' in light
+    assert 'cdn.plot.ly' not in light
+    assert 'cdn.plot.ly' in full
+
+    # Optional panels
+    assert 'name="uncertainty"' in full and 'name="metabs"' in full
+    assert 'name="uncertainty"' not in light and 'name="basis"' not in light
+    assert 'name="basis"' in light_basis and 'name="metabs"' not in light_basis
+    assert 'name="qc"' in light
+
+    assert len(light) < len(full) / 2
@@ -0,0 +1,140 @@
+"""Test the results index (fsl_mrs.utils.results_index)
+
+Copyright (C) 2026 University of Oxford"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from fsl_mrs.utils import results_index as ri
+from fsl_mrs.utils.fmrs_tools import create_contrasts, Contrast
+
+metabs = ['Cr', 'NAA', 'PCr']
+
+
+def write_svs_results(folder, seed):
+    """Write the tabular outputs of a fsl_mrs fit"""
+    rng = np.random.default_rng(seed)
+    folder.mkdir(parents=True)
+    conc = pd.DataFrame(
+        rng.random((3, 4)),
+        index=pd.Index(metabs, name='Metabs'),
+        columns=pd.MultiIndex.from_product([['mean', 'std'], ['raw', 'internal']]))
+    conc.to_csv(folder / 'concentrations.csv')
+    pd.DataFrame({'Metab': metabs, 'SNR': rng.random(3), 'FWHM': rng.random(3)})\
+        .to_csv(folder / 'qc.csv', index=False)
+    pd.DataFrame({'parameter': metabs + ['gamma_0'], 'mean': rng.random(4), 'std': rng.random(4)})\
+        .to_csv(folder / 'all_parameters.csv', index=False)
+    with open(folder / 'options.txt', 'w') as fp:
+        fp.write(json.dumps({'algo': 'Newton', 'seed': seed}))
+        fp.write('\n--------\n')
+    return conc
+
+
+def write_dyn_results(folder, seed):
+    """Write the tabular outputs of a fsl_dynmrs fit"""
+    rng = np.random.default_rng(seed)
+    folder.mkdir(parents=True)
+    free = [f'conc_{m}_{b}' for m in metabs for b in ('beta0', 'beta1')] + ['gamma_0', 'eps_0']
+    values = pd.DataFrame(rng.random((1, len(free))), columns=free)
+    values.to_csv(folder / 'dyn_results.csv')
+    cov = 1E-4 * np.eye(len(free)) + 1E-5
+    cov_df = pd.DataFrame(cov, index=free, columns=free)
+    cov_df.iloc[0, 1] = np.nan
+    cov_df.to_csv(folder / 'dyn_cov.csv')
+    pd.concat((values.mean(), pd.Series(np.sqrt(np.diag(cov)), index=free)), axis=1, keys=['mean', 'sd'])\
+        .to_csv(folder / 'free_parameters.csv')
+    mapped = [f'conc_{m}' for m in metabs] + ['gamma_0', 'eps_0']
+    pd.DataFrame(
+        rng.random((len(mapped), 4)),
+        index=mapped,
+        columns=pd.MultiIndex.from_product([['0.0', '1.0'], ['mean', 'std']]))\
+        .to_csv(folder / 'mapped_parameters.csv')
+    return values, cov_df
+
+
+def test_find_results(tmp_path):
+    write_svs_results(tmp_path / 'sub0' / 'fit', 0)
+    write_dyn_results(tmp_path / 'sub1' / 'dyn', 1)
+    (tmp_path / 'sub2').mkdir()
+
+    assert ri.find_results(tmp_path) == [tmp_path / 'sub0' / 'fit', tmp_path / 'sub1' / 'dyn']
+    assert ri.find_results(tmp_path, kind='svs') == [tmp_path / 'sub0' / 'fit']
+    assert ri.result_kind(tmp_path / 'sub1' / 'dyn') == 'dynamic'
+    assert ri.result_kind(tmp_path / 'sub2') is None
+
+
+def test_svs_index(tmp_path):
+    concs = [write_svs_results(tmp_path / f'sub{idx}', idx) for idx in range(3)]
+    folders = ri.find_results(tmp_path)
+
+    with ri.ResultsIndex(tmp_path / 'index.sqlite') as index:
+        assert len(index.update(folders)) == 3
+        assert len(index) == 3
+        assert index.options(folders[1]) == {'algo': 'Newton', 'seed': 1}
+
+        # Round trip of the original table
+        conc = index.table('concentrations', folders[0])
+        assert np.allclose(conc.to_numpy(), concs[0].to_numpy())
+        assert conc.index.to_list() == metabs
+        assert conc.columns.to_list() == concs[0].columns.to_list()
+        assert index.table('parameters', folders[0]).index.to_list() == metabs + ['gamma_0']
+        assert index.table('qc', folders[0]).columns.to_list() == ['SNR', 'FWHM']
+
+        # Matches the combined dataframe used by fsl_mrs_summarise
+        conc_df = index.concentrations(folders, names=['a', 'b', 'c'])
+        assert conc_df.index.names == ['Metabolite', 'dataset']
+        assert np.isclose(conc_df.loc[('NAA', 'c'), ('mean', 'internal')], concs[2].loc['NAA', ('mean', 'internal')])
+        assert index.qc().shape == (9, 2)
+
+        # SQL queries
+        naa = index.query(
+            "SELECT value FROM concentrations WHERE metabolite = 'NAA' AND measure = 'mean' AND scaling = 'raw'")
+        assert naa.shape == (3, 1)
+
+    # Reopen, only changed folders are re-read
+    with ri.ResultsIndex(tmp_path / 'index.sqlite') as index:
+        assert index.update(folders) == []
+
+        new_conc = concs[1] * 2
+        new_conc.to_csv(folders[1] / 'concentrations.csv')
+        stat = os.stat(folders[1] / 'concentrations.csv')
+        os.utime(folders[1] / 'concentrations.csv', ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+        assert index.update(folders) == [folders[1].resolve()]
+        assert np.allclose(index.table('concentrations', folders[1]).to_numpy(), new_conc.to_numpy())
+        assert index.folders() == [fp.resolve() for fp in folders]
+
+        # Deleted results are removed on refresh
+        (folders[2] / 'concentrations.csv').unlink()
+        index.refresh()
+        assert folders[2] not in index
+        assert len(index) == 2
+
+        with pytest.raises(ri.ResultsIndexError):
+            index.table('concentrations', folders[2])
+        with pytest.raises(ri.ResultsIndexError):
+            index.update([tmp_path])
+
+
+def test_dynamic_index(tmp_path):
+    values, cov = write_dyn_results(tmp_path / 'sub0', 0)
+
+    index = ri.ResultsIndex()
+    index.update([tmp_path / 'sub0'])
+    value_df, cov_df, mapped = index.dynamic_results(tmp_path / 'sub0')
+    assert np.allclose(value_df.to_numpy(), values.to_numpy())
+    assert value_df.index.to_list() == [0]
+    assert np.allclose(cov_df.to_numpy(), cov.to_numpy(), equal_nan=True)
+    assert mapped.to_list() == ['conc_Cr', 'conc_NAA', 'conc_PCr', 'gamma_0', 'eps_0']
+    assert index.table('mapped_parameters', tmp_path / 'sub0').columns.nlevels == 2
+
+    # fmrs_tools reads from the index
+    contrasts = [Contrast('mean', ['beta0', 'beta1'], [0.5, 0.5])]
+    from_files = create_contrasts(tmp_path / 'sub0', contrasts=contrasts, metabolites_to_combine=[['Cr', 'PCr']])
+    from_index = create_contrasts(
+        tmp_path / 'sub0', contrasts=contrasts, metabolites_to_combine=[['Cr', 'PCr']], index=index)
+    assert from_files[3] == from_index[3]
+    assert np.allclose(from_files[2].to_numpy(), from_index[2].to_numpy(), equal_nan=True)
@@ -1,3 +1,3 @@
 from .contrasts import create_contrasts, Contrast
-from .flame import flameo_wrapper
+from .flame import flameo_wrapper, group_glm
 from .scalings import fmrs_internal_reference
@@ -249,7 +249,7 @@ def _combine_params(values, covariance, metabolite_comb, contrasts, metabolites)
     return new_value_df, new_cov_df, list(new_var.keys())
 
 
-def create_contrasts(results, contrasts=[], metabolites_to_combine=[], output_dir=None, full_load=False):
+def create_contrasts(results, contrasts=[], metabolites_to_combine=[], output_dir=None, full_load=False, index=None):
     """Generate contrasts from dynamic fMRS fit.
 
     Contrasts are (scaled) linear combinations of GLM betas. Applied at the first level.
@@ -264,6 +264,8 @@ def create_contrasts(results, contrasts=[], metabolites_to_combine=[], output_di
     :type output_dir: str or pathlib.Path, optional
     :param full_load: Load the full results object from file, defaults to False
     :type full_load: Bool, optional
+    :param index: Results index to read saved results from, defaults to None
+    :type index: fsl_mrs.utils.results_index.ResultsIndex, optional
     :return values_out: Expanded free parameter results dataframe
     :rtype: pandas.Dataframe
     :return covariance_out: Expanded covariance matrix (off-diagonals of new parameters are Nan)
@@ -273,7 +275,7 @@ def create_contrasts(results, contrasts=[], metabolites_to_combine=[], output_di
     :return new_params: List of parameter names added by function
     :rtype: list
     """
-    value_df, cov_df, metabolites = utils.load_dyn_res(results)
+    value_df, cov_df, metabolites = utils.load_dyn_res(results, index=index)
 
     # Run the combination
     values_out, covariance_out, new_params = _combine_params(
@@ -1,4 +1,6 @@
-"""Module for wrapping FSL FLAME tool for higher level analysis of fMRS data.
+"""Module for higher level (group) analysis of fMRS data.
+
+    Contains a wrapper for the FSL FLAME tool and a native (NumPy) implementation of the group GLM.
 
     Author: Will Clarke <william.clarke@ndcn.ox.ac.uk>
             Saad Jbabdi <saad@fmrib.ox.ac.uk>
@@ -18,7 +20,22 @@ from fsl.data.vest import generateVest
 from fsl.data.image import Image
 
 
-def flameo_wrapper(cope, varcope, design_mat=None, contrast_mat=None, covariance_mat=None, ftests=None, verbose=False):
+RUN_MODES = ('flame1', 'ols', 'fe')
+
+
+def _check_2d(mat, T=True):
+    mat = np.asarray(mat)
+    if mat.ndim == 1:
+        if T:
+            return np.atleast_2d(mat).T
+        else:
+            return np.atleast_2d(mat)
+    else:
+        return mat
+
+
+def flameo_wrapper(cope, varcope, design_mat=None, contrast_mat=None, covariance_mat=None, ftests=None, verbose=False,
+                   runmode='flame1'):
     """Wrapper around FSL FLAMEO for fMRS group analysis
 
     Apply FLAME stage 1 method (https://www.fmrib.ox.ac.uk/datasets/techrep/tr04ss2/tr04ss2/node4.html) to
@@ -37,6 +54,10 @@ def flameo_wrapper(cope, varcope, design_mat=None, contrast_mat=None, covariance
     :type covariance_mat: np.array, optional
     :param ftests: Vector of f-test selections, defaults to np.zeros((1, ncontrasts))
     :type ftests: np.array, optional
+    :param verbose: Print flameo output, defaults to False
+    :type verbose: bool, optional
+    :param runmode: flameo run mode, 'flame1' (mixed effects), 'ols' or 'fe' (fixed effects), defaults to 'flame1'
+    :type runmode: str, optional
     :return: Output p values
     :rtype: np.array
     :return: Output z statistics
@@ -48,37 +69,30 @@ def flameo_wrapper(cope, varcope, design_mat=None, contrast_mat=None, covariance
     :return: Output group-level f-tests results. Dict of f, zf stats and p values
     :rtype: dict or None
     """
+    if runmode not in RUN_MODES:
+        raise ValueError(f'runmode must be one of {RUN_MODES}, not {runmode}.')
 
     nsubjects = cope.shape[0]
     nparams   = cope.shape[1]
     mats = {}
 
-    def check_2d(mat, T=True):
-        if mat.ndim == 1:
-            if T:
-                return np.atleast_2d(mat).T
-            else:
-                return np.atleast_2d(mat)
-        else:
-            return mat
-
     if design_mat is None:
         mats['desmat'] = np.ones((nsubjects, 1))
     else:
-        mats['desmat'] = check_2d(design_mat)
+        mats['desmat'] = _check_2d(design_mat)
 
     if contrast_mat is None:
         mats['conmat'] = np.ones((1, 1))
     else:
-        mats['conmat'] = check_2d(contrast_mat)
+        mats['conmat'] = _check_2d(contrast_mat)
 
     if covariance_mat is None:
         mats['covmat'] = np.ones((nsubjects, 1))
     else:
-        mats['covmat'] = check_2d(covariance_mat)
+        mats['covmat'] = _check_2d(covariance_mat)
 
     if ftests is not None:
-        mats['fmat'] = check_2d(ftests, T=False)
+        mats['fmat'] = _check_2d(ftests, T=False)
         print(mats['fmat'])
         ncontrasts = mats['conmat'].shape[0]
         if mats['fmat'].shape[1] != ncontrasts:
@@ -113,7 +127,7 @@ def flameo_wrapper(cope, varcope, design_mat=None, contrast_mat=None, covariance
             f'--dm={str(tmp / "desmat")}',  # design matrix file
             f'--tc={str(tmp / "conmat")}',  # file containing matrix specifying the t contrasts
             f'--cs={str(tmp / "covmat")}',  # file containing matrix specifying the covariance groups
-            '--runmode=flame1',  # (mixed effects - FLAME stage 1)
+            f'--runmode={runmode}',  # flame1: mixed effects - FLAME stage 1
             '--sdof=-1']
 
         if ftests is not None:
@@ -166,3 +180,222 @@ def flameo_wrapper(cope, varcope, design_mat=None, contrast_mat=None, covariance
             fout = None
 
     return np.stack(p), np.stack(z), np.stack(out_cope), np.stack(out_varcope), fout
+
+
+def group_glm(cope, varcope, design_mat=None, contrast_mat=None, covariance_mat=None, ftests=None, runmode='flame1'):
+    """Native (NumPy) group GLM for fMRS group analysis
+
+    Equivalent inputs and outputs to flameo_wrapper, but fitted in-process and vectorised across all parameters.
+    Three estimators are available:
+
+    - 'fe': fixed effects, subjects weighted by the inverse of their varcope, z statistics from the normal distribution.
+    - 'ols': ordinary least squares, varcopes are ignored and a single residual variance is estimated.
+    - 'flame1': mixed effects, the between-subject variance of each covariance group is estimated
+      by maximising the marginal (restricted) likelihood, following FLAME stage 1.
+      Subjects are weighted by the inverse of the sum of varcope and between-subject variance.
+
+    For 'ols' and 'flame1' t and F statistics use n - p degrees of freedom before conversion to z.
+    flameo_wrapper can be used as a reference to validate results.
+
+    :param cope: subjects x params numpy array of betas
+    :type cope: np.array
+    :param varcope: subjects x params numpy array of variances
+    :type varcope: np.array
+    :param design_mat: Group analysis design matrix, defaults to np.ones((nsubjects, 1))
+    :type design_mat: np.array, optional
+    :param contrast_mat: Group analysis contrasts matrix, defaults to np.ones((1, 1))
+    :type contrast_mat: np.array, optional
+    :param covariance_mat: Vector of covariance group assignments, defaults to np.ones((nsubjects, 1))
+    :type covariance_mat: np.array, optional
+    :param ftests: Vector of f-test selections, defaults to np.zeros((1, ncontrasts))
+    :type ftests: np.array, optional
+    :param runmode: Estimator, 'flame1' (mixed effects), 'ols' or 'fe' (fixed effects), defaults to 'flame1'
+    :type runmode: str, optional
+    :return: Output p values
+    :rtype: np.array
+    :return: Output z statistics
+    :rtype: np.array
+    :return: Output group-level COPEs
+    :rtype: np.array
+    :return: Output group-level VARCOPEs
+    :rtype: np.array
+    :return: Output group-level f-tests results. Dict of f, zf stats and p values
+    :rtype: dict or None
+    """
+    if runmode not in RUN_MODES:
+        raise ValueError(f'runmode must be one of {RUN_MODES}, not {runmode}.')
+
+    cope = _check_2d(np.asarray(cope, dtype=float))
+    varcope = _check_2d(np.asarray(varcope, dtype=float))
+    nsubjects = cope.shape[0]
+    if varcope.shape != cope.shape:
+        raise ValueError(f'varcope shape {varcope.shape} must match cope shape {cope.shape}.')
+
+    if design_mat is None:
+        design_mat = np.ones((nsubjects, 1))
+    design_mat = _check_2d(np.asarray(design_mat, dtype=float))
+    if contrast_mat is None:
+        contrast_mat = np.ones((1, 1))
+    contrast_mat = _check_2d(np.asarray(contrast_mat, dtype=float))
+    if covariance_mat is None:
+        covariance_mat = np.ones((nsubjects, 1))
+    groups = np.asarray(covariance_mat).ravel()
+
+    nregressors = design_mat.shape[1]
+    if design_mat.shape[0] != nsubjects:
+        raise ValueError(f'The design matrix first dim ({design_mat.shape[0]}) '
+                         f'must match the number of subjects ({nsubjects}).')
+    if contrast_mat.shape[1] != nregressors:
+        raise ValueError(f'The contrast matrix second dim ({contrast_mat.shape[1]}) '
+                         f'must match the number of regressors ({nregressors}).')
+    if groups.size != nsubjects:
+        raise ValueError(f'The covariance group vector ({groups.size}) '
+                         f'must match the number of subjects ({nsubjects}).')
+    if ftests is not None:
+        ftests = _check_2d(ftests, T=False)
+        if ftests.shape[1] != contrast_mat.shape[0]:
+            raise ValueError(
+                f'The ftests matrix second dim ({ftests.shape[1]}) '
+                f'must match the number of contrasts ({contrast_mat.shape[0]}).')
+
+    if runmode == 'fe':
+        if (varcope <= 0).any():
+            raise ValueError('Fixed effects analysis requires positive varcopes.')
+        beta, cov = _wls(cope, varcope, design_mat)
+        dof = np.inf
+    elif runmode == 'ols':
+        beta, cov = _wls(cope, np.ones_like(cope), design_mat)
+        residuals = cope - design_mat @ beta.T
+        dof = nsubjects - nregressors
+        sigma2 = (residuals ** 2).sum(axis=0) / dof
+        cov *= sigma2[:, np.newaxis, np.newaxis]
+    else:
+        if (varcope < 0).any():
+            raise ValueError('varcopes must not be negative.')
+        s2 = _flame1_variances(cope, varcope, design_mat, groups)
+        beta, cov = _wls(cope, np.maximum(varcope + s2, _variance_floor(cope, varcope)), design_mat)
+        dof = nsubjects - nregressors
+
+    if dof <= 0:
+        raise ValueError(f'Insufficient subjects ({nsubjects}) for a design with {nregressors} regressors.')
+
+    # Contrasts: ncontrasts x params
+    out_cope = contrast_mat @ beta.T
+    out_varcope = np.einsum('ci,pij,cj->cp', contrast_mat, cov, contrast_mat)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tstat = np.where(out_varcope > 0, out_cope / np.sqrt(out_varcope), 0.0)
+    z = _t2z(tstat, dof)
+    p = scipy.stats.norm.sf(z)
+
+    if ftests is None:
+        return p, z, out_cope, out_varcope, None
+
+    f = []
+    for selection in ftests:
+        con = contrast_mat[selection.astype(bool)]
+        ccope = con @ beta.T
+        ccov = np.einsum('ci,pij,dj->pcd', con, cov, con)
+        f.append(np.einsum('cp,pc->p', ccope, np.linalg.solve(ccov, ccope.T[..., np.newaxis])[..., 0]) / con.shape[0])
+    f = np.stack(f)
+    nsel = ftests.astype(bool).sum(axis=1)[:, np.newaxis]
+    if np.isinf(dof):
+        pf = scipy.stats.chi2.sf(f * nsel, nsel)
+    else:
+        pf = scipy.stats.f.sf(f, nsel, dof)
+    zf = scipy.stats.norm.isf(pf)
+    return p, z, out_cope, out_varcope, {'f-stat': f, 'zf-stat': zf, 'p': pf}
+
+
+def _wls(cope, variance, design_mat):
+    """Weighted least squares fit of each parameter (column) with weights of 1/variance.
+
+    :return: Betas (params x regressors), beta covariance (params x regressors x regressors)
+    """
+    weights = 1 / variance
+    xtwx = np.einsum('np,ni,nj->pij', weights, design_mat, design_mat)
+    xtwy = np.einsum('np,ni,np->pi', weights, design_mat, cope)
+    cov = np.linalg.inv(xtwx)
+    beta = np.einsum('pij,pj->pi', cov, xtwy)
+    return beta, cov
+
+
+def _neg_log_marginal(cope, variance, design_mat):
+    """Negative log restricted (beta marginalised) likelihood for each parameter, up to a constant."""
+    weights = 1 / variance
+    xtwx = np.einsum('np,ni,nj->pij', weights, design_mat, design_mat)
+    xtwy = np.einsum('np,ni,np->pi', weights, design_mat, cope)
+    beta = np.linalg.solve(xtwx, xtwy[..., np.newaxis])[..., 0]
+    residuals = cope - design_mat @ beta.T
+    _, logdet = np.linalg.slogdet(xtwx)
+    nll = 0.5 * (np.log(variance).sum(axis=0) + logdet + (weights * residuals ** 2).sum(axis=0))
+    return np.nan_to_num(nll, nan=np.inf)
+
+
+def _flame1_variances(cope, varcope, design_mat, groups, ngrid=36, niter=40, ncycles=3):
+    """Estimate the between-subject variance of each covariance group and parameter.
+
+    Each group variance is found by a grid search followed by golden section refinement (in log space),
+    run simultaneously for all parameters. Multiple groups are estimated by coordinate descent.
+
+    :return: Between-subject variance for each subject and parameter (subjects x params)
+    """
+    labels, group_idx = np.unique(groups, return_inverse=True)
+    nparams = cope.shape[1]
+
+    # Scale of the search for each parameter, variance estimates below the lower limit are set to zero.
+    scale = _variance_scale(cope, varcope)
+    floor = _variance_floor(cope, varcope)
+    log_grid = np.linspace(-6, 1, ngrid)
+
+    s2 = np.zeros((labels.size, nparams))
+    cycles = 1 if labels.size == 1 else ncycles
+
+    def nll(group, value):
+        trial = s2.copy()
+        trial[group] = value
+        return _neg_log_marginal(cope, np.maximum(varcope + trial[group_idx], floor), design_mat)
+
+    for _ in range(cycles):
+        for grp in range(labels.size):
+            # Coarse grid, including zero
+            costs = np.stack([nll(grp, 0.0)] + [nll(grp, scale * 10 ** lg) for lg in log_grid])
+            best = costs.argmin(axis=0)
+
+            # Golden section search between the neighbours of the best grid point
+            lo = log_grid[np.clip(best - 2, 0, ngrid - 1)]
+            hi = log_grid[np.clip(best, 0, ngrid - 1)]
+            ratio = (np.sqrt(5) - 1) / 2
+            x1 = hi - ratio * (hi - lo)
+            x2 = lo + ratio * (hi - lo)
+            f1 = nll(grp, scale * 10 ** x1)
+            f2 = nll(grp, scale * 10 ** x2)
+            for _ in range(niter):
+                left = f1 < f2
+                hi = np.where(left, x2, hi)
+                lo = np.where(left, lo, x1)
+                x1, x2 = np.where(left, hi - ratio * (hi - lo), x2), np.where(left, x1, lo + ratio * (hi - lo))
+                fnew = nll(grp, scale * 10 ** np.where(left, x1, x2))
+                f1, f2 = np.where(left, fnew, f2), np.where(left, f1, fnew)
+            refined = scale * 10 ** ((lo + hi) / 2)
+            s2[grp] = np.where(nll(grp, refined) < costs[0], refined, 0.0)
+
+    return s2[group_idx]
+
+
+def _variance_scale(cope, varcope):
+    """Typical variance of each parameter, used to scale the between-subject variance search."""
+    scale = cope.var(axis=0) + varcope.mean(axis=0)
+    scale[scale <= 0] = 1.0
+    return scale
+
+
+def _variance_floor(cope, varcope):
+    """Minimum total variance of each parameter, avoiding infinite weights where varcopes are zero."""
+    return 1E-12 * _variance_scale(cope, varcope)
+
+
+def _t2z(tstat, dof):
+    """Convert t statistics to z statistics preserving precision in the tails."""
+    if np.isinf(dof):
+        return tstat
+    return np.sign(tstat) * scipy.stats.norm.isf(scipy.stats.t.sf(np.abs(tstat), dof))
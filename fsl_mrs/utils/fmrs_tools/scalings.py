@@ -11,27 +11,50 @@ import numpy as np
 from fsl_mrs.utils.fmrs_tools import utils
 
 
-def fmrs_internal_reference(results, reference_contrast, output_dir=None, samples=1E5):
-    """_summary_
+COVARIANCE_METHODS = ('delta', 'montecarlo')
+
+
+def fmrs_internal_reference(results, reference_contrast, output_dir=None, method='delta',
+                            samples=1E6, chunk_size=1E4, rtol=1E-2, seed=None):
+    """Scale fMRS concentration parameters to a reference contrast.
 
     Parameters are scaled to a named contrast (typically a concentration parameter).
 
-    Calculation of the scaled covariance matrix is done using Gaussian sampling.
-    The analytical calculation of ratios to correlated parameters remains difficult.
-    Number of samples set to default of 1E5, but can be increased.
-
-    :param results: _description_
-    :type results: _type_
-    :param reference_contrast: _description_
-    :type reference_contrast: _type_
-    :param output_dir: _description_
-    :type output_dir: _type_, optional
-    :param samples: _description_, defaults to 1E5
-    :type samples: _type_, optional
-    :raises ValueError: _description_
-    :return: _description_
-    :rtype: _type_
+    By default the covariance of the scaled parameters is calculated by the (first-order) delta method,
+    i.e. propagating the covariance through the Jacobian of the ratio transform evaluated at the mean values.
+    Alternatively the covariance can be estimated by Gaussian (Monte Carlo) sampling.
+    Samples are drawn in chunks until the parameter standard deviations change by less than rtol
+    between chunks, or the maximum number of samples is reached.
+
+    :param results: Dynamic fitting results directory
+    :type results: str or pathlib.Path
+    :param reference_contrast: Name of the parameter to scale to, e.g. 'conc_Cr_beta0'
+    :type reference_contrast: str
+    :param output_dir: Location to save outputs, defaults to None
+    :type output_dir: pathlib.Path, optional
+    :param method: Covariance calculation, 'delta' or 'montecarlo', defaults to 'delta'
+    :type method: str, optional
+    :param samples: Maximum number of Monte Carlo samples, defaults to 1E6
+    :type samples: int, optional
+    :param chunk_size: Number of Monte Carlo samples drawn per chunk, defaults to 1E4
+    :type chunk_size: int, optional
+    :param rtol: Relative tolerance on the standard deviations for Monte Carlo convergence, defaults to 1E-2
+    :type rtol: float, optional
+    :param seed: Seed or numpy Generator for Monte Carlo sampling, defaults to None
+    :type seed: int or numpy.random.Generator, optional
+    :raises ValueError: If reference_contrast is not a parameter, or method is not recognised
+    :return values: Scaled free parameter results dataframe
+    :rtype: pandas.Dataframe
+    :return covariance: Scaled covariance matrix
+    :rtype: pandas.Dataframe
+    :return summary_df: New free_parameters.csv with parameter means and std.
+    :rtype: pandas.Dataframe
+    :return new_params: Empty list, no parameters are added
+    :rtype: list
     """
+    if method not in COVARIANCE_METHODS:
+        raise ValueError(f'method must be one of {COVARIANCE_METHODS}, not {method}.')
+
     value_df, cov_df, _ = utils.load_dyn_res(results, mapped_p=False)
     all_contrasts = list(value_df.columns)
 
@@ -53,13 +76,99 @@ def fmrs_internal_reference(results, reference_contrast, output_dir=None, sample
     # Calculate covariance
     denom_index = all_contrasts.index(reference_contrast)
     conc_index = [all_contrasts.index(x) for x in conc_columns]
-    rng = np.random.default_rng()
-    # Use 1E5 samples, possibly needs scaling for different size covariance matrices/noise levels
-    samples = rng.multivariate_normal(
-        value_df.mean().to_numpy(),
-        np.nan_to_num(cov_df.to_numpy()),
-        int(samples)).T
-    samples[conc_index, :] /= samples[denom_index, :]
-    cov_df.loc[:, :] = np.cov(samples)
+    mean = value_df.mean().to_numpy()
+    cov = np.nan_to_num(cov_df.to_numpy())
+    if method == 'delta':
+        cov_df.loc[:, :] = ratio_covariance_delta(mean, cov, conc_index, denom_index)
+    else:
+        cov_df.loc[:, :] = ratio_covariance_montecarlo(
+            mean, cov, conc_index, denom_index,
+            samples=samples, chunk_size=chunk_size, rtol=rtol, seed=seed)
 
     return utils.save_and_return_new_res(new_value_df, cov_df, [], output_dir)
+
+
+def ratio_covariance_delta(mean, cov, num_index, denom_index):
+    """Covariance of parameters after division of a subset by a reference parameter, by the delta method.
+
+    Parameters at num_index (which may include denom_index) are divided by the parameter at denom_index,
+    other parameters are unchanged.
+
+    :param mean: Parameter values
+    :type mean: numpy.ndarray
+    :param cov: Parameter covariance matrix
+    :type cov: numpy.ndarray
+    :param num_index: Indices of parameters to scale
+    :type num_index: list
+    :param denom_index: Index of the reference parameter
+    :type denom_index: int
+    :return: Covariance of the transformed parameters
+    :rtype: numpy.ndarray
+    """
+    jacobian = np.eye(mean.size)
+    num_index = np.asarray(num_index, dtype=int)
+    jacobian[num_index, num_index] = 1 / mean[denom_index]
+    jacobian[num_index, denom_index] -= mean[num_index] / mean[denom_index]**2
+    return jacobian @ cov @ jacobian.T
+
+
+def ratio_covariance_montecarlo(mean, cov, num_index, denom_index,
+                                samples=1E6, chunk_size=1E4, rtol=1E-2, seed=None):
+    """Covariance of parameters after division of a subset by a reference parameter, by Gaussian sampling.
+
+    Samples are drawn in chunks, accumulating the sample covariance, until the standard deviations change
+    by less than rtol between chunks or samples have been drawn. A warning is raised if not converged.
+
+    :param mean: Parameter values
+    :type mean: numpy.ndarray
+    :param cov: Parameter covariance matrix
+    :type cov: numpy.ndarray
+    :param num_index: Indices of parameters to scale
+    :type num_index: list
+    :param denom_index: Index of the reference parameter
+    :type denom_index: int
+    :param samples: Maximum number of samples, defaults to 1E6
+    :type samples: int, optional
+    :param chunk_size: Samples per chunk, defaults to 1E4
+    :type chunk_size: int, optional
+    :param rtol: Relative tolerance on the standard deviations, defaults to 1E-2
+    :type rtol: float, optional
+    :param seed: Seed or numpy Generator, defaults to None
+    :type seed: int or numpy.random.Generator, optional
+    :return: Covariance of the transformed parameters
+    :rtype: numpy.ndarray
+    """
+    rng = np.random.default_rng(seed)
+    chunk_size = int(chunk_size)
+    samples = max(int(samples), chunk_size)
+
+    # Accumulate sums of samples shifted by the ratio of means, for numerical stability
+    shift = mean.copy()
+    shift[num_index] /= mean[denom_index]
+    total = np.zeros(mean.size)
+    outer = np.zeros((mean.size, mean.size))
+    count = 0
+    prev_sd = None
+    converged = False
+    while count < samples:
+        draws = rng.multivariate_normal(mean, cov, min(chunk_size, samples - count))
+        draws[:, num_index] /= draws[:, [denom_index]]
+        draws -= shift
+        total += draws.sum(axis=0)
+        outer += draws.T @ draws
+        count += draws.shape[0]
+
+        centred = total / count
+        cov_est = (outer - count * np.outer(centred, centred)) / (count - 1)
+        sd = np.sqrt(np.clip(np.diag(cov_est), 0, None))
+        if prev_sd is not None:
+            nonzero = sd > 0
+            if (np.abs(sd - prev_sd)[nonzero] <= rtol * sd[nonzero]).all():
+                converged = True
+                break
+        prev_sd = sd
+
+    if not converged:
+        import warnings
+        warnings.warn(f'Monte Carlo ratio covariance not converged after {count} samples.')
+    return cov_est
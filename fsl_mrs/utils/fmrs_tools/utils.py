@@ -16,12 +16,17 @@ import numpy as np
 import fsl_mrs.dynamic.dyn_results as dres
 
 
-def load_dyn_res(results, full_load=False, mapped_p=True):
+def load_dyn_res(results, full_load=False, mapped_p=True, index=None):
     # Load data
     if isinstance(results, (dres.dynRes_mcmc, dres.dynRes_newton)):
         value_df = results.dataframe_free
         cov_df = results.cov_free
         mapped_params = results.mapped_names
+    elif index is not None and results in index:
+        # Read from a results index (fsl_mrs.utils.results_index.ResultsIndex)
+        value_df, cov_df, mapped_params = index.dynamic_results(results)
+        if not mapped_p:
+            mapped_params = []
     elif isinstance(results, (str, Path)):
         if isinstance(results, str):
             results = Path(results)
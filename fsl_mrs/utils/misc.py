@@ -982,3 +982,29 @@ def create_rel_symlink(dst, src, name, match_ext=True):
     else:
         with _cd(src):
             os.symlink(relpath, name)
+
+
+# Concurrency
+
+def thread_map(func, items, workers=None):
+    """Apply func to each item using a pool of threads, returning results in order.
+
+    Intended for I/O bound operations, e.g. reading a folder of files.
+    Runs serially for fewer than two items or if workers is 1.
+
+    :param func: Function to apply
+    :type func: callable
+    :param items: Items to apply func to
+    :type items: iterable
+    :param workers: Maximum number of threads, defaults to None (concurrent.futures default)
+    :type workers: int, optional
+    :return: List of func outputs
+    :rtype: list
+    """
+    items = list(items)
+    if len(items) < 2 or workers == 1:
+        return [func(item) for item in items]
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, items))
@@ -1 +1 @@
-from fsl_mrs.utils.mrs_io.main import read_FID, read_basis
+from fsl_mrs.utils.mrs_io.main import read_FID, read_basis, compile_basis
@@ -0,0 +1,237 @@
+# basis_cache.py - Compiled (binary) basis set container
+#
+# Author: FSL-MRS contributors
+#
+# Copyright (C) 2026 University of Oxford
+# SHBASECOPYRIGHT
+
+"""Compiled basis sets store the FIDs, names and headers of a basis set in a single binary file.
+The same container is used to cache the output of the text format parsers.
+
+Layout: magic string, format version (uint32), metadata length (uint64), JSON metadata,
+then a complex128 array (for a basis, points x metabolites), aligned to 64 bytes.
+The array is memory-mapped on load.
+The metadata records the size and modification time of each source file,
+a compiled basis or parser cache is ignored if these have changed.
+"""
+
+import json
+import os
+import struct
+from pathlib import Path
+
+import numpy as np
+
+CACHE_SUFFIX = '.fslbasis'
+PARSE_CACHE_SUFFIX = '.fslcache'
+CACHE_VERSION = 1
+
+_MAGIC = b'FSLMRSBASIS\x00'
+_PREAMBLE = struct.Struct('<12sIQ')
+_ALIGN = 64
+_DTYPE = np.dtype('<c16')
+
+# File types read from a basis folder
+_SOURCE_PATTERNS = ('*.json', '*.txt', '*.raw', '*.RAW')
+
+
+class CompiledBasisError(Exception):
+    pass
+
+
+def default_cache_path(source):
+    """Default location of the compiled basis for a basis file or folder.
+
+    :param source: Basis file or folder
+    :type source: str or pathlib.Path
+    :return: Path to compiled basis, within a basis folder or alongside a basis file
+    :rtype: pathlib.Path
+    """
+    source = Path(source)
+    if source.is_dir():
+        return source / ('basis' + CACHE_SUFFIX)
+    return source.with_name(source.name + CACHE_SUFFIX)
+
+
+def source_fingerprint(source):
+    """Size and modification time of each basis source file.
+
+    :param source: Basis file or folder
+    :type source: str or pathlib.Path
+    :return: List of [file name, size in bytes, modification time in ns]
+    :rtype: list
+    """
+    source = Path(source)
+    if source.is_dir():
+        files = sorted({file for ptrn in _SOURCE_PATTERNS for file in source.glob(ptrn)})
+    else:
+        files = [source]
+
+    fingerprint = []
+    for file in files:
+        stat = file.stat()
+        fingerprint.append([file.name, stat.st_size, stat.st_mtime_ns])
+    return fingerprint
+
+
+def write_compiled_basis(out_path, fid_array, names, headers, source=None):
+    """Write basis FIDs, names and headers to a compiled basis file.
+
+    :param out_path: Output file path
+    :type out_path: str or pathlib.Path
+    :param fid_array: 2D array of basis FIDs (time x metabs)
+    :type fid_array: numpy.ndarray
+    :param names: Metabolite names
+    :type names: list of str
+    :param headers: Basis header for each metabolite
+    :type headers: list of dict
+    :param source: Source basis file or folder, recorded to allow invalidation, defaults to None
+    :type source: str or pathlib.Path, optional
+    """
+    fid_array = np.asarray(fid_array, dtype=_DTYPE)
+    if fid_array.ndim == 1:
+        fid_array = fid_array[:, np.newaxis]
+
+    meta = {'names': list(names),
+            'headers': headers,
+            'original_dwell': headers[0]['dwelltime'],
+            'original_points': fid_array.shape[0]}
+    _write_container(out_path, fid_array, meta, source)
+
+
+def read_compiled_basis(path):
+    """Read a compiled basis file, memory-mapping the FID array.
+
+    The array is mapped copy-on-write: it can be modified in memory without altering the file.
+
+    :param path: Compiled basis file
+    :type path: str or pathlib.Path
+    :return: FID array (time x metabs), names, headers and the file metadata
+    :rtype: tuple
+    """
+    fids, meta = _read_container(path)
+    return fids, meta['names'], meta['headers'], meta
+
+
+def is_current(meta, source=None):
+    """Check that the source of a compiled basis is unchanged.
+
+    A compiled basis holds all basis information, so is considered current
+    if no source was recorded or the source no longer exists (e.g. the compiled file has been copied elsewhere).
+
+    :param meta: Compiled basis metadata (as returned by read_compiled_basis)
+    :type meta: dict
+    :param source: Source basis file or folder, defaults to the source recorded on compilation
+    :type source: str or pathlib.Path, optional
+    :return: False if the source files have changed
+    :rtype: bool
+    """
+    if source is None:
+        source = meta['source']
+    if source is None or not Path(source).exists():
+        return True
+    return source_fingerprint(source) == meta['fingerprint']
+
+
+def load_cached_basis(source):
+    """Load the compiled basis stored at the default location for a basis file or folder.
+
+    :param source: Basis file or folder
+    :type source: str or pathlib.Path
+    :return: FID array, names and headers, or None if there is no current compiled basis
+    :rtype: tuple or None
+    """
+    cache = default_cache_path(source)
+    if not cache.is_file():
+        return None
+    try:
+        fids, names, headers, meta = read_compiled_basis(cache)
+    except CompiledBasisError:
+        return None
+    if not is_current(meta, source):
+        print(f'Compiled basis {cache} is out of date and will be ignored, '
+              'recompile with "basis_tools compile".')
+        return None
+    return fids, names, headers
+
+
+def cached_parse(source, parser):
+    """Parse a text format file, caching the result in binary form alongside the source.
+
+    The cache is used in place of parsing until the source file changes.
+    If the cache cannot be written (e.g. a read-only location) the file is parsed as normal.
+
+    :param source: File to parse
+    :type source: str or pathlib.Path
+    :param parser: Function taking the file path and returning a tuple of (array, JSON serialisable header)
+    :type parser: callable
+    :return: Parsed array (memory-mapped if loaded from the cache) and header
+    :rtype: tuple
+    """
+    source = Path(source)
+    cache = source.with_name(source.name + PARSE_CACHE_SUFFIX)
+    if cache.is_file():
+        try:
+            array, meta = _read_container(cache)
+            if is_current(meta, source):
+                return array, meta['header']
+        except (CompiledBasisError, KeyError):
+            pass
+
+    array, header = parser(source)
+    try:
+        _write_container(cache, array, {'header': header}, source)
+    except OSError:
+        pass
+    return array, header
+
+
+def _write_container(out_path, array, meta, source=None):
+    """Write array and metadata to file, recording the source fingerprint."""
+    out_path = Path(out_path)
+    array = np.asarray(array, dtype=_DTYPE)
+    meta = {'version': CACHE_VERSION,
+            'shape': list(array.shape),
+            **meta,
+            'source': None if source is None else str(Path(source).resolve()),
+            'fingerprint': None if source is None else source_fingerprint(source)}
+    meta_bytes = json.dumps(meta, default=_json_default).encode('utf-8')
+    offset = _PREAMBLE.size + len(meta_bytes)
+    padding = -offset % _ALIGN
+
+    # Write to a temporary file then move, so readers never see a partial file
+    tmp_path = out_path.with_name(out_path.name + '.tmp')
+    with open(tmp_path, 'wb') as fp:
+        fp.write(_PREAMBLE.pack(_MAGIC, CACHE_VERSION, len(meta_bytes)))
+        fp.write(meta_bytes)
+        fp.write(b'\x00' * padding)
+        fp.write(np.ascontiguousarray(array).tobytes())
+    os.replace(tmp_path, out_path)
+
+
+def _read_container(path):
+    """Read metadata and memory-map (copy-on-write) the array of a container file."""
+    path = Path(path)
+    with open(path, 'rb') as fp:
+        preamble = fp.read(_PREAMBLE.size)
+        if len(preamble) < _PREAMBLE.size:
+            raise CompiledBasisError(f'{path} is not a compiled basis file.')
+        magic, version, meta_len = _PREAMBLE.unpack(preamble)
+        if magic != _MAGIC:
+            raise CompiledBasisError(f'{path} is not a compiled basis file.')
+        if version != CACHE_VERSION:
+            raise CompiledBasisError(
+                f'{path} has compiled basis version {version}, expected {CACHE_VERSION}. Please recompile.')
+        meta = json.loads(fp.read(meta_len).decode('utf-8'))
+
+    offset = _PREAMBLE.size + meta_len
+    offset += -offset % _ALIGN
+    array = np.memmap(path, dtype=_DTYPE, mode='c', offset=offset, shape=tuple(meta['shape']))
+    return array, meta
+
+
+def _json_default(obj):
+    """Serialise numpy scalars held in basis headers."""
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
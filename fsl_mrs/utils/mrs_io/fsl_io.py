@@ -13,6 +13,7 @@ import os
 import glob
 import re
 from fsl_mrs.core.nifti_mrs import gen_nifti_mrs
+from fsl_mrs.utils.misc import thread_map
 from pathlib import Path
 from datetime import datetime
 
@@ -99,20 +100,20 @@ def readFSLBasisFiles(basisFolder, readoutShift=4.65, bandwidth=None, points=Non
         raise ValueError(' ''basisFolder'' must be a folder containing basis json files.')
     # loop through all files in folder
     basisfiles = sorted(glob.glob(os.path.join(basisFolder, '*.json')))
+    if bandwidth is None or points is None:
+        # If simple read operation call readFSLBasis
+        loaded = thread_map(readFSLBasis, basisfiles)
+    else:
+        # If recalculation requested call readAndGenFSLBasis for each file
+        loaded = thread_map(
+            lambda bfile: readAndGenFSLBasis(bfile, readoutShift, bandwidth, points),
+            basisfiles)
+
     basis, names, header = [], [], []
-    for bfile in basisfiles:
-        if bandwidth is None or points is None:
-            # If simple read operation call readFSLBasis
-            b, n, h  = readFSLBasis(bfile)
-            basis.append(b)
-            names.append(n)
-            header.append(h)
-        else:
-            # If recalculation requested loop through files calling readAndGenFSLBasis
-            b, n, h  = readAndGenFSLBasis(bfile, readoutShift, bandwidth, points)
-            basis.append(b)
-            names.append(n)
-            header.append(h)
+    for b, n, h in loaded:
+        basis.append(b)
+        names.append(n)
+        header.append(h)
 
     basis = np.array(basis).conj().T
     return basis, names, header
@@ -9,6 +9,8 @@ import numpy as np
 import re
 import os.path as op
 from fsl_mrs.core.nifti_mrs import gen_nifti_mrs
+from fsl_mrs.utils.mrs_io import basis_cache
+from fsl_mrs.utils.misc import thread_map
 
 
 def readjMRUItxt_fid(txtfile):
@@ -40,23 +42,24 @@ def readjMRUItxt_fid(txtfile):
 
 
 # Read jMRUI .txt files containing basis
-def read_txtBasis_files(txtfiles):
+def read_txtBasis_files(txtfiles, cache=False):
     """Read a list of files containing a jMRUI basis set
 
     :param txtfiles: List of files to read basis from. Can be a single file/element.
     :type txtfiles: List
+    :param cache: Cache parsed files in binary form, defaults to False
+    :type cache: bool, optional
     :return: Tuple of basis, names, headers
     :rtype: tuple
     """
+    # Special case for the VESPA information file that can be packaged in JMRUI basisets
+    txtfiles = [file for file in txtfiles if op.basename(file) != 'jmrui-text_output_summary.txt']
+    loaded = thread_map(lambda file: readjMRUItxt(file, cache=cache), txtfiles)
+
     basis = []
     names = []
     header = []
-    for file in txtfiles:
-        # Special case for the VESPA information file that can be packaged in JMRUI basisets
-        if op.basename(file) == 'jmrui-text_output_summary.txt':
-            continue
-
-        b, h = readjMRUItxt(file)
+    for b, h in loaded:
         basis.append(b)
 
         try:
@@ -82,48 +85,25 @@ def read_txtBasis_files(txtfiles):
 
 
 # generically read jMRUI style text files
-def readjMRUItxt(filename):
+def readjMRUItxt(filename, cache=False):
     """
     Read .txt format file
     Parameters
     ----------
     filename : string
         Name of jmrui .txt file
+    cache : bool
+        Cache the parsed file in binary form alongside it (used until the file changes)
 
     Returns
     -------
     array-like
         Complex data
     """
-    signalRe = re.compile(r'Signal (\d{1,}) out of (\d{1,}) in file')
-    headerRe = re.compile(r'(\w*):(.*)')
-    header = {}
-    data   = []
-    recordData = False
-    nsig = 0
-    with open(filename, 'r') as txtfile:
-        for line in txtfile:
-            headerComp = headerRe.match(line)
-            if headerComp:
-                value = headerComp[2].strip()
-                header.update({headerComp[1]: num(value)})
-
-            signalIndices = signalRe.match(line)
-            if signalIndices:
-                nsig += 1
-                recordData = True
-                continue
-
-            if recordData:
-                curr_data = line.split()
-                if len(curr_data) > 2:
-                    curr_data = curr_data[:2]
-                data.append(list(map(float, curr_data)))
-
-    # Reshape data
-    data = np.concatenate([np.array(i) for i in data])
-    data = (data[0::2] + 1j * data[1::2]).astype(complex)
-    data = data.reshape(nsig, -1)
+    if cache:
+        data, header = basis_cache.cached_parse(filename, _parse_jmrui_file)
+    else:
+        data, header = _parse_jmrui_file(filename)
 
     # Clean up header
     header = translateHeader(header)
@@ -131,6 +111,45 @@ def readjMRUItxt(filename):
     return data, header
 
 
+_signal_re = re.compile(r'Signal (\d{1,}) out of (\d{1,}) in file[^\n]*')
+_header_re = re.compile(r'(\w*):(.*)')
+
+
+def _parse_jmrui_file(filename):
+    """Parse jMRUI text file into complex data (signals x points) and the raw header fields
+
+    :param filename: Path to file
+    :return: data
+    :return: header dict
+    """
+    with open(filename, 'r') as txtfile:
+        text = txtfile.read()
+
+    # Header fields precede the first signal
+    first_signal = _signal_re.search(text)
+    header_end = len(text) if first_signal is None else first_signal.start()
+    header = {}
+    for line in text[:header_end].splitlines():
+        headerComp = _header_re.match(line)
+        if headerComp:
+            value = headerComp[2].strip()
+            header.update({headerComp[1]: num(value)})
+
+    # Numeric block, with the signal separator lines removed
+    blocks = _signal_re.split(text[header_end:])[3::3]
+    nsig = len(blocks)
+    if nsig == 0:
+        raise ValueError(f'No signals found in jMRUI file {filename}.')
+
+    # Only the first two columns (time domain real and imaginary) are used
+    ncols = len(blocks[0].lstrip().split('\n', 1)[0].split())
+    data = np.array(' '.join(blocks).split(), dtype=float).reshape(-1, ncols)
+    data = data[:, 0] + 1j * data[:, 1]
+    data = data.reshape(nsig, -1)
+
+    return data, header
+
+
 # Translate jMRUI header to mandatory fields
 def translateHeader(header):
     newHeader = {'jmrui': header}
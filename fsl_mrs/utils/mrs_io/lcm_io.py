@@ -9,41 +9,27 @@
 import numpy as np
 import os
 import re
-from fsl_mrs.utils.misc import checkCFUnits
+from fsl_mrs.utils.misc import checkCFUnits, thread_map
 from fsl_mrs.core.nifti_mrs import gen_nifti_mrs
+from fsl_mrs.utils.mrs_io import basis_cache
 
 
 # Raw file reading
-def readLCModelRaw(filename, unpack_header=True, conjugate=True):
+def readLCModelRaw(filename, unpack_header=True, conjugate=True, cache=False):
     """
     Read LCM format file
 
     :param filename: Path to .RAW/.H2O file
     :param bool conjugate: Apply conjugation upon read
+    :param bool cache: Cache the parsed file in binary form alongside it (used until the file changes)
 
     :return: data
     :return: header
     """
-    header = []
-    data   = []
-    in_header = False
-    header_done = False
-    with open(filename, 'r') as f:
-        for line in f:
-            if (line.find('$') > 0):
-                in_header = True
-            if in_header:
-                header.append(line)
-            elif header_done:
-                data.append(list(map(float, line.split())))
-
-            if line.find('$END') > 0:
-                in_header = False
-                header_done = True
-
-    # Reshape data
-    data = np.concatenate([np.array(i) for i in data])
-    data = (data[0::2] + 1j * data[1::2]).astype(complex)
+    if cache:
+        data, header = basis_cache.cached_parse(filename, _parse_lcm_file)
+    else:
+        data, header = _parse_lcm_file(filename)
 
     # LCModel-specific conjugation
     if conjugate:
@@ -56,6 +42,42 @@ def readLCModelRaw(filename, unpack_header=True, conjugate=True):
     return data, header
 
 
+def _parse_lcm_file(filename):
+    """Parse LCModel format file into complex data and (unprocessed) header lines
+
+    Namelist sections run from a line containing '$' to the next line containing '$END'.
+    Numeric data follows the first section, and is interleaved with any later sections.
+
+    :param filename: Path to file
+    :return: data
+    :return: list of header lines
+    """
+    with open(filename, 'r') as f:
+        text = f.read()
+
+    header, data = [], []
+    pos = None
+    start = text.find('$')
+    while start >= 0:
+        line_start = text.rfind('\n', 0, start) + 1
+        if pos is not None:
+            data.append(text[pos:line_start])
+        end = text.find('$END', start)
+        if end < 0:
+            end = len(text)
+        pos = text.find('\n', end) + 1 or len(text)
+        header += text[line_start:pos].splitlines(keepends=True)
+        start = text.find('$', pos)
+    if pos is not None:
+        data.append(text[pos:])
+
+    # Bulk conversion of all numeric fields, real and imaginary parts interleaved
+    data = np.array(' '.join(data).split(), dtype=float)
+    data = data[0::2] + 1j * data[1::2]
+
+    return data, header
+
+
 def read_lcm_raw_h2o(filename):
     """
     Read LCM format .RAW or .H2O file
@@ -71,7 +93,7 @@ def read_lcm_raw_h2o(filename):
 
 
 # Read .RAW basis files
-def read_basis_files(basisfiles, ignore=[]):
+def read_basis_files(basisfiles, ignore=[], cache=False):
     """
      Reads basis files and extracts name of metabolite from file name
      Assumes .RAW files are FIDs (not spectra)
@@ -81,16 +103,17 @@ def read_basis_files(basisfiles, ignore=[]):
     :type basisfiles: list
     :param ignore: Optionally ignore files, defaults to []
     :type ignore: list, optional
+    :param cache: Cache parsed files in binary form, defaults to False
+    :type cache: bool, optional
     :return: Numpy array of basis spectra and names
     """
-    basis = []
-    names = []
+    names, files = [], []
     for file in basisfiles:
-        data, header = readLCModelRaw(file)
         name = os.path.splitext(os.path.split(file)[-1])[-2]
         if name not in ignore:
             names.append(name)
-            basis.append(data)
+            files.append(file)
+    basis = [data for data, _ in thread_map(lambda file: readLCModelRaw(file, cache=cache), files)]
     basis = np.asarray(basis).astype(complex).T
     return basis, names
 
@@ -100,13 +123,15 @@ class EncryptedBasisError(Exception):
 
 
 # Read .BASIS files
-def readLCModelBasis(filename, N=None, doifft=True, conjugate=True):
+def readLCModelBasis(filename, N=None, doifft=True, conjugate=True, cache=False):
     """
     Read .BASIS format file
     Parameters
     ----------
     filename : string
         Name of .BASIS file
+    cache : bool
+        Cache the parsed file in binary form alongside it
 
     Returns
     -------
@@ -120,7 +145,7 @@ def readLCModelBasis(filename, N=None, doifft=True, conjugate=True):
     """
     metabo = []
     # do not conjugate here - this reads a spectrum!
-    data, header = readLCModelRaw(filename, unpack_header=False, conjugate=False)
+    data, header = readLCModelRaw(filename, unpack_header=False, conjugate=False, cache=cache)
 
     # extract metabolite names and shifts
     metabo, shifts = siv_basis_header(header)
@@ -15,6 +15,7 @@ from nifti_mrs.nifti_mrs import NotNIFTI_MRS
 from fsl_mrs.utils.mrs_io import fsl_io as fsl, jmrui_io
 from fsl_mrs.utils.mrs_io import lcm_io as lcm
 from fsl_mrs.utils.mrs_io import jmrui_io as jmrui
+from fsl_mrs.utils.mrs_io import basis_cache
 from fsl_mrs.core import nifti_mrs as fsl_nmrs
 from fsl_mrs.core import basis as bmod
 import fsl.utils.path as fslpath
@@ -110,15 +111,20 @@ def read_FID(filename):
 # Basis reading functions
 # Formats accepted are .json, .basis/.raw (LCMODEL style) or .txt (jMRUI style)
 # Now handled by the Basis class methods
-def read_basis(filename):
+def read_basis(filename, use_compiled=True):
     """
     Read basis file(s) to generate a Basis object
 
     Load the basis fids, names and headers for each format handled.
     Ensures similar sorting by name for each type.
 
-    :param filepath: Path to basis file or folder
+    A compiled basis (see compile_basis) can be loaded directly,
+    or is used in place of the source files if found alongside them and the sources are unchanged.
+
+    :param filepath: Path to basis file or folder, or compiled basis (.fslbasis) file
     :type filepath: str or pathlib.Path
+    :param use_compiled: Use a current compiled basis if one is found, defaults to True
+    :type use_compiled: bool, optional
     :return: A Basis class object
     :rtype: fsl_mrs.core.basis.Basis
     """
@@ -127,6 +133,35 @@ def read_basis(filename):
     if isinstance(filename, str):
         filename = Path(filename)
 
+    if filename.is_file() and filename.suffix.lower() == basis_cache.CACHE_SUFFIX:
+        basis, names, header, meta = basis_cache.read_compiled_basis(filename)
+        if not basis_cache.is_current(meta):
+            print(f'Compiled basis {filename} is out of date, reading from {meta["source"]}.')
+            basis, names, header = _read_basis_files(Path(meta['source']))
+    else:
+        cached = None
+        if use_compiled and filename.exists():
+            cached = basis_cache.load_cached_basis(filename)
+        if cached is None:
+            basis, names, header = _read_basis_files(filename)
+        else:
+            basis, names, header = cached
+
+    # Handle single basis spectra
+    if basis.ndim == 1:
+        basis = basis[:, np.newaxis]
+
+    return bmod.Basis(basis, names, header)
+
+
+def _read_basis_files(filename):
+    """Read the fids, names and headers from basis file(s) of any handled format.
+
+    :param filepath: Path to basis file or folder
+    :type filepath: pathlib.Path
+    :return: basis fids, names and headers
+    :rtype: tuple
+    """
     # LCModel BASIS format format
     if filename.is_file():
         if filename.suffix.lower() == '.basis':
@@ -162,8 +197,28 @@ def read_basis(filename):
     else:
         raise UnknownBasisFormat(f'{filename} is neither a file nor a folder!')
 
-    # Handle single basis spectra
-    if basis.ndim == 1:
-        basis = basis[:, np.newaxis]
+    return basis, names, header
 
-    return bmod.Basis(basis, names, header)
+
+def compile_basis(filename, output=None):
+    """Compile a basis set to a single binary file which is memory-mapped on loading.
+
+    The compiled basis is used by read_basis in place of the source files until they change.
+
+    :param filename: Path to basis file or folder
+    :type filename: str or pathlib.Path
+    :param output: Compiled basis file path, defaults to basis.fslbasis in a basis folder,
+        or the basis file name with a .fslbasis suffix added.
+    :type output: str or pathlib.Path, optional
+    :return: Path of the compiled basis
+    :rtype: pathlib.Path
+    """
+    filename = Path(filename)
+    if filename.suffix.lower() == basis_cache.CACHE_SUFFIX:
+        raise UnknownBasisFormat(f'{filename} is already a compiled basis.')
+    basis, names, header = _read_basis_files(filename)
+
+    if output is None:
+        output = basis_cache.default_cache_path(filename)
+    basis_cache.write_compiled_basis(output, basis, names, header, source=filename)
+    return Path(output)
@@ -1,10 +1,11 @@
 # Make core preprocessing functions availible at module level
 from fsl_mrs.utils.preproc.combine import combine_FIDs
-from fsl_mrs.utils.preproc.align import phase_freq_align, phase_freq_align_diff
-from fsl_mrs.utils.preproc.phasing import phaseCorrect, applyPhase, applyLinPhase
+from fsl_mrs.utils.preproc.align import phase_freq_align, phase_freq_align_batch, \
+    phase_freq_align_diff, phase_freq_align_diff_batch
+from fsl_mrs.utils.preproc.phasing import phaseCorrect, phaseCorrect_stack, applyPhase, applyLinPhase
 from fsl_mrs.utils.preproc.eddycorrect import eddy_correct
 from fsl_mrs.utils.preproc.shifting import truncate, pad, timeshift, freqshift, shiftToRef
 from fsl_mrs.utils.preproc.filtering import apodize
-from fsl_mrs.utils.preproc.remove import hlsvd, model_fid_hlsvd, zero_spectrum
+from fsl_mrs.utils.preproc.remove import hlsvd, hlsvd_stack, model_fid_hlsvd, zero_spectrum
 from fsl_mrs.utils.preproc.general import add, subtract
 from fsl_mrs.utils.preproc.unlike import identifyUnlikeFIDs
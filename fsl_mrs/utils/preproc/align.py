@@ -8,12 +8,12 @@
 # Copyright (C) 2019 University of Oxford
 # SHBASECOPYRIGHT
 
-from fsl_mrs.utils.preproc.general import get_target_FID, add, subtract
-from fsl_mrs.utils.preproc.filtering import apodize as apod
+from fsl_mrs.utils.preproc.general import add, subtract
 from fsl_mrs.core import MRS
-from fsl_mrs.utils.misc import extract_spectrum, shift_FID
+from fsl_mrs.utils.misc import extract_spectrum, shift_FID, FIDToSpec
 from scipy.optimize import minimize
 import numpy as np
+from fsl_mrs.utils.preproc.reporting import deferrable_report
 
 
 # Phase-Freq alignment functions
@@ -108,6 +108,128 @@ def align_FID_diff(mrs, src_FID0, src_FID1, tgt_FID, diffType='add', ppmlim=None
     return alignedFID0, phi, eps
 
 
+def _nearest_to_mean(FIDs):
+    """Batched get_target_FID(..., target='nearest_to_mean') over the transient (penultimate) axis.
+
+    :param FIDs: Array of FIDs, shape (..., transients, time)
+    :return: Target FIDs, shape (..., 1, time)
+    """
+    avg = FIDs.mean(axis=-2, keepdims=True)
+    dist = np.linalg.norm(FIDs - avg, axis=-1)
+    return np.take_along_axis(FIDs, dist.argmin(axis=-1)[..., None, None], axis=-2).copy()
+
+
+def fit_phase_freq_batch(mrs, src_FIDs, tgt_FIDs, ppmlim=None, shift=True, max_iter=50, tol=1E-10):
+    """Batched phase and frequency alignment
+
+    Minimises the cost function of align_FID,
+    ||extract(exp(-1j * phi) * shift_FID(FID, eps)) - extract(target)||,
+    for all source FIDs simultaneously. The target spectra are calculated once.
+    Both parameters are refined using a damped Gauss-Newton (Levenberg-Marquardt)
+    iteration with analytic derivatives, started from zero shift and from the
+    integer-point cross-correlation peak (searched within half the width of the ppm range)
+    with phase at its closed-form optimum. The lowest cost solution is returned.
+
+    :param mrs: MRS object providing the time and ppm axes
+    :type mrs: fsl_mrs.core.MRS
+    :param src_FIDs: Source FIDs, shape (..., time)
+    :type src_FIDs: numpy.ndarray
+    :param tgt_FIDs: Target FID(s), broadcastable to the shape of src_FIDs
+    :type tgt_FIDs: numpy.ndarray
+    :param ppmlim: ppm range over which the cost function is calculated, defaults to mrs.default_ppm_range
+    :type ppmlim: tuple, optional
+    :param shift: Apply H20 shift to ppm limit, defaults to True
+    :type shift: bool, optional
+    :param max_iter: Maximum number of Gauss-Newton iterations, defaults to 50
+    :type max_iter: int, optional
+    :param tol: Relative cost function change at which iteration stops, defaults to 1E-10
+    :type tol: float, optional
+    :return: phi (radians) and eps (Hz), each of shape src_FIDs.shape[:-1]
+    :rtype: tuple
+    """
+    if ppmlim is None:
+        ppmlim = mrs.default_ppm_range
+    first, last = mrs.ppmlim_to_range(ppmlim=ppmlim, shift=shift)
+
+    src_FIDs = np.asarray(src_FIDs, dtype=complex)
+    batch_shape = src_FIDs.shape[:-1]
+    npoints = src_FIDs.shape[-1]
+    fids = src_FIDs.reshape(-1, npoints)
+    nfids = fids.shape[0]
+
+    t = np.asarray(mrs.timeAxis).ravel()
+    dfids = fids * (-2j * np.pi * t)
+
+    # Target spectra calculated once, then broadcast across the batch
+    tgt_spec = FIDToSpec(np.array(tgt_FIDs, dtype=complex), axis=-1)
+    tgt_win = np.zeros_like(tgt_spec)
+    tgt_win[..., first:last] = tgt_spec[..., first:last]
+    tgt = np.broadcast_to(tgt_spec[..., first:last], batch_shape + (last - first,)).reshape(nfids, -1)
+
+    def spectra(x, eps):
+        return FIDToSpec(x * np.exp(-2j * np.pi * eps[:, None] * t), axis=1)[:, first:last]
+
+    # Initialise frequency with the cross-correlation of spectra with the windowed target.
+    # Shifting by eps = k * bw / npoints is an exact circular shift of k points.
+    src_spec = FIDToSpec(fids.copy(), axis=1)
+    tgt_win = np.broadcast_to(tgt_win, batch_shape + (npoints,)).reshape(nfids, npoints)
+    xcorr = np.fft.ifft(np.fft.fft(src_spec, axis=1) * np.fft.fft(tgt_win, axis=1).conj(), axis=1)
+    max_lag = max((last - first) // 2, 1)
+    lags = np.arange(-max_lag, max_lag + 1)
+    best = np.abs(xcorr[:, lags % npoints]).argmax(axis=1)
+
+    # Refine from both zero shift (as align_FID) and the cross-correlation peak, keeping the best.
+    fids, dfids, tgt = np.tile(fids, (2, 1)), np.tile(dfids, (2, 1)), np.tile(tgt, (2, 1))
+    eps = np.concatenate((np.zeros(nfids), lags[best] * mrs.bandwidth / npoints))
+
+    # Closed form phase at the initial frequency
+    A = spectra(fids, eps)
+    phi = np.angle(np.sum(A * tgt.conj(), axis=1))
+
+    def model(A, phi):
+        S = np.exp(-1j * phi)[:, None] * A
+        return S, np.sum(np.abs(S - tgt)**2, axis=1)
+
+    S, cost = model(A, phi)
+    B = spectra(dfids, eps)
+    damping = np.full(2 * nfids, 1E-3)
+    active = np.ones(2 * nfids, dtype=bool)
+    for _ in range(max_iter):
+        # Jacobian columns of the complex residual, real inner products for Gauss-Newton
+        jac = np.stack((-1j * S, np.exp(-1j * phi)[:, None] * B), axis=1)
+        JtJ = np.einsum('nim,njm->nij', jac.conj(), jac).real
+        Jtr = np.einsum('nim,nm->ni', jac.conj(), S - tgt).real
+
+        H = JtJ + damping[:, None, None] * (JtJ * np.eye(2)) + np.eye(2) * np.finfo(float).tiny
+        step = -np.linalg.solve(H, Jtr[..., None])[..., 0]
+        step[~active] = 0
+
+        new_phi = phi + step[:, 0]
+        new_eps = eps + step[:, 1]
+        new_A = spectra(fids, new_eps)
+        new_S, new_cost = model(new_A, new_phi)
+
+        accept = active & (new_cost < cost)
+        converged = accept & ((cost - new_cost) <= tol * cost)
+
+        phi = np.where(accept, new_phi, phi)
+        eps = np.where(accept, new_eps, eps)
+        S[accept] = new_S[accept]
+        cost = np.where(accept, new_cost, cost)
+        if np.any(accept):
+            B[accept] = spectra(dfids[accept], eps[accept])
+        damping = np.where(accept, damping / 10, damping * 10)
+
+        active &= ~converged & (damping < 1E10)
+        if not np.any(active):
+            break
+
+    start = cost.reshape(2, nfids).argmin(axis=0)
+    phi = phi.reshape(2, nfids)[start, np.arange(nfids)]
+    eps = eps.reshape(2, nfids)[start, np.arange(nfids)]
+    return phi.reshape(batch_shape), eps.reshape(batch_shape)
+
+
 # The functions to call
 # 1) For normal FIDs
 def phase_freq_align(FIDlist,
@@ -123,7 +245,7 @@ def phase_freq_align(FIDlist,
     """
     Algorithm:
        Average spectra
-       Loop over all spectra and find best phase/frequency shifts
+       Find best phase/frequency shifts for all spectra (see fit_phase_freq_batch)
        Iterate
 
     Parameters:
@@ -142,42 +264,91 @@ def phase_freq_align(FIDlist,
     --------
     list of FID aligned to each other
     """
-    all_FIDs = FIDlist.copy()
+    all_FIDs, phiOut, epsOut = phase_freq_align_batch(np.asarray(FIDlist),
+                                                      bandwidth,
+                                                      centralFrequency,
+                                                      nucleus=nucleus,
+                                                      ppmlim=ppmlim,
+                                                      niter=niter,
+                                                      apodize=apodize,
+                                                      verbose=verbose,
+                                                      shift=shift,
+                                                      target=target)
+    if isinstance(FIDlist, list):
+        all_FIDs = list(all_FIDs)
+    return all_FIDs, phiOut, epsOut
+
 
-    phiOut, epsOut = np.zeros(len(FIDlist)), np.zeros(len(FIDlist))
+def phase_freq_align_batch(FIDs,
+                           bandwidth,
+                           centralFrequency,
+                           nucleus='1H',
+                           ppmlim=None,
+                           niter=2,
+                           apodize=0,
+                           verbose=False,
+                           shift=True,
+                           target=None):
+    """Phase and frequency align many independent groups of transients at once.
+
+    Equivalent to running phase_freq_align on each group of transients,
+    but all transients of all groups are aligned in a single batched operation.
+
+    :param FIDs: FIDs, shape (groups..., transients, time)
+    :type FIDs: numpy.ndarray
+    :param bandwidth: Spectral bandwidth in Hz
+    :type bandwidth: float
+    :param centralFrequency: Central frequency
+    :type centralFrequency: float
+    :param nucleus: Nucleus string, defaults to '1H'
+    :type nucleus: str, optional
+    :param ppmlim: ppm limits of alignment, defaults to None
+    :type ppmlim: tuple, optional
+    :param niter: Number of iterations, defaults to 2
+    :type niter: int, optional
+    :param apodize: Exponential apodisation (Hz) applied for estimation only, defaults to 0
+    :type apodize: float, optional
+    :param verbose: Print iteration number, defaults to False
+    :type verbose: bool, optional
+    :param shift: Apply H20 shift to ppm limit, defaults to True
+    :type shift: bool, optional
+    :param target: Target FID, either one FID or one per group (groups..., time).
+        Defaults to None, in which case the transient nearest to each group's mean is used.
+    :type target: numpy.ndarray, optional
+    :return: Aligned FIDs, phase (radians) and shift (Hz) applied, each of shape (groups..., transients)
+    :rtype: tuple
+    """
+    all_FIDs = np.array(FIDs, dtype=complex)
+    mrs = MRS(FID=all_FIDs.reshape(-1, all_FIDs.shape[-1])[0],
+              bw=bandwidth,
+              cf=centralFrequency,
+              nucleus=nucleus)
+    t = np.asarray(mrs.timeAxis).ravel()
+
+    if target is not None:
+        target = np.asarray(target, dtype=complex)[..., None, :]
+
+    phiOut, epsOut = np.zeros(all_FIDs.shape[:-1]), np.zeros(all_FIDs.shape[:-1])
     for iter in range(niter):
         if verbose:
             print(' ---- iteration {} ----\n'.format(iter))
 
         if target is None:
-            target = get_target_FID(all_FIDs, target='nearest_to_mean')
-
-        MRSargs = {'FID': target, 'bw': bandwidth, 'cf': centralFrequency, 'nucleus': nucleus}
-        mrs = MRS(**MRSargs)
+            target = _nearest_to_mean(all_FIDs)
 
+        # Equivalent to filtering.apodize with the 'exp' filter
         if apodize > 0:
-            target = apod(target, mrs.dwellTime, [apodize])
-
-        for idx, FID in enumerate(all_FIDs):
-            if verbose:
-                print(f'... aligning FID number {idx}\r')
-
-            if apodize > 0:
-                FID_apod = apod(FID.copy(), mrs.dwellTime, [apodize])
-            else:
-                FID_apod = FID
-
-            phi, eps = align_FID(mrs,
-                                 FID_apod,
-                                 target,
-                                 ppmlim=ppmlim,
-                                 shift=shift)
-
-            all_FIDs[idx] = np.exp(-1j * phi) * shift_FID(mrs, FID, eps)
-            phiOut[idx] += phi
-            epsOut[idx] += eps
-        if verbose:
-            print('\n')
+            target = target * np.exp(-t * apodize)
+            FID_apod = all_FIDs * np.exp(-t * apodize)
+        else:
+            FID_apod = all_FIDs
+
+        phi, eps = fit_phase_freq_batch(mrs, FID_apod, target, ppmlim=ppmlim, shift=shift)
+
+        all_FIDs = np.exp(-1j * phi)[..., None] * all_FIDs * np.exp(-1j * 2 * np.pi * eps[..., None] * t)
+        phiOut += phi
+        epsOut += eps
+
     return all_FIDs, phiOut, epsOut
 
 
@@ -211,36 +382,91 @@ def phase_freq_align_diff(FIDlist0,
     --------
     two lists of FID aligned to each other, phase and shift applied to first list.
     """
+    alignedFIDs0, _, phiOut, epsOut = phase_freq_align_diff_batch(np.asarray(FIDlist0),
+                                                                  np.asarray(FIDlist1),
+                                                                  bandwidth,
+                                                                  centralFrequency,
+                                                                  nucleus=nucleus,
+                                                                  diffType=diffType,
+                                                                  ppmlim=ppmlim,
+                                                                  shift=shift,
+                                                                  target=target)
+
+    return list(alignedFIDs0), FIDlist1, list(phiOut), list(epsOut)
+
+
+def phase_freq_align_diff_batch(FIDs0,
+                                FIDs1,
+                                bandwidth,
+                                centralFrequency,
+                                nucleus='1H',
+                                diffType='add',
+                                ppmlim=None,
+                                shift=True,
+                                target=None):
+    """Align subspectra from difference methods for many groups of transients at once.
+
+    Equivalent to running phase_freq_align_diff on each group, only FIDs0 are shifted.
+    The cost function of align_FID_diff, ||combine(FID1, shifted FID0) - target||,
+    is (up to a constant factor) the distance of the shifted FID0 from a per-transient
+    target formed from FID1 and the target, so all transients are fitted together
+    using fit_phase_freq_batch.
+
+    :param FIDs0: FIDs to shift, shape (groups..., transients, time)
+    :type FIDs0: numpy.ndarray
+    :param FIDs1: Fixed FIDs, same shape as FIDs0
+    :type FIDs1: numpy.ndarray
+    :param bandwidth: Spectral bandwidth in Hz
+    :type bandwidth: float
+    :param centralFrequency: Central frequency
+    :type centralFrequency: float
+    :param nucleus: Nucleus string, defaults to '1H'
+    :type nucleus: str, optional
+    :param diffType: 'add' or 'sub', defaults to 'add'
+    :type diffType: str, optional
+    :param ppmlim: ppm limits of alignment, defaults to None
+    :type ppmlim: tuple, optional
+    :param shift: Apply H20 shift to ppm limit, defaults to True
+    :type shift: bool, optional
+    :param target: Target FID, either one FID or one per group (groups..., time).
+        Defaults to None, in which case the difference spectrum nearest to each group's mean is used.
+    :type target: numpy.ndarray, optional
+    :return: Aligned FIDs0, FIDs1, phase (radians) and shift (Hz) applied to FIDs0
+    :rtype: tuple
+    """
+    FIDs0 = np.asarray(FIDs0, dtype=complex)
+    FIDs1 = np.asarray(FIDs1, dtype=complex)
+
+    if diffType.lower() == 'add':
+        combine = add
+    elif diffType.lower() == 'sub':
+        combine = subtract
+    else:
+        raise ValueError('diffType must be add or sub.')
+
     # Process target
     if target is not None:
-        tgt_FID = target
+        tgt_FID = np.asarray(target, dtype=complex)[..., None, :]
+    else:
+        tgt_FID = _nearest_to_mean(combine(FIDs1, FIDs0))
+
+    # (FID1 + S) / 2 - T = (S - (2T - FID1)) / 2 and (FID1 - S) / 2 - T = -(S - (FID1 - 2T)) / 2
+    if diffType.lower() == 'add':
+        tgt_FID0 = 2 * tgt_FID - FIDs1
     else:
-        diffFIDList = []
-        for fid0, fid1 in zip(FIDlist0, FIDlist1):
-            if diffType.lower() == 'add':
-                diffFIDList.append(add(fid1, fid0))
-            elif diffType.lower() == 'sub':
-                diffFIDList.append(subtract(fid1, fid0))
-            else:
-                raise ValueError('diffType must be add or sub.')
-        tgt_FID = get_target_FID(diffFIDList, target='nearest_to_mean')
-
-    # Pass to phase_freq_align
-    mrs = MRS(FID=FIDlist0[0], cf=centralFrequency, bw=bandwidth, nucleus=nucleus)
-    phiOut, epsOut = [], []
-    alignedFIDs0 = []
-    for fid0, fid1 in zip(FIDlist0, FIDlist1):
-        # breakpoint()
-        out = align_FID_diff(mrs, fid0, fid1, tgt_FID, diffType=diffType,
-                             ppmlim=ppmlim, shift=shift)
-        alignedFIDs0.append(out[0])
-        phiOut.append(out[1])
-        epsOut.append(out[2])
-
-    return alignedFIDs0, FIDlist1, phiOut, epsOut
+        tgt_FID0 = FIDs1 - 2 * tgt_FID
+
+    mrs = MRS(FID=FIDs0.reshape(-1, FIDs0.shape[-1])[0], cf=centralFrequency, bw=bandwidth, nucleus=nucleus)
+    phi, eps = fit_phase_freq_batch(mrs, FIDs0, tgt_FID0, ppmlim=ppmlim, shift=shift)
+
+    t = np.asarray(mrs.timeAxis).ravel()
+    alignedFIDs0 = np.exp(-1j * phi)[..., None] * FIDs0 * np.exp(-1j * 2 * np.pi * eps[..., None] * t)
+
+    return alignedFIDs0, FIDs1, phi, eps
 
 
 # Reporting functions
+@deferrable_report()
 def phase_freq_align_report(inFIDs,
                             outFIDs,
                             phi,
@@ -370,6 +596,7 @@ def phase_freq_align_report(inFIDs,
         return fig, fig2, fig3
 
 
+@deferrable_report()
 def phase_freq_align_diff_report(inFIDs0,
                                  inFIDs1,
                                  outFIDs0,
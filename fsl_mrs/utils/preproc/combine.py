@@ -7,6 +7,7 @@
 # SHBASECOPYRIGHT
 
 import numpy as np
+from fsl_mrs.utils.preproc.reporting import deferrable_report
 
 
 def dephase(FIDlist):
@@ -135,6 +136,63 @@ def svd_reduce(FIDlist, W=None, C=None, return_alpha=False):
         return FID
 
 
+def svd_reduce_stack(FIDs, W=None):
+    """Combine a stack of multi-channel FIDs by the wSVD method
+
+    Batched equivalent of svd_reduce, the whole stack is decomposed
+    by a single call to np.linalg.svd.
+
+    :param FIDs: Array of FIDs (stack x timepoints x N coils)
+    :type FIDs: np.array
+    :param W: Pre-whitening matrix applied to all FIDs, defaults to None
+    :type W: np.array, optional
+    :return: Coil combined FIDs (stack x timepoints)
+    :rtype: np.array
+    """
+    FIDs = np.asarray(FIDs)
+    U, S, V = np.linalg.svd(FIDs, full_matrices=False)
+
+    # get arbitrary amplitude
+    iW = np.eye(FIDs.shape[-1])
+    if W is not None:
+        iW = np.linalg.inv(W)
+    amp = V[:, 0, :] @ iW
+
+    # arbitrary scaling here such that the first coil weight is real and positive
+    svdRescale = np.linalg.norm(amp, axis=-1) * (amp[:, 0] / np.abs(amp[:, 0]))
+
+    # combined channels
+    return U[:, :, 0] * (S[:, 0] * svdRescale)[:, np.newaxis]
+
+
+def combine_FIDs_stack(FIDs, do_prewhiten=False, cov=None):
+    """Combine a stack of multi-channel FIDs using the (prewhitened) wSVD method
+
+    Equivalent to calling combine_FIDs(..., 'svd') on each element of the stack,
+    but prewhitening is applied to the whole stack as one matrix product and the
+    SVDs are calculated in a single batched operation.
+
+    :param FIDs: Array of FIDs (stack x timepoints x N coils)
+    :type FIDs: np.array
+    :param do_prewhiten: If true noise whitening is performed before combination, defaults to False
+    :type do_prewhiten: bool, optional
+    :param cov: covariance matrix for noise correlation between coils, defaults to None.
+        If None (and do_prewhiten) the covariance is estimated across the whole stack.
+    :type cov: np.ndarray, optional
+    :return: Combined FIDs (stack x timepoints)
+    :rtype: numpy.array
+    """
+    FIDs = np.asarray(FIDs, dtype=complex)
+    if FIDs.shape[-1] == 1:
+        return FIDs[..., 0]
+
+    pre_w_mat = None
+    if do_prewhiten:
+        FIDs, pre_w_mat, _ = prewhiten(FIDs, C=cov)
+
+    return svd_reduce_stack(FIDs, pre_w_mat)
+
+
 def weightedCombination(FIDlist, weights):
     """
     Combine different FIDS with different complex weights
@@ -210,6 +268,7 @@ def combine_FIDs(FIDlist, method, do_prewhiten=False, do_dephase=False, weights=
             "Should be either 'mean', 'svd', 'svd_weights', or 'weighted'.")
 
 
+@deferrable_report()
 def combine_FIDs_report(inFIDs,
                         outFID,
                         bw,
@@ -5,11 +5,15 @@
 # Copyright (C) 2021 University of Oxford
 # SHBASECOPYRIGHT
 import os.path as op
+from copy import deepcopy
 
 import numpy as np
 
 from fsl_mrs.dynamic import dynMRS
 from fsl_mrs.utils import preproc as proc
+from fsl_mrs.utils import fitting
+from fsl_mrs.utils.misc import FIDToSpec, SpecToFID, rescale_FID
+from fsl_mrs import models
 from fsl_mrs.core import NIFTI_MRS
 from fsl_mrs.utils.preproc.align import phase_freq_align_report
 from fsl_mrs.utils.preproc.nifti_mrs_proc import update_processing_prov, apodize
@@ -17,13 +21,17 @@ from fsl_mrs.utils.preproc.nifti_mrs_proc import update_processing_prov, apodize
 config_file_path = op.dirname(__file__)
 
 
-def align_by_dynamic_fit(data, basis, fitargs={}, verbose=False, apodize_hz=0):
+def align_by_dynamic_fit(data, basis, fitargs={}, verbose=False, apodize_hz=0, fast=False):
     """Phase and frequency alignment based on dynamic fitting
 
     This function performs phase and frequency alignment based on the fsl-mrs
     dynamic fitting tool. All parameters are kept constant except eps (frequency)
     and phi0 (zero-order phase).
 
+    With fast=True the general dynamic fitting machinery is bypassed: the shared
+    spectrum is fitted once and per-transient eps and phi0 are estimated together
+    by a batched Gauss-Newton fit (see fit_shift_and_phase).
+
     Only one higher encoding dimension can be handled currently.
 
     A single basis may be used or a list with a size equal to the size of the aligned
@@ -39,7 +47,12 @@ def align_by_dynamic_fit(data, basis, fitargs={}, verbose=False, apodize_hz=0):
     :type fitargs: dict, optional
     :param verbose: Verbose output, defaults to False
     :type verbose: bool, optional
-    :return: Tuple with the aligned data, shift, and phase
+    :param apodize_hz: Apodize data (Hz) for fitting only, defaults to 0 (off)
+    :type apodize_hz: float, optional
+    :param fast: Use the specialised shift and phase fitting kernel, defaults to False
+    :type fast: bool, optional
+    :return: Tuple with the aligned data, shift, phase, and the fit results
+        (dynRes object, or list of shared spectrum FitRes objects if fast=True)
     :rtype: tuple
     """
     if not isinstance(data, NIFTI_MRS):
@@ -66,25 +79,29 @@ def align_by_dynamic_fit(data, basis, fitargs={}, verbose=False, apodize_hz=0):
     for mrs in mrslist:
         mrs.check_Basis(repair=True)
 
-    tval = np.arange(0, len(mrslist))
+    if fast:
+        eps, phi, dyn_res = fit_shift_and_phase(mrslist, fitargs=fitargs, verbose=verbose)
+        eps = eps[:, 0] / (2 * np.pi)
+    else:
+        tval = np.arange(0, len(mrslist))
+
+        dyn = dynMRS(
+            mrslist,
+            tval,
+            config_file=op.join(config_file_path, 'align_model.py'),
+            **fitargs)
 
-    dyn = dynMRS(
-        mrslist,
-        tval,
-        config_file=op.join(config_file_path, 'align_model.py'),
-        **fitargs)
+        init = dyn.initialise(indiv_init='mean', verbose=verbose)
+        dyn_res = dyn.fit(init=init, verbose=verbose)
 
-    init = dyn.initialise(indiv_init='mean', verbose=verbose)
-    dyn_res = dyn.fit(init=init, verbose=verbose)
+        eps = dyn_res.dataframe_mapped.eps_0.to_numpy() / (2 * np.pi)
+        phi = dyn_res.dataframe_mapped.Phi_0_0.to_numpy()
 
     def correctfid(fid, hz_shift, phase_shift):
         fid_shift = proc.freqshift(fid, data.dwelltime, hz_shift)
         fid_phased = proc.applyPhase(fid_shift, phase_shift)
         return fid_phased
 
-    eps = dyn_res.dataframe_mapped.eps_0.to_numpy() / (2 * np.pi)
-    phi = dyn_res.dataframe_mapped.Phi_0_0.to_numpy()
-
     aligned_obj = data.copy()
     generator = data.iterate_over_dims()
     for (dd, idx), ei, pi in zip(generator, eps, phi):
@@ -92,13 +109,180 @@ def align_by_dynamic_fit(data, basis, fitargs={}, verbose=False, apodize_hz=0):
 
     # Update processing prov
     processing_info = f'{__name__}.align_by_dynamic_fit, '
-    processing_info += f'fitargs={fitargs}.'
+    processing_info += f'fitargs={fitargs}'
+    processing_info += ', fast=True.' if fast else '.'
 
     update_processing_prov(aligned_obj, 'Frequency and phase correction', processing_info)
 
     return aligned_obj, eps, phi, dyn_res
 
 
+# Models in which eps is a per-group frequency shift applied in the time domain
+_SHIFT_PHASE_MODELS = ('voigt', 'lorentzian')
+
+
+def fit_shift_and_phase(mrslist, fitargs={}, passes=2, max_iter=50, tol=1E-8, verbose=False):
+    """Fit a shared spectral model with a per-transient frequency shift and zero-order phase.
+
+    Equivalent to dynamic fitting with all parameters fixed except eps and phi0,
+    but without the general dynamic fitting machinery.
+    The shared model is fitted once to the mean spectrum, then eps and phi0 are
+    estimated for all transients at once by a damped Gauss-Newton fit with
+    the remaining parameters held at the shared values.
+    For passes > 1 the shared model is refitted to the mean of the corrected
+    transients and the per-transient fit repeated.
+
+    Transients with different basis spectra (e.g. edit conditions) are fitted
+    against a shared model fitted to the mean of the transients using that basis.
+
+    :param mrslist: List of MRS objects, one per transient, with basis set
+    :type mrslist: list
+    :param fitargs: Fitting keyword arguments: model ('voigt' or 'lorentzian'), ppmlim,
+        baseline, baseline_order, and metab_groups. Defaults to {}.
+    :type fitargs: dict, optional
+    :param passes: Number of shared model / per-transient fit passes, defaults to 2
+    :type passes: int, optional
+    :param max_iter: Maximum Gauss-Newton iterations, defaults to 50
+    :type max_iter: int, optional
+    :param tol: Convergence tolerance on the parameter update, defaults to 1E-8
+    :type tol: float, optional
+    :param verbose: Verbose output, defaults to False
+    :type verbose: bool, optional
+    :return: eps (rad/s, transients x metabolite groups), phi0 (rad, per transient),
+        and list of shared model FitRes objects (one per distinct basis)
+    :rtype: tuple
+    """
+    fitargs = {key: val for key, val in fitargs.items() if key != 'rescale'}
+    model = fitargs.get('model', 'voigt')
+    if model not in _SHIFT_PHASE_MODELS:
+        raise ValueError(f'Fast alignment only handles the {" or ".join(_SHIFT_PHASE_MODELS)} models, not {model}.')
+
+    # Group transients sharing the same (formatted) basis spectra
+    basis_groups = {}
+    for idx, mrs in enumerate(mrslist):
+        basis_groups.setdefault(mrs.basis.tobytes(), []).append(idx)
+
+    # Common scaling across all transients, as in dynamic fitting
+    fids = np.asarray([mrs.FID for mrs in mrslist])
+    scale = np.mean([rescale_FID(fid, scale=100.0)[1] for fid in fids])
+
+    n_groups = max(fitargs['metab_groups']) + 1 if fitargs.get('metab_groups') else 1
+    eps = np.zeros((len(mrslist), n_groups))
+    phi = np.zeros(len(mrslist))
+    shared_res = []
+    for indices in basis_groups.values():
+        mean_mrs = deepcopy(mrslist[indices[0]])
+        corrected = fids[indices]
+        res = None
+        for npass in range(passes):
+            if verbose:
+                print(f'Shared model fit, pass {npass + 1}/{passes}.')
+            mean_mrs.FID = corrected.mean(axis=0)
+            mean_mrs.fid_scaling = scale
+            mean_mrs.basis_scaling_target = 100.0
+            res = fitting.fit_FSLModel(
+                mean_mrs,
+                method='Newton',
+                x0=None if res is None else res.params,
+                **fitargs)
+            eps[indices], phi[indices] = _gauss_newton_shift_phase(
+                res,
+                mean_mrs,
+                FIDToSpec(fids[indices] * scale, axis=1),
+                None if npass == 0 else (eps[indices], phi[indices]),
+                max_iter,
+                tol)
+            corrected = _correct_shift_phase(fids[indices], mean_mrs.timeAxis.flatten(), eps[indices], phi[indices])
+        shared_res.append(res)
+
+    return eps, phi, shared_res
+
+
+def _correct_shift_phase(fids, t, eps, phi):
+    """Remove per-transient group-0 shift and phase from FIDs (transients on first axis)"""
+    return fids * np.exp(1j * (eps[:, :1] * t + phi[:, None]))
+
+
+def _gauss_newton_shift_phase(res, mrs, spectra, x0, max_iter, tol):
+    """Batched Levenberg-Marquardt fit of eps and phi0 for each spectrum
+    with all other model parameters fixed to those in res.
+
+    :return: eps (transients x groups) and phi0 (transients)
+    :rtype: tuple
+    """
+    _, _, forward, x2p, p2x = models.getModelFunctions(res.model)
+    first, last = mrs.ppmlim_to_range(res.ppmlim)
+    metab_groups, n_groups = res.metab_groups, res.g
+
+    freq = mrs.frequencyAxis.flatten()
+    t = mrs.timeAxis.flatten()
+    basis = mrs.basis
+
+    # Shared time-domain template for each metabolite group (eps = phi = 0)
+    # and the baseline, from the model forward function.
+    params = list(x2p(res.params, mrs.numBasis, n_groups))
+    con, phi1, baseline = params[0], params[-2], params[-1]
+    zero_eps = np.zeros(n_groups)
+
+    def evaluate(con_in, b_in):
+        return forward(p2x(con_in, *params[1:-4], zero_eps, 0.0, 0.0, b_in),
+                       freq[:, None], t[:, None], basis, res.base_poly, metab_groups, n_groups)
+
+    templates = np.zeros((t.size, n_groups), dtype=complex)
+    for gg in range(n_groups):
+        in_group = np.asarray(metab_groups) == gg
+        templates[:, gg] = SpecToFID(evaluate(con * in_group, np.zeros_like(baseline)))
+    baseline_spec = evaluate(np.zeros_like(con), baseline)[first:last]
+    phase_ramp = np.exp(-1j * phi1 * freq[first:last])
+    data = spectra[:, first:last]
+
+    def model_and_jac(eps, phi):
+        fid = templates[None] * np.exp(-1j * eps[:, None, :] * t[None, :, None])
+        spec = FIDToSpec(fid, axis=1)[:, first:last]
+        dspec = FIDToSpec(-1j * t[None, :, None] * fid, axis=1)[:, first:last]
+        phase = np.exp(-1j * phi)[:, None] * phase_ramp
+        metab = phase * spec.sum(axis=-1)
+        jac = np.concatenate((phase[..., None] * dspec, -1j * metab[..., None]), axis=-1)
+        return metab + baseline_spec, jac
+
+    def cost(pred):
+        return np.sum(np.abs(data - pred)**2, axis=1)
+
+    if x0 is None:
+        eps = np.tile(params[-4], (data.shape[0], 1))
+        # Closed form phase at the shared shift
+        pred, _ = model_and_jac(eps, np.zeros(data.shape[0]))
+        phi = np.angle(np.sum((pred - baseline_spec) * (data - baseline_spec).conj(), axis=1))
+    else:
+        eps, phi = x0[0].copy(), x0[1].copy()
+
+    pred, jac = model_and_jac(eps, phi)
+    current = cost(pred)
+    lam = np.full(data.shape[0], 1E-3)
+    active = np.ones(data.shape[0], dtype=bool)
+    for _ in range(max_iter):
+        resid = data - pred
+        jtj = np.real(np.einsum('tli,tlj->tij', jac.conj(), jac))
+        jtr = np.real(np.einsum('tli,tl->ti', jac.conj(), resid))
+        damped = jtj + lam[:, None, None] * np.eye(jtj.shape[-1]) * np.diagonal(jtj, axis1=1, axis2=2)[:, None, :]
+        step = np.linalg.solve(damped, jtr[..., None])[..., 0]
+        step[~active] = 0
+
+        new_pred, new_jac = model_and_jac(eps + step[:, :-1], phi + step[:, -1])
+        new_cost = cost(new_pred)
+        accept = new_cost <= current
+        eps[accept] += step[accept, :-1]
+        phi[accept] += step[accept, -1]
+        pred[accept], jac[accept], current[accept] = new_pred[accept], new_jac[accept], new_cost[accept]
+        lam = np.where(accept, lam / 10, lam * 10)
+
+        active &= ~(accept & (np.abs(step).max(axis=1) < tol)) & (lam < 1E10)
+        if not active.any():
+            break
+
+    return eps, phi
+
+
 def align_by_dynamic_fit_report(indata, aligned_data, eps, phi, ppmlim=(0.0, 4.2), html=None):
     """Report for dynamic fitting alignment
 
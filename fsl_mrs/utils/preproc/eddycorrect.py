@@ -7,6 +7,7 @@
 # SHBASECOPYRIGHT
 
 import numpy as np
+from fsl_mrs.utils.preproc.reporting import deferrable_report
 
 
 def eddy_correct(FIDmet, FIDPhsRef):
@@ -27,6 +28,7 @@ def eddy_correct(FIDmet, FIDPhsRef):
     return np.abs(FIDmet) * np.exp(1j * (np.angle(FIDmet) - phsRef))
 
 
+@deferrable_report()
 def eddy_correct_report(inFID,
                         outFID,
                         phsRef,
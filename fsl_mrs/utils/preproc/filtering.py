@@ -7,13 +7,14 @@
 # SHBASECOPYRIGHT
 
 import numpy as np
+from fsl_mrs.utils.preproc.reporting import deferrable_report
 
 
 def apodize(FID, dwelltime, broadening, filter='exp'):
     """ Apodize FID
 
     Args:
-        FID (ndarray): Time domain data
+        FID (ndarray): Time domain data, time on the last axis
         dwelltime (float): dwelltime in seconds
         broadening (tuple,float): apodisation in Hz
         filter (str,optional):'exp','l2g'
@@ -21,7 +22,8 @@ def apodize(FID, dwelltime, broadening, filter='exp'):
     Returns:
         FID (ndarray): Apodised FID
     """
-    taxis = np.linspace(0, dwelltime * (FID.size - 1), FID.size)
+    npoints = FID.shape[-1]
+    taxis = np.linspace(0, dwelltime * (npoints - 1), npoints)
     if filter == 'exp':
         Tl = 1 / broadening[0]
         window = np.exp(-taxis / Tl)
@@ -35,6 +37,7 @@ def apodize(FID, dwelltime, broadening, filter='exp'):
     return window * FID
 
 
+@deferrable_report()
 def apodize_report(inFID,
                    outFID,
                    bw,
@@ -7,6 +7,7 @@
 # SHBASECOPYRIGHT
 
 import numpy as np
+from fsl_mrs.utils.preproc.reporting import deferrable_report
 
 
 def get_target_FID(FIDlist, target='mean'):
@@ -38,6 +39,7 @@ def add(FID1, FID2):
     return (FID1 + FID2) / 2.0
 
 
+@deferrable_report()
 def add_subtract_report(inFID,
                         inFID2,
                         outFID,
@@ -118,6 +120,7 @@ def add_subtract_report(inFID,
         return fig
 
 
+@deferrable_report()
 def generic_report(inFID,
                    outFID,
                    inHdr,
@@ -7,12 +7,9 @@ SHBASECOPYRIGHT
 '''
 
 import numpy as np
-from scipy.signal import correlate
-from scipy.optimize import minimize
 
 from fsl.data.image import Image
 
-from fsl_mrs.utils.preproc import freqshift, pad
 from fsl_mrs.utils.misc import FIDToSpec
 from fsl_mrs.core.nifti_mrs import NIFTI_MRS
 
@@ -39,24 +36,26 @@ def mrsi_phase_corr(data, mask=None, ppmlim=None):
     else:
         limits = data.mrs().mrs_from_average().ppmlim_to_range(ppmlim, shift=True)
 
-    phs_array = np.zeros(data.shape[:3] + data.shape[4:])
-    phs = np.zeros(data.shape[:3])
-    out = data.copy()
-    for dd, idx in data.iterate_over_dims(iterate_over_space=False):
-        dd[mask, :], phs[mask] = phase_corr_max_real(
-            dd[mask, :],
-            limits=limits)
+    # All masked voxels and higher dimension elements are phased in one step
+    out = data[:].copy()
+    tmp, phs = phase_corr_max_real(
+        np.moveaxis(data[:][mask, :], 1, -1).reshape(-1, data.shape[3]),
+        limits=limits)
 
-        out[idx] = dd
-        phs_array[idx[:3] + idx[4:]] = phs * 180 / np.pi
+    out[mask, :] = np.moveaxis(tmp.reshape((np.sum(mask),) + data.shape[4:] + (data.shape[3],)), -1, 1)
+    phs_array = np.zeros(data.shape[:3] + data.shape[4:])
+    phs_array[mask] = phs.reshape((np.sum(mask),) + data.shape[4:]) * 180 / np.pi
 
-    return out, Image(phs_array, xform=data.voxToWorldMat)
+    return NIFTI_MRS(out, header=data.header), Image(phs_array, xform=data.voxToWorldMat)
 
 
 def phase_corr_max_real(fids, limits=None):
     """Phase correction of multiple FIDs based on maximising the real part fo the spectrum
     Optionally define limits between which to maximise.
 
+    The zero-order phase which maximises the summed real part is found in closed form
+    as the negative angle of the complex sum of the spectrum across the limits.
+
     :param fids: list of FIDs
     :type fids: list or np.array
     :param limits: limits over which to maximise real part, index of array, defaults to None
@@ -64,20 +63,16 @@ def phase_corr_max_real(fids, limits=None):
     :return: Phased FIDs, array of applied phases
     :rtype: (np.array, np.array)
     """
-
+    fids = np.asarray(fids)
     if limits is None:
         limits = (0, fids.shape[1])
 
-    phases = []
-    for fid in fids:
-        def phase_fun(x):
-            return -np.sum(FIDToSpec(fid * np.exp(1j * x))[limits[0]:limits[1]].real)
-        phases.append(minimize(phase_fun, 1E-3).x[0])  # Init with non-zero
+    phases = -np.angle(np.sum(FIDToSpec(fids, axis=1)[:, limits[0]:limits[1]], axis=1))
 
-    return np.stack([fid * np.exp(1j * x) for fid, x in zip(fids, phases)]), np.asarray(phases)
+    return fids * np.exp(1j * phases[:, None]), phases
 
 
-def mrsi_freq_align(data, mask=None, zpad_factor=1, separate_higher_dim=False):
+def mrsi_freq_align(data, mask=None, zpad_factor=1, separate_higher_dim=False, interpolate=True):
     """Frequency align MRSI data using cross correlation to mean FID.
 
     :param data: MRSI data
@@ -88,6 +83,8 @@ def mrsi_freq_align(data, mask=None, zpad_factor=1, separate_higher_dim=False):
     :type zpad_factor: int, optional
     :param separate_higher_dim: Align each higher dimension element independently across space.
     :type separate_higher_dim: Bool, optional
+    :param interpolate: Estimate shifts to sub-point precision, defaults to True
+    :type interpolate: Bool, optional
     :return: Returns shifted MRSI data and Image containing shifts applied in Hz
     :rtype: NIFTI_MRS, Image
     """
@@ -104,7 +101,8 @@ def mrsi_freq_align(data, mask=None, zpad_factor=1, separate_higher_dim=False):
             dd[mask, :], shifts[mask] = xcorr_align(
                 dd[mask, :],
                 data.dwelltime,
-                zpad_factor=zpad_factor)
+                zpad_factor=zpad_factor,
+                interpolate=interpolate)
 
             out[idx] = dd
             shift_array[idx[:3] + idx[4:]] = shifts
@@ -114,7 +112,8 @@ def mrsi_freq_align(data, mask=None, zpad_factor=1, separate_higher_dim=False):
         tmp, shifts = xcorr_align(
             np.moveaxis(data[:][mask, :], 1, -1).reshape(-1, data.shape[3]),
             data.dwelltime,
-            zpad_factor=zpad_factor)
+            zpad_factor=zpad_factor,
+            interpolate=interpolate)
 
         out[mask, :] = np.moveaxis(tmp.reshape((np.sum(mask),) + data.shape[4:] + (data.shape[3],)), -1, 1)
         if shift_array.ndim == 3:
@@ -124,47 +123,77 @@ def mrsi_freq_align(data, mask=None, zpad_factor=1, separate_higher_dim=False):
         return NIFTI_MRS(out, header=data.header), Image(shift_array, xform=data.voxToWorldMat)
 
 
-def xcorr_align(fids_in, dwelltime, zpad_factor=1):
+def xcorr_align(fids_in, dwelltime, zpad_factor=1, interpolate=True, chunk_size=4096):
     """Align fids using cross correlation to mean
 
+    Magnitude spectra of all FIDs are cross-correlated with the mean spectrum via FFTs
+    of the stacked (chunked) data, and the frequency shift is applied to all FIDs at once.
+
     :param fids_in: Array of FIDs, transients x timedomain
     :type fids_in: numpy.ndarray
     :param dwelltime: spectral dwell time (1/bandwidth) in s.
     :type dwelltime: float
     :param zpad_factor: Zeropadding applied to fid before xcorrelation, defaults to 1, 0 disables
     :type zpad_factor: int
+    :param interpolate: Refine the correlation peak to sub-point precision by parabolic
+        interpolation, defaults to True. If False shifts are integer multiples of the (padded) spectral resolution.
+    :type interpolate: bool, optional
+    :param chunk_size: Number of FIDs processed in each block, defaults to 4096
+    :type chunk_size: int, optional
     :returns: tuple containing shifted FIDs, shifts in Hz
     """
-    def zpad(x):
-        return pad(x, fids_in.shape[1] * zpad_factor, 'last')
+    npoints = fids_in.shape[1]
+    length = npoints * (1 + zpad_factor)
+    nfft = 2 * length
 
     def prep_spec(x):
-        return np.abs(FIDToSpec(zpad(x)))
+        return np.abs(FIDToSpec(np.pad(x, ((0, 0), (0, length - npoints))), axis=1))
+
+    mean_spec_ft = np.fft.rfft(prep_spec(fids_in.mean(axis=0)[None, :]), n=nfft, axis=1).conj()
+
+    # Lags equivalent to scipy.signal.correlate(..., mode='same')
+    lags = np.arange(length) - length // 2
+
+    shifts = np.zeros(fids_in.shape[0])
+    for start in range(0, fids_in.shape[0], chunk_size):
+        chunk = slice(start, start + chunk_size)
+        xcorr = np.fft.irfft(np.fft.rfft(prep_spec(fids_in[chunk]), n=nfft, axis=1) * mean_spec_ft, n=nfft, axis=1)
+        xcorr = xcorr[:, lags % nfft]
+        peak = np.argmax(xcorr, axis=1)
+        shifts[chunk] = lags[peak]
+
+        if interpolate:
+            inner = (peak > 0) & (peak < length - 1)
+            rows = np.flatnonzero(inner)
+            y0 = xcorr[rows, peak[inner] - 1]
+            y1 = xcorr[rows, peak[inner]]
+            y2 = xcorr[rows, peak[inner] + 1]
+            denom = y0 - 2 * y1 + y2
+            with np.errstate(divide='ignore', invalid='ignore'):
+                delta = np.where(denom < 0, 0.5 * (y0 - y2) / denom, 0.0)
+            shifts[start + rows] += delta
 
-    padded_mean_spec = prep_spec(fids_in.mean(axis=0))
-
-    shifts = []
-    for fid in fids_in:
-        shifts.append(
-            np.argmax(correlate(prep_spec(fid), padded_mean_spec, mode='same')))
-    shifts = np.asarray(shifts)
-    shifts -= int(fids_in.shape[1] * 0.5 * (1 + zpad_factor))
     bandwidth = 1 / dwelltime
-    shifts_hz = - shifts.astype(float) * bandwidth / (fids_in.shape[1] * (1 + zpad_factor))
+    shifts_hz = - shifts * bandwidth / length
 
-    return np.stack([freqshift(fid, dwelltime, s) for fid, s in zip(fids_in, shifts_hz)]), shifts_hz
+    # Equivalent to freqshift applied to each FID
+    tAxis = np.linspace(0, dwelltime * npoints, npoints)
+    return fids_in * np.exp(1j * 2 * np.pi * shifts_hz[:, None] * tAxis), shifts_hz
 
 
-def lipid_removal_l2(data, beta=1E-5, lipid_mask=None, lipid_basis=None):
+def lipid_removal_l2(data, beta=1E-5, lipid_mask=None, lipid_basis=None, rank=None):
     """Lipid removal using the L2-regularised 'reconstruction' approach.
 
     The user must specify one of lipid_mask or lipid_basis.
-    Currently only implemented for MRSI data with no higher NIfTI dimensions.
 
     Originally published by Bilgic et al in jMRI 2014 doi: 10.1002/jmri.24365
     The code is broadly a port of the matlab demo hosted by the original authors at
     https://martinos.org/~berkin/software.html
 
+    The operator (I + beta * L L^H)^-1 is never formed. Using the SVD of the
+    lipid basis, L = U S V^H, it equals I - U diag(beta s^2 / (1 + beta s^2)) U^H,
+    which is applied to all FIDs (including any higher NIfTI dimensions) at once.
+
     :param data: MRSI data
     :type data: fsl_mrs.core.nifti_mrs.NIFTI_MRS
     :param beta: regularisation scaling parameter, defaults to 1E-5
@@ -173,12 +202,11 @@ def lipid_removal_l2(data, beta=1E-5, lipid_mask=None, lipid_basis=None):
     :type lipid_mask: fsl.data.image.Image, optional
     :param lipid_basis: Array of lipid FIDS, fist dim should be time, defaults to None
     :type lipid_basis: np.array, optional
+    :param rank: Truncate the lipid basis to this many principal components, defaults to None (no truncation)
+    :type rank: int, optional
     :return: Data with lipids removed
     :rtype: fsl_mrs.core.nifti_mrs.NIFTI_MRS
     """
-    if data.ndim > 4 and np.prod(data.shape[4:]) > 1.0:
-        raise ValueError('Data cannot have higher NIfTI dimensions.')
-
     # Assemble a lipid basis from masked region or the direct input
     if lipid_basis is not None:
         if lipid_basis.shape[0] != data.shape[3]:
@@ -192,17 +220,26 @@ def lipid_removal_l2(data, beta=1E-5, lipid_mask=None, lipid_basis=None):
         if not any(lipid_mask.ravel()):
             raise ValueError('Mask image must contain some selected voxels.')
 
-        lipid_basis = data[:][lipid_mask, :].T
-        assert lipid_basis.shape[0] == data.shape[3]
+        # Lipid FIDs from all masked voxels and higher dimension elements
+        lipid_basis = np.moveaxis(data[:][lipid_mask, :], 1, 0).reshape(data.shape[3], -1)
     else:
         raise TypeError('One of lipid_mask or lipid_basis must be specified. Both are set to None.')
 
-    # Calculate the inverted matrix
-    lipid_inv = np.linalg.inv(np.eye(lipid_basis.shape[0]) + beta * (lipid_basis @ lipid_basis.T.conj()))
+    if rank is not None and rank < 1:
+        raise ValueError('rank must be a positive integer.')
+
+    # Low rank form of the inverted matrix
+    u, s, _ = np.linalg.svd(lipid_basis, full_matrices=False)
+    if rank is not None:
+        u, s = u[:, :rank], s[:rank]
+    weights = beta * s**2 / (1 + beta * s**2)
+
+    # Apply to all FIDs in one product
+    fids = np.moveaxis(data[:], 3, 0)
+    fids_flat = fids.reshape(data.shape[3], -1)
+    corrected = fids_flat - u @ (weights[:, None] * (u.conj().T @ fids_flat))
 
-    # Apply voxel-wise
     reduced_lipid_img = data.copy()
-    for dd, idx in data.iterate_over_dims(iterate_over_space=True):
-        reduced_lipid_img[idx] = lipid_inv @ dd
+    reduced_lipid_img[:] = np.moveaxis(corrected.reshape(fids.shape), 0, 3)
 
     return reduced_lipid_img
@@ -7,6 +7,7 @@ Author: Saad Jbabdi <saad@fmrib.ox.ac.uk>
 Copyright (C) 2021 University of Oxford
 SHBASECOPYRIGHT'''
 from datetime import datetime
+from functools import partial
 
 import numpy as np
 
@@ -14,7 +15,6 @@ from fsl_mrs.utils import preproc
 from fsl_mrs.core import NIFTI_MRS
 from fsl_mrs.core import nifti_mrs as ntools
 from fsl_mrs import __version__
-from fsl_mrs.utils.misc import shift_FID
 
 
 class DimensionsDoNotMatch(Exception):
@@ -59,10 +59,98 @@ def first_index(idx):
     return all([ii == slice(None, None, None) or ii == 0 for ii in idx])
 
 
+def report_indices(data, report_all=False):
+    """Indices of the FIDs shown in figures and reports.
+
+    Equivalent to the indices of iterate_over_dims(iterate_over_space=True)
+    filtered by report_all or first_index.
+
+    :param data: NIfTI-MRS object
+    :type data: fsl_mrs.core.nifti_mrs.NIFTI_MRS
+    :param report_all: True to return all indices, otherwise only the first, defaults to False
+    :type report_all: bool, optional
+    :return: List of index tuples
+    :rtype: list
+    """
+    if report_all:
+        return [idx[:3] + (slice(None),) + idx[3:] for idx in np.ndindex(data.shape[:3] + data.shape[4:])]
+    return [(0, 0, 0, slice(None)) + (0,) * (data.ndim - 4)]
+
+
+# Default number of worker processes used to process independent index groups,
+# set using set_workers
+_workers = 1
+
+
+def set_workers(workers):
+    """Set the default number of worker processes used by functions in this module
+    which process independent index groups (e.g. voxels) separately.
+
+    :param workers: Number of processes, 1 (or None) to run in this process
+    :type workers: int
+    """
+    global _workers
+    _workers = 1 if workers is None else max(1, int(workers))
+
+
+def _resolve_workers(workers):
+    """Return the number of workers, using the module default if None."""
+    return _workers if workers is None else max(1, int(workers))
+
+
+def parallel_map(func, groups, workers=None):
+    """Apply func to each independent index group, optionally using a pool of worker processes.
+
+    Results are returned in the order of groups, independent of the order
+    in which the workers complete, so the output is deterministic.
+
+    :param func: Function (must be picklable) applied to each group
+    :type func: callable
+    :param groups: Sequence of groups, e.g. arrays of FIDs
+    :type groups: list or numpy.ndarray
+    :param workers: Number of processes, defaults to None (module default, see set_workers)
+    :type workers: int, optional
+    :return: List of results, one per group
+    :rtype: list
+    """
+    workers = min(_resolve_workers(workers), len(groups))
+    if workers <= 1:
+        return [func(group) for group in groups]
+
+    import multiprocessing as mp
+    with mp.Pool(workers) as pool:
+        return pool.map(func, groups, chunksize=max(1, len(groups) // (4 * workers)))
+
+
+def parallel_batch(func, stacked, workers=None):
+    """Run a batched function on contiguous chunks of a stack of independent groups,
+    one chunk per worker, and reassemble the results in order.
+
+    :param func: Function (must be picklable) taking an array with groups on the first axis.
+        It should return an array, or tuple of arrays, with groups on the first axis.
+    :type func: callable
+    :param stacked: Array of groups, groups on first axis
+    :type stacked: numpy.ndarray
+    :param workers: Number of processes, defaults to None (module default, see set_workers)
+    :type workers: int, optional
+    :return: Output of func for the whole stack
+    :rtype: numpy.ndarray or tuple
+    """
+    workers = min(_resolve_workers(workers), len(stacked))
+    if workers <= 1:
+        return func(stacked)
+
+    results = parallel_map(func, np.array_split(stacked, workers), workers)
+    if isinstance(results[0], tuple):
+        return tuple(np.concatenate(res, axis=0) for res in zip(*results))
+    return np.concatenate(results, axis=0)
+
+
 def coilcombine(
         data,
         reference=None,
         noise=None, covariance=None, no_prewhiten=False,
+        workers=None,
         figure=False,
         report=None,
         report_all=False):
@@ -72,6 +160,7 @@ def coilcombine(
     :param noise: Supply noise (NCoils x M) to estimate coil covariance (overridden by no_prewhiten)
     :param covariance: Supply coil-covariance for prewhitening (overridden by noise or no_prewhiten)
     :param no_prewhiten: True to disable prewhitening
+    :param int workers: Number of worker processes, defaults to None (see set_workers)
     :param figure: True to show figure.
     :param report: Provide output location as path to generate report
     :param report_all: True to output all indicies
@@ -145,57 +234,42 @@ def coilcombine(
 
         combinedc_obj[:] = np.sum(weighted_data, axis=coil_dim)
 
-        if (figure or report):
-            from fsl_mrs.utils.preproc.combine import combine_FIDs_report
-            for main, idx in data.iterate_over_dims(dim='DIM_COIL',
-                                                    iterate_over_space=True,
-                                                    reduce_dim_index=True):
-
-                if (report_all or first_index(idx)):
-                    fig = combine_FIDs_report(
-                        main,
-                        combinedc_obj[idx],
-                        data.bandwidth,
-                        data.spectrometer_frequency[0],
-                        data.nucleus[0],
-                        ncha=data.shape[data.dim_position('DIM_COIL')],
-                        ppmlim=(0.0, 6.0),
-                        method='svd',
-                        dim='DIM_COIL',
-                        html=report)
-                    if figure:
-                        fig.show()
-                if first_index(idx):
-                    break
-
     else:
-        # If there is no reference data (or [TODO] supplied weights) then have to run
-        # per-voxel wSVD. This is slow for high-res MRSI data
+        # If there is no reference data (or [TODO] supplied weights) then run
+        # wSVD on every voxel and higher dimension index as one batched operation.
+        from fsl_mrs.utils.preproc.combine import combine_FIDs_stack
+        # Stack as (voxels * other dimensions) x time x coils
+        data_array = np.moveaxis(data[:], (3, coil_dim), (-2, -1))
+        stack_shape = data_array.shape[:-2]
+        combined = parallel_batch(
+            partial(combine_FIDs_stack, do_prewhiten=not no_prewhiten, cov=coil_cov),
+            data_array.reshape((-1, ) + data_array.shape[-2:]),
+            workers)
+        combined = np.moveaxis(combined.reshape(stack_shape + (data.shape[3], )), -1, 3)
+        combinedc_obj[:] = combined.reshape(combinedc_obj.shape)
+
+    if (figure or report):
+        from fsl_mrs.utils.preproc.combine import combine_FIDs_report
         for main, idx in data.iterate_over_dims(dim='DIM_COIL',
                                                 iterate_over_space=True,
                                                 reduce_dim_index=True):
-
-            combinedc_obj[idx] = preproc.combine_FIDs(
-                list(main.T),
-                'svd',
-                do_prewhiten=not no_prewhiten,
-                cov=coil_cov)
-
-        if (figure or report) and (report_all or first_index(idx)):
-            from fsl_mrs.utils.preproc.combine import combine_FIDs_report
+            if not (report_all or first_index(idx)):
+                continue
             fig = combine_FIDs_report(
                 main,
                 combinedc_obj[idx],
                 data.bandwidth,
                 data.spectrometer_frequency[0],
                 data.nucleus[0],
-                ncha=data.shape[data.dim_position('DIM_COIL')],
+                ncha=ncoils,
                 ppmlim=(0.0, 6.0),
                 method='svd',
                 dim='DIM_COIL',
                 html=report)
             if figure:
                 fig.show()
+            if not report_all:
+                break
 
     # Update processing prov
     processing_info = f'{__name__}.coilcombine, '
@@ -226,24 +300,24 @@ def average(data, dim, figure=False, report=None, report_all=False):
     '''
     # Check that requested dimension exists and is non-singleton
     # First check carried out in dim_position method
-    if data.shape[data.dim_position(dim)] == 1:
+    dim_position = data.dim_position(dim)
+    if data.shape[dim_position] == 1:
         print(f'{dim} dimension is singleton, no averaging performed, returning unmodified input.')
         return data
 
     combined_obj = data.copy(remove_dim=dim)
-    for dd, idx in data.iterate_over_dims(dim=dim,
-                                          iterate_over_space=True,
-                                          reduce_dim_index=True):
-        combined_obj[idx] = preproc.combine_FIDs(dd, 'mean')
+    combined_obj[:] = np.mean(data[:], axis=dim_position)
 
-        if (figure or report) and (report_all or first_index(idx)):
-            from fsl_mrs.utils.preproc.combine import combine_FIDs_report
-            fig = combine_FIDs_report(dd,
+    if figure or report:
+        from fsl_mrs.utils.preproc.combine import combine_FIDs_report
+        for idx in report_indices(combined_obj, report_all):
+            in_idx = idx[:dim_position] + (slice(None),) + idx[dim_position:]
+            fig = combine_FIDs_report(data[in_idx],
                                       combined_obj[idx],
                                       data.bandwidth,
                                       data.spectrometer_frequency[0],
                                       data.nucleus[0],
-                                      ncha=data.shape[data.dim_position(dim)],
+                                      ncha=data.shape[dim_position],
                                       ppmlim=(0.0, 6.0),
                                       method=f'Mean along dim = {dim}',
                                       html=report)
@@ -266,6 +340,7 @@ def align(
         target=None,
         ppmlim=None,
         niter=2,
+        workers=None,
         figure=False,
         report=None,
         report_all=False):
@@ -281,6 +356,7 @@ def align(
     :param target: Optional target FID
     :param ppmlim: ppm search limits.
     :param int niter: Number of total iterations
+    :param int workers: Number of worker processes, defaults to None (see set_workers)
     :param figure: True to show figure.
     :param report: Provide output location as path to generate report
     :param report_all: True to output all indicies
@@ -302,109 +378,47 @@ def align(
                                            iterate_over_space=True,
                                            reduce_dim_index=False)
 
-    mrs = data.mrs()[0]
-    for dd, idx in generator:
-
-        if dim == 'all':
-            # flatten
-            original_shape = dd.shape
-            dd = dd.reshape(original_shape[0], -1)
-
-        if window is None:
-            # Use original single transient alignment
-            out = preproc.phase_freq_align(
-                dd.T,
-                data.bandwidth,
-                data.spectrometer_frequency[0],
-                nucleus=data.nucleus[0],
-                ppmlim=ppmlim,
-                niter=niter,
-                verbose=False,
-                target=target)
-
-            if dim == 'all':
-                aligned_obj[idx], phi, eps = out[0].T.reshape(original_shape), out[1], out[2]
-            else:
-                aligned_obj[idx], phi, eps = out[0].T, out[1], out[2]
-
-        else:
-            # Use iterative windowed alignment
-            curr_phs = np.zeros(dd.shape[1])
-            curr_eps = np.zeros(dd.shape[1])
-            curr_raw = dd.copy()
-
-            mean_eps = 1
-            nwiter = 0
-            win_size = window
-            if target is None:
-                set_target = True
-            else:
-                set_target = False
-            while mean_eps > 0.02:
-                if win_size % 2:
-                    # Odd window size: up the size of the window by two
-                    # discard the outer two zeros
-                    weighting_func = np.hanning(win_size + 2)
-                    weighting_func = weighting_func[1:-1]
-                    stride_size = win_size
-                else:
-                    # Even window size: up the size of the window by three
-                    # discard the outer two zeros
-                    weighting_func = np.hanning(win_size + 3)
-                    weighting_func = weighting_func[1:-1]
-                    stride_size = win_size + 1
-                half_win = int(win_size / 2)
-
-                # Handle window size 1 case
-                if win_size == 1:
-                    padded_data = curr_raw
-                else:
-                    padded_data = np.concatenate(
-                        (curr_raw[:, -half_win:], curr_raw[:, :], curr_raw[:, :half_win]),
-                        axis=1)
-
-                win_avg_data = np.lib.stride_tricks.sliding_window_view(
-                    padded_data,
-                    stride_size,
-                    axis=1) * weighting_func
-                win_avg_data = win_avg_data.mean(axis=-1)
-
-                if set_target:
-                    target = curr_raw.mean(axis=1)
-
-                _, phi, eps = preproc.phase_freq_align(
-                    win_avg_data.T,
-                    data.bandwidth,
-                    data.spectrometer_frequency[0],
+    # Stack every set of transients to align as (groups x transients x time)
+    dd_list, idx_list = zip(*generator)
+    original_shape = dd_list[0].shape
+    stacked = np.stack([dd.reshape(original_shape[0], -1).T for dd in dd_list])
+
+    if window is None:
+        # Use original single transient alignment, batched across all groups
+        aligned, phi_all, eps_all = parallel_batch(
+            partial(preproc.phase_freq_align_batch,
+                    bandwidth=data.bandwidth,
+                    centralFrequency=data.spectrometer_frequency[0],
+                    nucleus=data.nucleus[0],
                     ppmlim=ppmlim,
                     niter=niter,
-                    target=target)
-
-                for jdx, fid in enumerate(curr_raw.T):
-                    curr_raw.T[jdx] = np.exp(-1j * phi[jdx]) * shift_FID(mrs, fid, eps[jdx])
-
-                curr_phs += phi
-                curr_eps += eps
-                mean_eps = np.abs(eps).mean()
-                nwiter += 1
-                print(f'{nwiter}: {np.abs(phi).mean()} deg, {mean_eps} Hz.')
-                if nwiter == 30:
-                    print('Reached windowed average iteration limit. Stopping.')
-                    break
-
-            if dim == 'all':
-                aligned_obj[idx], phi, eps = curr_raw.reshape(original_shape), curr_phs, curr_eps
-            else:
-                aligned_obj[idx], phi, eps = curr_raw, curr_phs, curr_eps
+                    verbose=False,
+                    target=target),
+            stacked,
+            workers)
+
+    else:
+        # Use iterative windowed alignment, each group independently
+        results = parallel_map(
+            partial(_windowed_align,
+                    dwelltime=data.dwelltime,
+                    bandwidth=data.bandwidth,
+                    centralFrequency=data.spectrometer_frequency[0],
+                    window=window,
+                    target=target,
+                    ppmlim=ppmlim,
+                    niter=niter),
+            stacked,
+            workers)
+        aligned, phi_all, eps_all = (np.stack(res) for res in zip(*results))
+
+    for dd, idx, aligned_fids, phi, eps in zip(dd_list, idx_list, aligned, phi_all, eps_all):
+        aligned_obj[idx] = aligned_fids.T.reshape(original_shape)
 
         if (figure or report) and (report_all or first_index(idx)):
             from fsl_mrs.utils.preproc.align import phase_freq_align_report
-            if dim == 'all':
-                output_for_report = aligned_obj[idx].reshape(original_shape[0], -1)
-            else:
-                output_for_report = aligned_obj[idx]
-            fig = phase_freq_align_report(dd.T,
-                                          output_for_report.T,
+            fig = phase_freq_align_report(dd.reshape(original_shape[0], -1).T,
+                                          aligned_fids,
                                           phi,
                                           eps,
                                           data.bandwidth,
@@ -432,12 +446,82 @@ def align(
     return aligned_obj
 
 
+def _windowed_align(FIDs, dwelltime, bandwidth, centralFrequency, window, target, ppmlim, niter):
+    """Iterative windowed alignment of a single group of transients (transients x time).
+
+    :return: Aligned FIDs (transients x time), phases, and shifts
+    :rtype: tuple
+    """
+    t = np.arange(FIDs.shape[1]) * dwelltime
+    curr_phs = np.zeros(FIDs.shape[0])
+    curr_eps = np.zeros(FIDs.shape[0])
+    curr_raw = FIDs.T.copy()
+
+    mean_eps = 1
+    nwiter = 0
+    win_size = window
+    set_target = target is None
+    while mean_eps > 0.02:
+        if win_size % 2:
+            # Odd window size: up the size of the window by two
+            # discard the outer two zeros
+            weighting_func = np.hanning(win_size + 2)
+            weighting_func = weighting_func[1:-1]
+            stride_size = win_size
+        else:
+            # Even window size: up the size of the window by three
+            # discard the outer two zeros
+            weighting_func = np.hanning(win_size + 3)
+            weighting_func = weighting_func[1:-1]
+            stride_size = win_size + 1
+        half_win = int(win_size / 2)
+
+        # Handle window size 1 case
+        if win_size == 1:
+            padded_data = curr_raw
+        else:
+            padded_data = np.concatenate(
+                (curr_raw[:, -half_win:], curr_raw[:, :], curr_raw[:, :half_win]),
+                axis=1)
+
+        win_avg_data = np.lib.stride_tricks.sliding_window_view(
+            padded_data,
+            stride_size,
+            axis=1) * weighting_func
+        win_avg_data = win_avg_data.mean(axis=-1)
+
+        if set_target:
+            target = curr_raw.mean(axis=1)
+
+        _, phi, eps = preproc.phase_freq_align(
+            win_avg_data.T,
+            bandwidth,
+            centralFrequency,
+            ppmlim=ppmlim,
+            niter=niter,
+            target=target)
+
+        curr_raw = np.exp(-1j * phi) * curr_raw * np.exp(-1j * 2 * np.pi * t[:, None] * eps)
+
+        curr_phs += phi
+        curr_eps += eps
+        mean_eps = np.abs(eps).mean()
+        nwiter += 1
+        print(f'{nwiter}: {np.abs(phi).mean()} deg, {mean_eps} Hz.')
+        if nwiter == 30:
+            print('Reached windowed average iteration limit. Stopping.')
+            break
+
+    return curr_raw.T, curr_phs, curr_eps
+
+
 def aligndiff(data,
               dim_align,
               dim_diff,
               diff_type,
               target=None,
               ppmlim=None,
+              workers=None,
               figure=False,
               report=None,
               report_all=False):
@@ -450,6 +534,7 @@ def aligndiff(data,
     :param str diff_type: Either 'add' or 'sub'
     :param target: Optional target FID
     :param ppmlim: ppm search limits.
+    :param int workers: Number of worker processes, defaults to None (see set_workers)
     :param figure: True to show figure.
     :param report: Provide output location as path to generate report
     :param report_all: True to output all indicies
@@ -473,24 +558,26 @@ def aligndiff(data,
         else:
             data_1.append(dd)
 
-    for d0, d1, idx in zip(data_0, data_1, index_0):
-        out = preproc.phase_freq_align_diff(
-            d0.T,
-            d1.T,
-            data.bandwidth,
-            data.spectrometer_frequency[0],
-            nucleus=data.nucleus[0],
-            diffType=diff_type,
-            ppmlim=ppmlim,
-            target=target)
+    # Align all sub-spectra pairs as one batch of (groups x transients x time)
+    aligned_0, _, phi_all, eps_all = parallel_batch(
+        partial(_align_diff_pairs,
+                bandwidth=data.bandwidth,
+                centralFrequency=data.spectrometer_frequency[0],
+                nucleus=data.nucleus[0],
+                diffType=diff_type,
+                ppmlim=ppmlim,
+                target=target),
+        np.stack([np.stack((d0.T, d1.T)) for d0, d1 in zip(data_0, data_1)]),
+        workers)
 
-        aligned_obj[idx], _, phi, eps = np.asarray(out[0]).T, out[1], out[2], out[3]
+    for d0, d1, idx, aligned_fids, phi, eps in zip(data_0, data_1, index_0, aligned_0, phi_all, eps_all):
+        aligned_obj[idx] = aligned_fids.T
 
         if (figure or report) and (report_all or first_index(idx)):
             from fsl_mrs.utils.preproc.align import phase_freq_align_diff_report
             fig = phase_freq_align_diff_report(d0.T,
                                                d1.T,
-                                               aligned_obj[idx].T,
+                                               aligned_fids,
                                                d1.T,
                                                phi,
                                                eps,
@@ -520,6 +607,11 @@ def aligndiff(data,
     return aligned_obj
 
 
+def _align_diff_pairs(pairs, **kwargs):
+    """Batched sub-spectra alignment of stacked pairs (groups x 2 x transients x time)."""
+    return preproc.phase_freq_align_diff_batch(pairs[:, 0], pairs[:, 1], **kwargs)
+
+
 def ecc(data, reference, figure=False, report=None, report_all=False):
     '''Apply eddy current correction using a reference dataset
     :param NIFTI_MRS data: Data to eddy current correct
@@ -537,20 +629,22 @@ def ecc(data, reference, figure=False, report=None, report_all=False):
                                    ' or reference must be single FID.')
 
     corrected_obj = data.copy()
-    for dd, idx in data.iterate_over_dims(iterate_over_space=True):
-
-        if data.shape == reference.shape:
-            # Reference is the same shape as data, voxel-wise and spectrum-wise iteration
-            ref = reference[idx]
-        else:
-            # Only one reference FID, only iterate over spatial voxels.
-            ref = reference[idx[0], idx[1], idx[2], :]
-
-        corrected_obj[idx] = preproc.eddy_correct(dd, ref)
+    if data.shape == reference.shape:
+        # Reference is the same shape as data, voxel-wise and spectrum-wise correction
+        ref_all = reference[:]
+    else:
+        # Only one reference FID per spatial voxel, broadcast over higher dimensions.
+        ref_all = reference[:].reshape(reference.shape[:4] + (1,) * (data.ndim - 4))
+    corrected_obj[:] = preproc.eddy_correct(data[:], ref_all)
 
-        if (figure or report) and (report_all or first_index(idx)):
-            from fsl_mrs.utils.preproc.eddycorrect import eddy_correct_report
-            fig = eddy_correct_report(dd,
+    if figure or report:
+        from fsl_mrs.utils.preproc.eddycorrect import eddy_correct_report
+        for idx in report_indices(data, report_all):
+            if data.shape == reference.shape:
+                ref = reference[idx]
+            else:
+                ref = reference[idx[0], idx[1], idx[2], :]
+            fig = eddy_correct_report(data[idx],
                                       corrected_obj[idx],
                                       ref,
                                       data.bandwidth,
@@ -570,29 +664,30 @@ def ecc(data, reference, figure=False, report=None, report_all=False):
     return corrected_obj
 
 
-def remove_peaks(data, limits, limit_units='ppm+shift', figure=False, report=None, report_all=False):
+def remove_peaks(data, limits, limit_units='ppm+shift',
+                 hankel_size=None, sparse_algo=False, workers=None,
+                 figure=False, report=None, report_all=False):
     '''Apply HLSVD to remove peaks from specta
     :param NIFTI_MRS data: Data to remove peaks from
-    :param limits: ppm limits between which peaks will be removed
+    :param limits: ppm limits between which peaks will be removed.
+        A list of limits removes peaks in all ranges using a single decomposition.
     :param str limit_units: Can be 'Hz', 'ppm' or 'ppm+shift'.
+    :param int hankel_size: Number of rows of the Hankel matrix, defaults to half the FID length.
+    :param bool sparse_algo: Use the sparse HLSVD decomposition.
+    :param int workers: Number of worker processes used for the decompositions,
+        defaults to None (see set_workers)
     :param figure: True to show figure.
     :param report: Provide output location as path to generate report
     :param report_all: True to output all indicies
 
     :return: Corrected data in NIFTI_MRS format.
     '''
-    corrected_obj = data.copy()
-    for dd, idx in data.iterate_over_dims(iterate_over_space=True):
+    corrected_obj = _hlsvd_all(data, limits, limit_units, 20, hankel_size, sparse_algo, workers, False)
 
-        corrected_obj[idx] = preproc.hlsvd(dd,
-                                           data.dwelltime,
-                                           data.spectrometer_frequency[0],
-                                           limits,
-                                           limitUnits=limit_units)
-
-        if (figure or report) and (report_all or first_index(idx)):
-            from fsl_mrs.utils.preproc.remove import hlsvd_report
-            fig = hlsvd_report(dd,
+    if figure or report:
+        from fsl_mrs.utils.preproc.remove import hlsvd_report
+        for idx in report_indices(data, report_all):
+            fig = hlsvd_report(data[idx],
                                corrected_obj[idx],
                                limits,
                                data.bandwidth,
@@ -606,7 +701,10 @@ def remove_peaks(data, limits, limit_units='ppm+shift', figure=False, report=Non
     # Update processing prov
     processing_info = f'{__name__}.remove_peaks, '
     processing_info += f'limits={limits}, '
-    processing_info += f'limit_units={limit_units}.'
+    processing_info += f'limit_units={limit_units}'
+    if hankel_size is not None:
+        processing_info += f', hankel_size={hankel_size}'
+    processing_info += '.'
 
     update_processing_prov(corrected_obj, 'Nuisance peak removal', processing_info)
 
@@ -614,32 +712,30 @@ def remove_peaks(data, limits, limit_units='ppm+shift', figure=False, report=Non
 
 
 def hlsvd_model_peaks(data, limits,
-                      limit_units='ppm+shift', components=5, figure=False, report=None, report_all=False):
+                      limit_units='ppm+shift', components=5,
+                      hankel_size=None, sparse_algo=False, workers=None,
+                      figure=False, report=None, report_all=False):
     '''Apply HLSVD to model spectum
     :param NIFTI_MRS data: Data to model
     :param limits: ppm limits between which spectrum will be modeled
     :param str limit_units: Can be 'Hz', 'ppm' or 'ppm+shift'.
     :param int components: Number of lorentzian components to model
+    :param int hankel_size: Number of rows of the Hankel matrix, defaults to half the FID length.
+    :param bool sparse_algo: Use the sparse HLSVD decomposition.
+    :param int workers: Number of worker processes used for the decompositions,
+        defaults to None (see set_workers)
     :param figure: True to show figure.
     :param report: Provide output location as path to generate report
     :param report_all: True to output all indicies
 
     :return: Corrected data in NIFTI_MRS format.
     '''
-    corrected_obj = data.copy()
-    for dd, idx in data.iterate_over_dims(iterate_over_space=True):
-
-        corrected_obj[idx] = preproc.model_fid_hlsvd(
-            dd,
-            data.dwelltime,
-            data.spectrometer_frequency[0],
-            limits,
-            limitUnits=limit_units,
-            numSingularValues=components)
+    corrected_obj = _hlsvd_all(data, limits, limit_units, components, hankel_size, sparse_algo, workers, True)
 
-        if (figure or report) and (report_all or first_index(idx)):
-            from fsl_mrs.utils.preproc.remove import hlsvd_report
-            fig = hlsvd_report(dd,
+    if figure or report:
+        from fsl_mrs.utils.preproc.remove import hlsvd_report
+        for idx in report_indices(data, report_all):
+            fig = hlsvd_report(data[idx],
                                corrected_obj[idx],
                                limits,
                                data.bandwidth,
@@ -654,13 +750,33 @@ def hlsvd_model_peaks(data, limits,
     processing_info = f'{__name__}.hlsvd_model_peaks, '
     processing_info += f'limits={limits}, '
     processing_info += f'limit_units={limit_units}, '
-    processing_info += f'components={components}.'
+    processing_info += f'components={components}'
+    if hankel_size is not None:
+        processing_info += f', hankel_size={hankel_size}'
+    processing_info += '.'
 
     update_processing_prov(corrected_obj, 'HLSVD modeling', processing_info)
 
     return corrected_obj
 
 
+def _hlsvd_all(data, limits, limit_units, components, hankel_size, sparse_algo, workers, model):
+    """Run HLSVD removal/modelling on every FID of a NIfTI-MRS object as one stack."""
+    corrected_obj = data.copy()
+    corrected = preproc.hlsvd_stack(np.moveaxis(data[:], 3, -1),
+                                    data.dwelltime,
+                                    data.spectrometer_frequency[0],
+                                    limits,
+                                    limitUnits=limit_units,
+                                    numSingularValues=components,
+                                    sparse_algo=sparse_algo,
+                                    hankel_size=hankel_size,
+                                    model=model,
+                                    workers=_resolve_workers(workers))
+    corrected_obj[:] = np.moveaxis(corrected, -1, 3)
+    return corrected_obj
+
+
 def tshift(data, tshiftStart=0.0, tshiftEnd=0.0, samples=None, figure=False, report=None, report_all=False):
     '''Apply time shift or resampling to each FID
     :param NIFTI_MRS data: Data to shift
@@ -683,23 +799,23 @@ def tshift(data, tshiftStart=0.0, tshiftEnd=0.0, samples=None, figure=False, rep
             np.zeros(new_shape, dtype=data.dtype),
             header=data.header)
 
-    for dd, idx in data.iterate_over_dims(iterate_over_space=True):
-        shifted_obj[idx], newDT = preproc.timeshift(dd,
-                                                    data.dwelltime,
-                                                    tshiftStart,
-                                                    tshiftEnd,
-                                                    samples)
-
-        if (figure or report) and (report_all or first_index(idx)):
-            from fsl_mrs.utils.preproc.shifting import shift_report
+    shifted, newDT = preproc.timeshift(np.moveaxis(data[:], 3, -1),
+                                       data.dwelltime,
+                                       tshiftStart,
+                                       tshiftEnd,
+                                       samples)
+    shifted_obj[:] = np.moveaxis(shifted, -1, 3)
 
+    if figure or report:
+        from fsl_mrs.utils.preproc.shifting import shift_report
+        for idx in report_indices(data, report_all):
             original_hdr = {'bandwidth': data.bandwidth,
                             'centralFrequency': data.spectrometer_frequency[0],
                             'ResonantNucleus': data.nucleus[0]}
             new_hdr = {'bandwidth': 1 / newDT,
                        'centralFrequency': data.spectrometer_frequency[0],
                        'ResonantNucleus': data.nucleus[0]}
-            fig = shift_report(dd,
+            fig = shift_report(data[idx],
                                shifted_obj[idx],
                                original_hdr,
                                new_hdr,
@@ -740,27 +856,27 @@ def truncate_or_pad(data, npoints, position, figure=False, report=None, report_a
         np.zeros(new_shape, dtype=data.dtype),
         header=data.header)
 
-    for dd, idx in data.iterate_over_dims(iterate_over_space=True):
-        if npoints > 0:
-            trunc_obj[idx] = preproc.pad(dd,
-                                         np.abs(npoints),
-                                         position)
-            rep_func = 'pad'
-        elif npoints < 0:
-            trunc_obj[idx] = preproc.truncate(dd,
-                                              np.abs(npoints),
-                                              position)
-            rep_func = 'truncate'
-        else:
-            rep_func = 'none'
+    if npoints > 0:
+        trunc_obj[:] = np.moveaxis(
+            preproc.pad(np.moveaxis(data[:], 3, -1), np.abs(npoints), position),
+            -1, 3)
+        rep_func = 'pad'
+    elif npoints < 0:
+        trunc_obj[:] = np.moveaxis(
+            preproc.truncate(np.moveaxis(data[:], 3, -1), np.abs(npoints), position),
+            -1, 3)
+        rep_func = 'truncate'
+    else:
+        rep_func = 'none'
 
-        if (figure or report) and (report_all or first_index(idx)):
-            from fsl_mrs.utils.preproc.shifting import shift_report
+    if figure or report:
+        from fsl_mrs.utils.preproc.shifting import shift_report
+        for idx in report_indices(data, report_all):
             original_hdr = {'bandwidth': data.bandwidth,
                             'centralFrequency': data.spectrometer_frequency[0],
                             'ResonantNucleus': data.nucleus[0]}
 
-            fig = shift_report(dd,
+            fig = shift_report(data[idx],
                                trunc_obj[idx],
                                original_hdr,
                                original_hdr,
@@ -793,15 +909,17 @@ def apodize(data, amount, filter='exp', figure=False, report=None, report_all=Fa
     :return: Filtered data in NIFTI_MRS format.
     '''
     apod_obj = data.copy()
-    for dd, idx in data.iterate_over_dims(iterate_over_space=True):
-        apod_obj[idx] = preproc.apodize(dd,
-                                        data.dwelltime,
-                                        amount,
-                                        filter=filter)
+    apod_obj[:] = np.moveaxis(
+        preproc.apodize(np.moveaxis(data[:], 3, -1),
+                        data.dwelltime,
+                        amount,
+                        filter=filter),
+        -1, 3)
 
-        if (figure or report) and (report_all or first_index(idx)):
-            from fsl_mrs.utils.preproc.filtering import apodize_report
-            fig = apodize_report(dd,
+    if figure or report:
+        from fsl_mrs.utils.preproc.filtering import apodize_report
+        for idx in report_indices(data, report_all):
+            fig = apodize_report(data[idx],
                                  apod_obj[idx],
                                  data.bandwidth,
                                  data.spectrometer_frequency[0],
@@ -844,22 +962,22 @@ def fshift(data, amount, figure=False, report=None, report_all=False):
         shift_map = True
     else:
         shift_map = False
-        toshift = amount
+    toshift = amount
 
     shift_obj = data.copy()
-    for dd, idx in data.iterate_over_dims(iterate_over_space=True):
-        if shift_map:
-            toshift = amount[idx[:3] + idx[4:]]
-        shift_obj[idx] = preproc.freqshift(dd,
-                                           data.dwelltime,
-                                           toshift)
+    shift_obj[:] = np.moveaxis(
+        preproc.freqshift(np.moveaxis(data[:], 3, -1),
+                          data.dwelltime,
+                          toshift),
+        -1, 3)
 
-        if (figure or report) and (report_all or first_index(idx)):
-            from fsl_mrs.utils.preproc.shifting import shift_report
+    if figure or report:
+        from fsl_mrs.utils.preproc.shifting import shift_report
+        for idx in report_indices(data, report_all):
             original_hdr = {'bandwidth': data.bandwidth,
                             'centralFrequency': data.spectrometer_frequency[0],
                             'ResonantNucleus': data.nucleus[0]}
-            fig = shift_report(dd,
+            fig = shift_report(data[idx],
                                shift_obj[idx],
                                original_hdr,
                                original_hdr,
@@ -896,44 +1014,41 @@ def shift_to_reference(data, ppm_ref, peak_search, use_avg=False, figure=False,
     '''
 
     shift_obj = data.copy()
+    fids = np.moveaxis(data[:], 3, -1)
     if use_avg:
-        # Combine all higher dimensions
-        shift = np.zeros(data.shape[:3])
-        for dd, idx in data.iterate_over_spatial():
-            comb_data = preproc.combine_FIDs(
-                dd.reshape(dd.shape[0], -1),
-                'svd',
-                do_prewhiten=False)
-            # Run shift estimation
-            _, shift[idx[:3]] = preproc.shiftToRef(
-                comb_data,
-                ppm_ref,
-                data.bandwidth,
-                data.spectrometer_frequency[0],
-                nucleus=data.nucleus[0],
-                ppmlim=peak_search)
-
-    for dd, idx in data.iterate_over_dims(iterate_over_space=True):
-        if use_avg:
-            shift_obj[idx] = preproc.freqshift(
-                dd,
-                data.dwelltime,
-                - shift[idx[:3]] * data.spectrometer_frequency[0])
-        else:
-            shift_obj[idx], _ = preproc.shiftToRef(
-                dd,
-                ppm_ref,
-                data.bandwidth,
-                data.spectrometer_frequency[0],
-                nucleus=data.nucleus[0],
-                ppmlim=peak_search)
+        # Combine all higher dimensions of each voxel, then estimate shift of all voxels at once
+        from fsl_mrs.utils.preproc.combine import combine_FIDs_stack
+        comb_data = combine_FIDs_stack(
+            data[:].reshape((-1, data.shape[3], int(np.prod(data.shape[4:])))))
+        _, shift = preproc.shiftToRef(
+            comb_data,
+            ppm_ref,
+            data.bandwidth,
+            data.spectrometer_frequency[0],
+            nucleus=data.nucleus[0],
+            ppmlim=peak_search)
+        shift = shift.reshape(data.shape[:3] + (1,) * (data.ndim - 4))
+        shifted = preproc.freqshift(
+            fids,
+            data.dwelltime,
+            - shift * data.spectrometer_frequency[0])
+    else:
+        shifted, _ = preproc.shiftToRef(
+            fids,
+            ppm_ref,
+            data.bandwidth,
+            data.spectrometer_frequency[0],
+            nucleus=data.nucleus[0],
+            ppmlim=peak_search)
+    shift_obj[:] = np.moveaxis(shifted, -1, 3)
 
-        if (figure or report) and (report_all or first_index(idx)):
-            from fsl_mrs.utils.preproc.shifting import shift_report
+    if figure or report:
+        from fsl_mrs.utils.preproc.shifting import shift_report
+        for idx in report_indices(data, report_all):
             original_hdr = {'bandwidth': data.bandwidth,
                             'centralFrequency': data.spectrometer_frequency[0],
                             'ResonantNucleus': data.nucleus[0]}
-            fig = shift_report(dd,
+            fig = shift_report(data[idx],
                                shift_obj[idx],
                                original_hdr,
                                original_hdr,
@@ -1035,7 +1150,8 @@ def remove_unlike(data, ppmlim=None, sdlimit=1.96, niter=2, figure=False, report
     return good_out, bad_out
 
 
-def phase_correct(data, ppmlim, hlsvd=False, use_avg=False, figure=False, report=None, report_all=False):
+def phase_correct(data, ppmlim, hlsvd=False, use_avg=False, hlsvd_refine=True, workers=None,
+                  figure=False, report=None, report_all=False):
     '''Zero-order phase correct based on peak maximum
 
     :param NIFTI_MRS data: Data to truncate or pad
@@ -1043,6 +1159,9 @@ def phase_correct(data, ppmlim, hlsvd=False, use_avg=False, figure=False, report
     :param bool hlsvd: Use HLSVD to remove peaks outside the ppmlim
     :param bool use_avg: If multiple spectra in higher dimensions,
         use the average of all the higher dimension spectra to calculate phase correction.
+    :param bool hlsvd_refine: Remove peaks above and below ppmlim with two successive HLSVD decompositions.
+        If False a single decomposition per FID is used. Only used if hlsvd=True.
+    :param int workers: Number of worker processes used for HLSVD, defaults to None (see set_workers)
     :param figure: True to show figure.
     :param report: Provide output location as path to generate report
     :param report_all: True to output all indicies
@@ -1051,42 +1170,38 @@ def phase_correct(data, ppmlim, hlsvd=False, use_avg=False, figure=False, report
     '''
 
     phs_obj = data.copy()
+    fids = np.moveaxis(data[:], 3, -1)
+    phase_args = {'nucleus': data.nucleus[0],
+                  'ppmlim': ppmlim,
+                  'use_hlsvd': hlsvd,
+                  'hlsvd_refine': hlsvd_refine,
+                  'workers': _resolve_workers(workers)}
     if use_avg:
-        # Combine all higher dimensions
-        p0 = np.zeros(data.shape[:3])
-        pos_all = np.zeros(data.shape[:3], int)
-        for dd, idx in data.iterate_over_spatial():
-            comb_data = preproc.combine_FIDs(
-                dd.reshape(dd.shape[0], -1),
-                'svd',
-                do_prewhiten=False)
-            # Run phase correction estimation
-            _, p0[idx[:3]], pos_all[idx[:3]] = preproc.phaseCorrect(
-                comb_data,
-                phs_obj.bandwidth,
-                phs_obj.spectrometer_frequency[0],
-                nucleus=phs_obj.nucleus[0],
-                ppmlim=ppmlim,
-                use_hlsvd=hlsvd)
-
-    for dd, idx in data.iterate_over_dims(iterate_over_space=True):
-        if use_avg:
-            phs_obj[idx] = preproc.applyPhase(
-                dd,
-                p0[idx[:3]])
-            pos = pos_all[idx[:3]]
-        else:
-            phs_obj[idx], _, pos = preproc.phaseCorrect(
-                dd,
-                data.bandwidth,
-                data.spectrometer_frequency[0],
-                nucleus=data.nucleus[0],
-                ppmlim=ppmlim,
-                use_hlsvd=hlsvd)
+        # Combine all higher dimensions of each voxel, then estimate phase of all voxels at once
+        from fsl_mrs.utils.preproc.combine import combine_FIDs_stack
+        comb_data = combine_FIDs_stack(
+            data[:].reshape((-1, data.shape[3], int(np.prod(data.shape[4:])))))
+        _, p0, pos_all = preproc.phaseCorrect_stack(
+            comb_data,
+            data.bandwidth,
+            data.spectrometer_frequency[0],
+            **phase_args)
+        p0 = p0.reshape(data.shape[:3])
+        pos_all = pos_all.reshape(data.shape[:3])
+        phased = preproc.applyPhase(fids, p0.reshape(data.shape[:3] + (1,) * (data.ndim - 3)))
+    else:
+        phased, _, pos_all = preproc.phaseCorrect_stack(
+            fids,
+            data.bandwidth,
+            data.spectrometer_frequency[0],
+            **phase_args)
+    phs_obj[:] = np.moveaxis(phased, -1, 3)
 
-        if (figure or report) and (report_all or first_index(idx)):
-            from fsl_mrs.utils.preproc.phasing import phaseCorrect_report
-            fig = phaseCorrect_report(dd,
+    if figure or report:
+        from fsl_mrs.utils.preproc.phasing import phaseCorrect_report
+        for idx in report_indices(data, report_all):
+            pos = pos_all[idx[:3]] if use_avg else pos_all[idx[:3] + idx[4:]]
+            fig = phaseCorrect_report(data[idx],
                                       phs_obj[idx],
                                       pos,
                                       data.bandwidth,
@@ -1101,6 +1216,8 @@ def phase_correct(data, ppmlim, hlsvd=False, use_avg=False, figure=False, report
     processing_info = f'{__name__}.phase_correct, '
     processing_info += f'ppmlim={ppmlim}, '
     processing_info += f'hlsvd={hlsvd}, '
+    if hlsvd and not hlsvd_refine:
+        processing_info += f'hlsvd_refine={hlsvd_refine}, '
     processing_info += f'use_avg={use_avg}.'
 
     update_processing_prov(phs_obj, 'Phasing', processing_info)
@@ -1122,38 +1239,39 @@ def apply_fixed_phase(data, p0, p1=0.0, p1_type='shift', figure=False, report=No
     :return: Phased data in NIFTI_MRS format.
     '''
     phs_obj = data.copy()
-    for dd, idx in data.iterate_over_dims(iterate_over_space=True):
-        phs_obj[idx] = preproc.applyPhase(dd,
-                                          p0 * (np.pi / 180.0))
-
-        if p1 != 0.0:
-            if p1_type.lower() == 'shift':
-                phs_obj[idx], _ = preproc.timeshift(
-                    phs_obj[idx],
-                    data.dwelltime,
-                    p1,
-                    p1,
-                    samples=data.shape[3])
-            elif p1_type.lower() == 'linphase':
-                from fsl_mrs.utils.misc import calculateAxes
-                faxis = calculateAxes(
-                    data.spectralwidth,
-                    data.spectrometer_frequency[0],
-                    data.shape[3],
-                    0.0)['freq']
-                phs_obj[idx] = preproc.applyLinPhase(
-                    phs_obj[idx],
-                    faxis,
-                    p1)
-            else:
-                raise ValueError("p1_type kwarg must be 'shift' or 'linphase'.")
+    phased = preproc.applyPhase(np.moveaxis(data[:], 3, -1),
+                                p0 * (np.pi / 180.0))
 
-        if (figure or report) and (report_all or first_index(idx)):
-            from fsl_mrs.utils.preproc.general import generic_report
+    if p1 != 0.0:
+        if p1_type.lower() == 'shift':
+            phased, _ = preproc.timeshift(
+                phased,
+                data.dwelltime,
+                p1,
+                p1,
+                samples=data.shape[3])
+        elif p1_type.lower() == 'linphase':
+            from fsl_mrs.utils.misc import calculateAxes
+            faxis = calculateAxes(
+                data.spectralwidth,
+                data.spectrometer_frequency[0],
+                data.shape[3],
+                0.0)['freq']
+            phased = preproc.applyLinPhase(
+                phased,
+                faxis,
+                p1)
+        else:
+            raise ValueError("p1_type kwarg must be 'shift' or 'linphase'.")
+    phs_obj[:] = np.moveaxis(phased, -1, 3)
+
+    if figure or report:
+        from fsl_mrs.utils.preproc.general import generic_report
+        for idx in report_indices(data, report_all):
             original_hdr = {'bandwidth': data.bandwidth,
                             'centralFrequency': data.spectrometer_frequency[0],
                             'ResonantNucleus': data.nucleus[0]}
-            fig = generic_report(dd,
+            fig = generic_report(data[idx],
                                  phs_obj[idx],
                                  original_hdr,
                                  original_hdr,
@@ -1316,22 +1434,21 @@ def conjugate(data, figure=False, report=None, report_all=False):
     conj_data = data.copy()
     conj_data[:] = conj_data[:].conj()
 
-    if report:
-        for dd, idx in data.iterate_over_dims(iterate_over_space=True):
-            if report_all or first_index(idx):
-                from fsl_mrs.utils.preproc.general import generic_report
-                original_hdr = {'bandwidth': data.bandwidth,
-                                'centralFrequency': data.spectrometer_frequency[0],
-                                'ResonantNucleus': data.nucleus[0]}
-                fig = generic_report(dd,
-                                     conj_data[idx],
-                                     original_hdr,
-                                     original_hdr,
-                                     ppmlim=(0.2, 4.2),
-                                     html=report,
-                                     function='conjugate')
-                if figure:
-                    fig.show()
+    if figure or report:
+        from fsl_mrs.utils.preproc.general import generic_report
+        for idx in report_indices(data, report_all):
+            original_hdr = {'bandwidth': data.bandwidth,
+                            'centralFrequency': data.spectrometer_frequency[0],
+                            'ResonantNucleus': data.nucleus[0]}
+            fig = generic_report(data[idx],
+                                 conj_data[idx],
+                                 original_hdr,
+                                 original_hdr,
+                                 ppmlim=(0.2, 4.2),
+                                 html=report,
+                                 function='conjugate')
+            if figure:
+                fig.show()
 
     # Update processing prov
     processing_info = f'{__name__}.conjugate.'
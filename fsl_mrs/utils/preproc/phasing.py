@@ -12,7 +12,8 @@ import numpy as np
 from fsl_mrs.core import MRS
 from fsl_mrs.utils.misc import extract_spectrum, checkCFUnits, FIDToSpec, SpecToFID
 from fsl_mrs.utils.preproc.shifting import pad
-from fsl_mrs.utils.preproc.remove import hlsvd
+from fsl_mrs.utils.preproc.remove import hlsvd, hlsvd_stack
+from fsl_mrs.utils.preproc.reporting import deferrable_report
 
 
 def applyPhase(FID, phaseAngle):
@@ -26,7 +27,7 @@ def applyLinPhase(FID, frequency_axis, time):
     """
     Multiply spectrum by linear phase
     """
-    return SpecToFID(FIDToSpec(FID) * np.exp(1j * 2 * np.pi * frequency_axis * time))
+    return SpecToFID(FIDToSpec(FID, axis=-1) * np.exp(1j * 2 * np.pi * frequency_axis * time), axis=-1)
 
 
 def phaseCorrect(FID, bw, cf, nucleus='1H', ppmlim=(2.8, 3.2), shift=True, use_hlsvd=False):
@@ -76,6 +77,74 @@ def phaseCorrect(FID, bw, cf, nucleus='1H', ppmlim=(2.8, 3.2), shift=True, use_h
     return applyPhase(FID, phaseAngle), phaseAngle, int(np.round(maxIndex / 4))
 
 
+def phaseCorrect_stack(FIDs, bw, cf, nucleus='1H', ppmlim=(2.8, 3.2), shift=True,
+                       use_hlsvd=False, hlsvd_refine=True, workers=1):
+    """Phase correction of a stack of FIDs based on the phase of a maximum point.
+
+    Equivalent to phaseCorrect applied to each FID, but all (zero-padded) spectra
+    are calculated with a single stacked FFT.
+
+    :param FIDs: Time domain data, shape (..., time)
+    :type FIDs: numpy.ndarray
+    :param bw: bandwidth in Hz
+    :type bw: float
+    :param cf: central frequency
+    :type cf: float
+    :param nucleus: Nucleus string, defaults to '1H'
+    :type nucleus: str, optional
+    :param ppmlim: Limit to this ppm range, defaults to (2.8, 3.2)
+    :type ppmlim: tuple, optional
+    :param shift: Apply H20 shift, defaults to True
+    :type shift: bool, optional
+    :param use_hlsvd: Use HLSVD to remove peaks outside the limits first, defaults to False
+    :type use_hlsvd: bool, optional
+    :param hlsvd_refine: Remove peaks above and below the limits with two successive HLSVD
+        decompositions (as phaseCorrect), defaults to True.
+        If False a single decomposition is used for both ranges.
+    :type hlsvd_refine: bool, optional
+    :param workers: Number of worker processes for HLSVD, defaults to 1
+    :type workers: int, optional
+    :return: Phase corrected FIDs, phase angles in radians, index of phased point
+    :rtype: tuple
+    """
+    cf = checkCFUnits(cf, units='Hz')
+    FIDs = np.asarray(FIDs)
+    npoints = FIDs.shape[-1]
+    flat = FIDs.reshape(-1, npoints)
+
+    if use_hlsvd:
+        # Run HLSVD to remove peaks outside limits
+        upper = (ppmlim[1] + 0.5, ppmlim[1] + 3.0)
+        lower = (ppmlim[0] - 3.0, ppmlim[0] - 0.5)
+        try:
+            if hlsvd_refine:
+                fid_hlsvd = hlsvd_stack(flat, 1 / bw, cf, upper, limitUnits='ppm+shift', workers=workers)
+                fid_hlsvd = hlsvd_stack(fid_hlsvd, 1 / bw, cf, lower, limitUnits='ppm+shift', workers=workers)
+            else:
+                fid_hlsvd = hlsvd_stack(flat, 1 / bw, cf, [upper, lower], limitUnits='ppm+shift', workers=workers)
+        except Exception:
+            # Fall back to FID by FID processing so failures only affect individual FIDs
+            out = [phaseCorrect(fid, bw, cf, nucleus=nucleus, ppmlim=ppmlim, shift=shift, use_hlsvd=True)
+                   for fid in flat]
+            phased, phaseAngle, index = (np.asarray(x) for x in zip(*out))
+            return phased.reshape(FIDs.shape), phaseAngle.reshape(FIDs.shape[:-1]), index.reshape(FIDs.shape[:-1])
+    else:
+        fid_hlsvd = flat
+
+    # Find maximum of absolute spectrum in ppm limit
+    mrs = MRS(FID=np.zeros(npoints * 4, dtype=complex), bw=bw, cf=cf, nucleus=nucleus)
+    first, last = mrs.ppmlim_to_range(ppmlim=ppmlim, shift=shift)
+    spec = FIDToSpec(np.pad(fid_hlsvd, ((0, 0), (0, npoints * 3))), axis=1)[:, first:last]
+
+    maxIndex = np.argmax(np.abs(spec), axis=1)
+    phaseAngle = -np.angle(spec[np.arange(spec.shape[0]), maxIndex])
+
+    phased = applyPhase(flat, phaseAngle[:, None])
+    index = np.round(maxIndex / 4).astype(int)
+    return phased.reshape(FIDs.shape), phaseAngle.reshape(FIDs.shape[:-1]), index.reshape(FIDs.shape[:-1])
+
+
+@deferrable_report()
 def phaseCorrect_report(inFID,
                         outFID,
                         position,
@@ -0,0 +1,252 @@
+# pipeline.py - Run a sequence of nifti_mrs_proc operations in memory
+#
+# Author: FSL-MRS contributors
+#
+# Copyright (C) 2026 University of Oxford
+# SHBASECOPYRIGHT
+
+import inspect
+import json
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from fsl_mrs.core.nifti_mrs import NIFTI_MRS
+from fsl_mrs.utils.preproc import nifti_mrs_proc
+
+
+# nifti_mrs_proc functions which can be used as pipeline steps
+PIPELINE_STEPS = (
+    'coilcombine',
+    'average',
+    'align',
+    'aligndiff',
+    'ecc',
+    'remove_peaks',
+    'hlsvd_model_peaks',
+    'tshift',
+    'truncate_or_pad',
+    'apodize',
+    'fshift',
+    'shift_to_reference',
+    'remove_unlike',
+    'phase_correct',
+    'apply_fixed_phase',
+    'subtract',
+    'add',
+    'conjugate')
+
+# Step arguments which take NIfTI-MRS data, these can be specified as file paths
+NIFTI_MRS_ARGS = ('reference', 'data1')
+
+
+class PipelineError(Exception):
+    pass
+
+
+@dataclass
+class PipelineStep:
+    '''A single processing step: nifti_mrs_proc function name, its keyword arguments
+    and (optionally) a name under which to save the output of this step.'''
+    function: str
+    kwargs: dict = field(default_factory=dict)
+    save: str = None
+
+
+class Pipeline:
+    """Chain of nifti_mrs_proc operations applied to in-memory NIfTI-MRS data.
+
+    Data is only written for steps with the save option set,
+    provenance is recorded by each step as when called individually.
+
+    Example::
+
+        pipe = Pipeline()
+        pipe.add_step('average', dim='DIM_DYN')
+        pipe.add_step('phase_correct', ppmlim=(2.8, 3.2), save='phased')
+        processed = pipe.run(data, output='proc_dir')
+
+    Or loaded from a recipe file::
+
+        pipe = Pipeline.from_recipe('recipe.yaml')
+
+    where the recipe lists steps in order, each as a mapping of
+    nifti_mrs_proc function name to its keyword arguments::
+
+        steps:
+          - align:
+              dim: DIM_DYN
+              ppmlim: [0.2, 4.2]
+          - average:
+              dim: DIM_DYN
+          - ecc:
+              reference: wref.nii.gz
+          - phase_correct:
+              ppmlim: [2.8, 3.2]
+              save: true
+    """
+
+    def __init__(self, steps=None):
+        """Create pipeline
+
+        :param steps: List of PipelineStep objects, defaults to None
+        :type steps: list, optional
+        """
+        self.steps = []
+        if steps is not None:
+            for step in steps:
+                self.add_step(step.function, save=step.save, **step.kwargs)
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __repr__(self):
+        return 'Pipeline(' + ' -> '.join(step.function for step in self.steps) + ')'
+
+    def add_step(self, function, save=None, **kwargs):
+        """Append a processing step to the pipeline.
+
+        :param function: Name of nifti_mrs_proc function
+        :type function: str
+        :param save: Save the output of this step. True to use a default name,
+            or a string to specify the file name. Defaults to None (not saved).
+        :type save: bool or str, optional
+        :param kwargs: Keyword arguments passed to the function.
+            NIfTI-MRS arguments (reference, data1) may be given as file paths.
+        :return: The pipeline, to allow chained calls
+        :rtype: Pipeline
+        """
+        if function not in PIPELINE_STEPS:
+            raise PipelineError(
+                f'{function} is not a recognised pipeline step. '
+                f'Choose from: {", ".join(PIPELINE_STEPS)}.')
+
+        parameters = inspect.signature(getattr(nifti_mrs_proc, function)).parameters
+        for key in kwargs:
+            if key not in parameters or key == 'data':
+                raise PipelineError(f'{key} is not a valid argument for {function}.')
+
+        if save is True:
+            save = f'{len(self.steps):02d}_{function}'
+        elif save is False:
+            save = None
+
+        self.steps.append(PipelineStep(function, kwargs, save))
+        return self
+
+    @classmethod
+    def from_dict(cls, recipe):
+        """Create pipeline from a dictionary (or list) recipe.
+
+        :param recipe: Dict with a 'steps' key, or list of steps.
+            Each step is a single item mapping of function name to keyword arguments.
+        :type recipe: dict or list
+        :return: Pipeline
+        :rtype: Pipeline
+        """
+        if isinstance(recipe, dict):
+            if 'steps' not in recipe:
+                raise PipelineError("Recipe must contain a 'steps' list.")
+            recipe = recipe['steps']
+
+        pipe = cls()
+        for step in recipe:
+            if isinstance(step, str):
+                function, kwargs = step, {}
+            elif isinstance(step, dict) and len(step) == 1:
+                function, kwargs = next(iter(step.items()))
+                kwargs = {} if kwargs is None else dict(kwargs)
+            else:
+                raise PipelineError(f'Unrecognised recipe step: {step}.')
+
+            # Lists (e.g. ppm limits) are passed as tuples
+            kwargs = {key: tuple(val) if isinstance(val, list) else val for key, val in kwargs.items()}
+            save = kwargs.pop('save', None)
+            pipe.add_step(function, save=save, **kwargs)
+        return pipe
+
+    @classmethod
+    def from_recipe(cls, recipe_file):
+        """Create pipeline from a YAML (or JSON) recipe file.
+
+        NIfTI-MRS arguments given as relative paths which do not exist from the working directory
+        are resolved relative to the recipe location.
+
+        :param recipe_file: Path to .yaml, .yml or .json file.
+        :type recipe_file: str or pathlib.Path
+        :return: Pipeline
+        :rtype: Pipeline
+        """
+        recipe_file = Path(recipe_file)
+        with open(recipe_file) as fp:
+            if recipe_file.suffix.lower() == '.json':
+                recipe = json.load(fp)
+            else:
+                try:
+                    import yaml
+                except ImportError:
+                    raise PipelineError(
+                        'Could not import yaml. It can be installed by running "pip install PyYAML",'
+                        ' alternatively use a JSON recipe.')
+                recipe = yaml.safe_load(fp)
+
+        pipe = cls.from_dict(recipe)
+        for step in pipe.steps:
+            for key in NIFTI_MRS_ARGS:
+                if isinstance(step.kwargs.get(key), str):
+                    path = Path(step.kwargs[key])
+                    if not path.is_absolute() and not path.exists():
+                        path = recipe_file.parent / path
+                    step.kwargs[key] = str(path)
+        return pipe
+
+    def run(self, data, output=None, report=None, report_all=False, verbose=False):
+        """Run all steps on NIfTI-MRS data.
+
+        :param data: Input data
+        :type data: fsl_mrs.core.nifti_mrs.NIFTI_MRS
+        :param output: Output directory for saved intermediate steps, defaults to None
+        :type output: str or pathlib.Path, optional
+        :param report: Provide output location as path to generate reports for each step, defaults to None
+        :type report: str, optional
+        :param report_all: True to output reports for all indicies, defaults to False
+        :type report_all: bool, optional
+        :param verbose: Print each step as it is run, defaults to False
+        :type verbose: bool, optional
+        :return: Processed data
+        :rtype: fsl_mrs.core.nifti_mrs.NIFTI_MRS
+        """
+        if output is None and any(step.save for step in self.steps):
+            raise PipelineError('Specify an output directory to save intermediate steps.')
+
+        loaded = {}
+
+        def load(arg):
+            if isinstance(arg, (str, Path)):
+                if str(arg) not in loaded:
+                    loaded[str(arg)] = NIFTI_MRS(arg)
+                return loaded[str(arg)]
+            return arg
+
+        for idx, step in enumerate(self.steps):
+            if verbose:
+                print(f'Step {idx + 1}/{len(self.steps)}: {step.function}.')
+            func = getattr(nifti_mrs_proc, step.function)
+            parameters = inspect.signature(func).parameters
+
+            kwargs = {key: load(val) if key in NIFTI_MRS_ARGS else val
+                      for key, val in step.kwargs.items()}
+            if report is not None and 'report' in parameters:
+                kwargs.setdefault('report', report)
+            if report_all and 'report_all' in parameters:
+                kwargs.setdefault('report_all', report_all)
+
+            data = func(data, **kwargs)
+            if isinstance(data, tuple):
+                # e.g. remove_unlike also returns the removed FIDs
+                data = data[0]
+
+            if step.save:
+                Path(output).mkdir(parents=True, exist_ok=True)
+                data.save(Path(output) / step.save)
+
+        return data
@@ -6,10 +6,13 @@
 # Copyright (C) 2019 University of Oxford
 # SHBASECOPYRIGHT
 
+from functools import partial
+
 import numpy as np
 import hlsvdpropy
 from fsl_mrs.utils.misc import checkCFUnits, limit_to_range, calculateAxes, FIDToSpec, SpecToFID
 from fsl_mrs.utils.constants import PPM_SHIFT
+from fsl_mrs.utils.preproc.reporting import deferrable_report
 H2O_PPM_TO_TMS = PPM_SHIFT['1H']
 
 
@@ -42,7 +45,7 @@ def zero_spectrum(FID, dwelltime, centralFrequency, limits, limitUnits='ppmshift
 
 
 def model_fid_hlsvd(FID, dwelltime, centralFrequency, limits=None,
-                    limitUnits='ppm', numSingularValues=20):
+                    limitUnits='ppm', numSingularValues=20, hankel_size=None, sparse_algo=False):
     """Model a section of the FID using HLSVD. Optionally retain components
     only within the frequenccy/ppm limits.
 
@@ -52,14 +55,18 @@ def model_fid_hlsvd(FID, dwelltime, centralFrequency, limits=None,
     :type dwelltime: float
     :param centralFrequency: Central frequency in Hz
     :type centralFrequency: float
-    :param limits: Frequency/ppm limits, defaults to None
-    :type limits: tuple, optional
+    :param limits: Frequency/ppm limits, or list of limits, defaults to None (all components)
+    :type limits: tuple or list of tuples, optional
     :param limitUnits: Axis that limits are given in. By Default
         in ppm, relative to receiver frequency (no shift). Can be 'Hz', 'ppm'
         or 'ppm+shift'. Defaults to 'ppm'
     :type limitUnits: str, optional
     :param numSingularValues: Max number of singular values, defaults to 20
     :type numSingularValues: int, optional
+    :param hankel_size: Number of rows of the Hankel matrix, defaults to None (half the FID length)
+    :type hankel_size: int, optional
+    :param sparse_algo: Use the sparse (PROPACK-style) decomposition, defaults to False
+    :type sparse_algo: bool, optional
     """
 
     return _hlsvd(
@@ -68,22 +75,29 @@ def model_fid_hlsvd(FID, dwelltime, centralFrequency, limits=None,
         centralFrequency,
         limits,
         limitUnits=limitUnits,
-        numSingularValues=numSingularValues)
+        numSingularValues=numSingularValues,
+        hankel_size=hankel_size,
+        sparse_algo=sparse_algo)
 
 
 def hlsvd(FID, dwelltime, centralFrequency, limits,
-          limitUnits='ppm', numSingularValues=20, sparse_algo=False):
+          limitUnits='ppm', numSingularValues=20, sparse_algo=False, hankel_size=None):
     """ Run HLSVDPRO on FID
 
     Args:
         FID (ndarray): Time domain data
         dwelltime (float): dwell time in seconds
         centralFrequency (float) : Central frequency in Hz
-        limits (tuple): Limit deletion of singular values in this range.
+        limits (tuple or list of tuples): Limit deletion of singular values in this range.
+            If a list of ranges is given, components in any range are removed
+            using a single decomposition.
         limitUnits (str,optional): Axis that limits are given in. By Default
         in ppm, relative to receiver frequency (no shift). Can be 'Hz', 'ppm'
         or 'ppm+shift'.
         numSingularValues (int, optional): Max number of singular values
+        sparse_algo (bool, optional): Use sparse decomposition
+        hankel_size (int, optional): Number of rows of the Hankel matrix,
+        defaults to half the FID length.
 
     Returns:
         FID (ndarray): Modified FID
@@ -95,73 +109,175 @@ def hlsvd(FID, dwelltime, centralFrequency, limits,
         limits,
         limitUnits=limitUnits,
         numSingularValues=numSingularValues,
-        sparse_algo=sparse_algo)
+        sparse_algo=sparse_algo,
+        hankel_size=hankel_size)
 
     return FID - sumFID
 
 
-def _hlsvd(FID, dwelltime, centralFrequency, limits,
-           limitUnits='ppm', numSingularValues=20, sparse_algo=False):
-    """Run hlsvdpro on FID and return spectrum modeled by HLSVD.
+def hlsvd_stack(FIDs, dwelltime, centralFrequency, limits,
+                limitUnits='ppm', numSingularValues=20, sparse_algo=False, hankel_size=None,
+                model=False, workers=1):
+    """Run HLSVD on a stack of FIDs, either removing or modelling the components within limits.
 
-    :param FID: Time domain data
-    :type FID: numpy.array
+    Decompositions are distributed over a pool of worker processes,
+    components are then selected and synthesised for the whole stack at once.
+
+    :param FIDs: Time domain data, shape (..., time)
+    :type FIDs: numpy.ndarray
     :param dwelltime: dwell time in seconds
     :type dwelltime: float
     :param centralFrequency: Central frequency in Hz
     :type centralFrequency: float
-    :param limits: Frequency/ppm limits, defaults to None
-    :type limits: tuple, optional
-    :param limitUnits: Axis that limits are given in. By Default
-        in ppm, relative to receiver frequency (no shift). Can be 'Hz', 'ppm'
-        or 'ppm+shift'. Defaults to 'ppm'
+    :param limits: Frequency/ppm limits, or list of limits. None selects all components.
+    :type limits: tuple or list of tuples
+    :param limitUnits: Axis that limits are given in, 'Hz', 'ppm' or 'ppm+shift'. Defaults to 'ppm'
     :type limitUnits: str, optional
     :param numSingularValues: Max number of singular values, defaults to 20
     :type numSingularValues: int, optional
+    :param sparse_algo: Use the sparse (PROPACK-style) decomposition, defaults to False
+    :type sparse_algo: bool, optional
+    :param hankel_size: Number of rows of the Hankel matrix, defaults to None (half the FID length)
+    :type hankel_size: int, optional
+    :param model: If True return the HLSVD model of the selected components, otherwise
+        return the FIDs with the components removed. Defaults to False
+    :type model: bool, optional
+    :param workers: Number of worker processes, defaults to 1 (run in this process)
+    :type workers: int, optional
+    :return: Modified (or modelled) FIDs, same shape as FIDs
+    :rtype: numpy.ndarray
+    """
+    FIDs = np.asarray(FIDs)
+    flat = FIDs.reshape(-1, FIDs.shape[-1])
+
+    decompose = partial(_hlsvd_decompose,
+                        dwelltime=dwelltime,
+                        numSingularValues=numSingularValues,
+                        hankel_size=hankel_size,
+                        sparse_algo=sparse_algo)
+    if workers is not None and workers > 1 and flat.shape[0] > 1:
+        import multiprocessing as mp
+        with mp.Pool(workers) as pool:
+            components = pool.map(decompose, flat, chunksize=max(1, flat.shape[0] // (4 * workers)))
+    else:
+        components = [decompose(fid) for fid in flat]
 
-    :return: HLSVD modeled FID
+    # Pad to a common number of components, unused components have zero amplitude
+    ncomp = max([len(c[0]) for c in components] + [1])
+    params = np.zeros((flat.shape[0], 4, ncomp))
+    params[:, 1, :] = -np.inf
+    for idx, comp in enumerate(components):
+        params[idx, :, :len(comp[0])] = comp
+    frequencies, damping_factors, amplitudes, phases = np.moveaxis(params, 1, 0)
+
+    amplitudes = amplitudes * _select_components(frequencies, limits, limitUnits, centralFrequency)
+    sumFIDs = _synthesise(frequencies, damping_factors, amplitudes, phases, flat.shape[-1], dwelltime)
+
+    if model:
+        return sumFIDs.reshape(FIDs.shape)
+    return (flat - sumFIDs).reshape(FIDs.shape)
+
+
+def _hlsvd_decompose(FID, dwelltime, numSingularValues=20, hankel_size=None, sparse_algo=False):
+    """Run hlsvdpro on FID and return the components in standard units.
+
+    :return: Array of frequencies (Hz), damping (s), amplitudes and phases (degrees), shape (4, components)
     """
-    m = FID.size // 2
+    if hankel_size is None:
+        m = FID.size // 2
+    else:
+        m = hankel_size
     r = hlsvdpropy.hlsvdpro(FID, numSingularValues, m=m, sparse=sparse_algo)
     r = hlsvdpropy.convert_hlsvd_result(r, dwelltime)
-    nsv_found, singular_values, frequencies, damping_factors, amplitudes, \
-        phases = r[0:6]
+    return np.asarray(r[2:6], dtype=float).reshape(4, -1)
 
-    # convert to np array
-    frequencies = np.asarray(frequencies)
-    damping_factors = np.asarray(damping_factors)
-    amplitudes = np.asarray(amplitudes)
-    phases = np.asarray(phases)
 
-    # Limit by frequencies
+def _select_components(frequencies, limits, limitUnits, centralFrequency):
+    """Boolean mask of components within any of the frequency limits.
+
+    :param frequencies: Component frequencies in Hz
+    :param limits: Limits, list of limits, or None for all components
+    :param limitUnits: 'ppm', 'ppm+shift' or 'hz'
+    :param centralFrequency: Central frequency in Hz or MHz
+    """
+    if limits is None:
+        return np.ones(frequencies.shape, dtype=bool)
+
+    limits = np.asarray(limits, dtype=float).reshape(-1, 2)
     if limitUnits.lower() == 'ppm':
         centralFrequency = checkCFUnits(centralFrequency, units='MHz')
-        frequencylimit = np.array(limits) * centralFrequency
+        frequencylimit = limits * centralFrequency
     elif limitUnits.lower() == 'ppm+shift':
         centralFrequency = checkCFUnits(centralFrequency, units='MHz')
-        frequencylimit = (np.array(limits) - H2O_PPM_TO_TMS) * centralFrequency
+        frequencylimit = (limits - H2O_PPM_TO_TMS) * centralFrequency
     elif limitUnits.lower() == 'hz':
         frequencylimit = limits
     else:
         raise ValueError('limitUnits should be one of: ppm, ppm+shift or hz.')
-    limitIndicies = (frequencies > frequencylimit[0]) & \
-                    (frequencies < frequencylimit[1])
 
-    sumFID = np.zeros(FID.shape, dtype=np.complex128)
-    timeAxis = np.linspace(0, dwelltime * (FID.size - 1), FID.size)
+    frequencies = np.asarray(frequencies)[..., None]
+    return np.any((frequencies > frequencylimit[:, 0]) & (frequencies < frequencylimit[:, 1]), axis=-1)
+
+
+def _synthesise(frequencies, damping_factors, amplitudes, phases, npoints, dwelltime):
+    """Sum of damped complex exponentials, vectorised over leading dimensions and components.
+
+    :return: FIDs, shape frequencies.shape[:-1] + (npoints,)
+    """
+    timeAxis = np.linspace(0, dwelltime * (npoints - 1), npoints)
+    with np.errstate(divide='ignore'):
+        coeff = np.asarray(amplitudes) * np.exp(1j * 2 * np.pi * np.asarray(phases) / 360.0)
+        rate = 1 / np.asarray(damping_factors) + 1j * 2 * np.pi * np.asarray(frequencies)
+    coeff = coeff.reshape(-1, coeff.shape[-1])
+    # Unused components are excluded (and cannot overflow)
+    rate = np.where(coeff != 0, rate.reshape(-1, rate.shape[-1]), 0)
+
+    # Synthesise in chunks of FIDs to limit memory use
+    chunk = max(1, 2**22 // (npoints * coeff.shape[-1]))
+    out = np.empty((coeff.shape[0], npoints), dtype=np.complex128)
+    for start in range(0, coeff.shape[0], chunk):
+        sl = slice(start, start + chunk)
+        out[sl] = np.einsum('ntk,nk->nt', np.exp(timeAxis[None, :, None] * rate[sl, None, :]), coeff[sl])
+    return out.reshape(np.shape(frequencies)[:-1] + (npoints,))
+
+
+def _hlsvd(FID, dwelltime, centralFrequency, limits,
+           limitUnits='ppm', numSingularValues=20, sparse_algo=False, hankel_size=None):
+    """Run hlsvdpro on FID and return spectrum modeled by HLSVD.
+
+    :param FID: Time domain data
+    :type FID: numpy.array
+    :param dwelltime: dwell time in seconds
+    :type dwelltime: float
+    :param centralFrequency: Central frequency in Hz
+    :type centralFrequency: float
+    :param limits: Frequency/ppm limits, or list of limits, None selects all components.
+    :type limits: tuple or list of tuples
+    :param limitUnits: Axis that limits are given in. By Default
+        in ppm, relative to receiver frequency (no shift). Can be 'Hz', 'ppm'
+        or 'ppm+shift'. Defaults to 'ppm'
+    :type limitUnits: str, optional
+    :param numSingularValues: Max number of singular values, defaults to 20
+    :type numSingularValues: int, optional
+    :param hankel_size: Number of rows of the Hankel matrix, defaults to None (half the FID length)
+    :type hankel_size: int, optional
+
+    :return: HLSVD modeled FID
+    """
+    frequencies, damping_factors, amplitudes, phases = _hlsvd_decompose(
+        FID,
+        dwelltime,
+        numSingularValues=numSingularValues,
+        hankel_size=hankel_size,
+        sparse_algo=sparse_algo)
+
+    # Limit by frequencies
+    amplitudes = amplitudes * _select_components(frequencies, limits, limitUnits, centralFrequency)
 
-    for use, f, d, a, p in zip(limitIndicies,
-                               frequencies,
-                               damping_factors,
-                               amplitudes,
-                               phases):
-        if use:
-            sumFID += a * np.exp((timeAxis / d)
-                                 + 1j * 2 * np.pi
-                                 * (f * timeAxis + p / 360.0))
-    return sumFID
+    return _synthesise(frequencies, damping_factors, amplitudes, phases, FID.size, dwelltime)
 
 
+@deferrable_report()
 def hlsvd_report(inFID,
                  outFID,
                  limits,
@@ -5,12 +5,20 @@
 # Copyright (C) 2019 University of Oxford
 # SHBASECOPYRIGHT
 
-from jinja2 import FileSystemLoader, Environment
 import os.path as op
-from dataclasses import dataclass
+import functools
+import inspect
+import pickle
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from datetime import datetime
+from importlib import import_module
+from pathlib import Path
 templatePath = op.join(op.dirname(__file__), 'templates')
 
+# Active report capture, if report rendering is being deferred
+_active_capture = None
+
 
 @dataclass
 class figgroup:
@@ -72,8 +80,9 @@ def singleReport(outfile, opName, headerinfo, figurelist):
     Render a template and write it to file.
     :return:
     """
-    # Configure Jinja and ready the loader
+    from jinja2 import FileSystemLoader, Environment
 
+    # Configure Jinja and ready the loader
     env = Environment(
         loader=FileSystemLoader(searchpath=templatePath)
     )
@@ -111,3 +120,304 @@ def singleReport(outfile, opName, headerinfo, figurelist):
         f.write(base_template.render(
                 title=title,
                 sections=sections))
+
+
+def _plotly_script_key(tag):
+    """Identify script tags which load or configure the plotly library.
+
+    :return: Key identifying the library (URL, or version of inline bundle), None for other scripts
+    :rtype: str or None
+    """
+    src = tag.get('src')
+    if src:
+        return src if src.rsplit('/', 1)[-1].startswith('plotly') else None
+    text = (tag.string or '').lstrip()
+    if text.startswith('/**') and 'plotly.js' in text[:64]:
+        # Inline bundle, identified by its version comment
+        return ' '.join(text.split('\n', 2)[:2])
+    if text.startswith('window.PlotlyConfig') and len(text) < 256:
+        return text.strip()
+    return None
+
+
+def _remove_repeated_plotly(soup, seen):
+    """Remove plotly library script tags already in the set seen, adding new libraries to seen."""
+    for tag in soup.find_all('script'):
+        key = _plotly_script_key(tag)
+        if key is None:
+            continue
+        if key in seen:
+            tag.decompose()
+        else:
+            seen.add(key)
+
+
+def merge_reports(files, description, output='.', filename='mergedReports.html', delete=False):
+    """Merge multiple html reports (in order of filename) into a single report.
+
+    Reports are read and written one at a time, so the merged report is never held in memory.
+    Plotly library scripts (CDN links or inline bundles) are only included on first use.
+
+    :param files: List of html report files
+    :type files: list
+    :param description: Dataset description
+    :type description: str
+    :param output: Output folder, defaults to '.'
+    :type output: str, optional
+    :param filename: Output file name, defaults to 'mergedReports.html'
+    :type filename: str, optional
+    :param delete: Delete files after successful merge, defaults to False
+    :type delete: bool, optional
+    :return: Path to merged report
+    :rtype: str
+    """
+    from bs4 import BeautifulSoup, Comment
+    from os import remove, replace
+
+    if len(files) == 0:
+        raise ValueError('No reports to merge.')
+    # Sort files by filename
+    files = sorted(files)
+
+    outfile = op.join(output, filename)
+    # Write to a temporary file, moved into place once all reports are merged
+    tmpfile = outfile + '.part'
+    seen_plotly = set()
+    marker = 'fsl_mrs_merge_insert'
+    with open(tmpfile, 'w') as fout:
+        for idx, f in enumerate(files):
+            with open(f) as fp:
+                soup = BeautifulSoup(fp, features="html.parser")
+            _remove_repeated_plotly(soup, seen_plotly)
+            main = soup.body.main or soup.body
+
+            if idx == 0:
+                # The first report provides the page head and header.
+                # Its content is written up to the end of the main element,
+                # following reports are written in place of the marker.
+                soup.body.header.h1.string = f"Combined report for {description}"
+                soup.body.header.p.string = "Combined using merge_mrs_reports." \
+                                            " Part of the FSL-MRS package."
+                main.append(Comment(marker))
+                first, closing = str(soup).split(f'<!--{marker}-->')
+                fout.write(first)
+            else:
+                for element in main.contents:
+                    if element is not main.header:
+                        fout.write(str(element))
+            soup.decompose()
+        fout.write(closing)
+    replace(tmpfile, outfile)
+
+    if op.exists(outfile) and op.getsize(outfile) > 0:
+        if delete:
+            for htmlfile in files:
+                remove(htmlfile)
+    else:
+        raise IOError('Merged file not written successfully.')
+    return outfile
+
+
+def merge_report_directory(directory, description, filename='mergedReports.html', delete=True):
+    """Merge all html reports in a directory, see merge_reports."""
+    files = [str(f) for f in Path(directory).glob('*.html') if f.name != filename]
+    return merge_reports(files, description, output=directory, filename=filename, delete=delete)
+
+
+# Deferred report rendering
+@dataclass
+class ReportRecord:
+    '''Lightweight record of a report function call, to be rendered later.'''
+    module: str
+    function: str
+    args: tuple = ()
+    kwargs: dict = field(default_factory=dict)
+    final: bool = False
+
+    def render(self):
+        func = getattr(import_module(self.module), self.function)
+        # Call the undecorated report function
+        func = getattr(func, '__wrapped__', func)
+        return func(*self.args, **self.kwargs)
+
+
+def _render_record(record):
+    record.render()
+
+
+class ReportCapture:
+    """Captures report function calls as ReportRecords while processing runs.
+
+    Records are either rendered in a pool of background processes,
+    or (if record_dir is set) saved to disk to be rendered by render_report_records.
+    """
+
+    def __init__(self, workers=1, record_dir=None):
+        """
+        :param workers: Number of background rendering processes, defaults to 1
+        :type workers: int, optional
+        :param record_dir: Directory to save records in, rather than rendering, defaults to None
+        :type record_dir: str or pathlib.Path, optional
+        """
+        self.workers = max(int(workers), 1)
+        self.record_dir = None if record_dir is None else Path(record_dir)
+        self._count = 0
+        self._pool = None
+        self._results = []
+        self._final = []
+        self._stamp = datetime.now().strftime("%Y%m%d_%H%M%S%f")[:-3]
+
+    def report_path(self, html):
+        """Resolve a report directory to a unique report file name, ordered by capture."""
+        if op.isdir(html):
+            filename = 'report_' + datetime.now().strftime("%Y%m%d_%H%M%S%f")[:-3] + f'_{self._count:04d}.html'
+            return op.join(html, filename)
+        return html
+
+    def submit(self, func, *args, final=False, **kwargs):
+        """Capture a call of func(*args, **kwargs).
+
+        :param func: Report function
+        :param final: If True run after all other records have been rendered (e.g. merging), defaults to False
+        :type final: bool, optional
+        """
+        record = ReportRecord(func.__module__, func.__name__, args, kwargs, final)
+        self._count += 1
+        if self.record_dir is not None:
+            self.record_dir.mkdir(parents=True, exist_ok=True)
+            with open(self.record_dir / f'report_record_{self._stamp}_{self._count:04d}.pkl', 'wb') as fp:
+                pickle.dump(record, fp)
+        elif final:
+            self._final.append(record)
+        else:
+            if self._pool is None:
+                import multiprocessing as mp
+                self._pool = mp.Pool(self.workers)
+            self._results.append(self._pool.apply_async(_render_record, (record,)))
+
+    def close(self):
+        """Wait for background rendering to complete, then run any final records."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            for result in self._results:
+                # Raise any errors from rendering
+                result.get()
+            self._pool = None
+        for record in self._final:
+            record.render()
+        self._final = []
+
+    def terminate(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+
+def begin_deferred_reports(workers=1, record_dir=None):
+    """Start capturing reports, see deferred_reports.
+
+    :return: Active capture, call ReportCapture.close and end_deferred_reports when finished
+    :rtype: ReportCapture
+    """
+    global _active_capture
+    _active_capture = ReportCapture(workers=workers, record_dir=record_dir)
+    return _active_capture
+
+
+def end_deferred_reports(wait=True):
+    """Stop capturing reports, by default waiting for background rendering to complete."""
+    global _active_capture
+    capture, _active_capture = _active_capture, None
+    if capture is not None:
+        if wait:
+            capture.close()
+        else:
+            capture.terminate()
+
+
+@contextmanager
+def deferred_reports(workers=1, record_dir=None):
+    """Context in which report generation (of functions decorated with deferrable_report)
+    is taken off the critical path. Report content is captured and either rendered
+    in background processes or, if record_dir is given, saved for rendering later.
+    On exit waits for rendering to complete.
+
+    Note that deferred report functions return None rather than a figure.
+
+    :param workers: Number of background rendering processes, defaults to 1
+    :type workers: int, optional
+    :param record_dir: Save records in this directory for rendering by render_report_records, defaults to None
+    :type record_dir: str or pathlib.Path, optional
+    """
+    capture = begin_deferred_reports(workers=workers, record_dir=record_dir)
+    try:
+        yield capture
+    except BaseException:
+        end_deferred_reports(wait=False)
+        raise
+    else:
+        end_deferred_reports()
+
+
+def deferrable_report(output_arg='html'):
+    """Decorator for report generating functions which allows rendering to be deferred.
+
+    :param output_arg: Name of the argument giving the report output location, defaults to 'html'
+    :type output_arg: str, optional
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            capture = _active_capture
+            if capture is None:
+                return func(*args, **kwargs)
+
+            bound = inspect.signature(func).bind(*args, **kwargs)
+            output = bound.arguments.get(output_arg)
+            if output is None:
+                # No report output, return figure as normal
+                return func(*args, **kwargs)
+
+            bound.arguments[output_arg] = capture.report_path(str(output))
+            capture.submit(func, *bound.args, **bound.kwargs)
+            return None
+        return wrapper
+    return decorator
+
+
+def render_report_records(record_dir, workers=1, delete=True):
+    """Render report records saved by a deferred_reports capture.
+
+    :param record_dir: Directory containing records
+    :type record_dir: str or pathlib.Path
+    :param workers: Number of rendering processes, defaults to 1
+    :type workers: int, optional
+    :param delete: Delete record files after rendering, defaults to True
+    :type delete: bool, optional
+    :return: Number of records rendered
+    :rtype: int
+    """
+    files = sorted(Path(record_dir).glob('report_record_*.pkl'))
+    records = []
+    for file in files:
+        with open(file, 'rb') as fp:
+            records.append(pickle.load(fp))
+
+    reports = [rec for rec in records if not rec.final]
+    if workers > 1 and len(reports) > 1:
+        import multiprocessing as mp
+        with mp.Pool(workers) as pool:
+            pool.map(_render_record, reports)
+    else:
+        for rec in reports:
+            rec.render()
+
+    for rec in records:
+        if rec.final:
+            rec.render()
+
+    if delete:
+        for file in files:
+            file.unlink()
+    return len(records)
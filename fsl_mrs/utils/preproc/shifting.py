@@ -8,14 +8,15 @@
 
 import numpy as np
 from fsl_mrs.core import MRS
-from fsl_mrs.utils.misc import extract_spectrum
+from fsl_mrs.utils.misc import FIDToSpec
+from fsl_mrs.utils.preproc.reporting import deferrable_report
 
 
 def timeshift(FID, dwelltime, shiftstart, shiftend, samples=None):
     """ Shift data on time axis
 
     Args:
-        FID (ndarray): Time domain data
+        FID (ndarray): Time domain data, time on the last axis
         dwelltime (float): dwell time in seconds
         shiftstart (float): Shift start point in seconds
         shiftend (float): Shift end point in seconds
@@ -24,15 +25,25 @@ def timeshift(FID, dwelltime, shiftstart, shiftend, samples=None):
     Returns:
         FID (ndarray): Shifted FID
     """
-    originalAcqTime = dwelltime * (FID.size - 1)
-    originalTAxis = np.linspace(0, originalAcqTime, FID.size)
+    npoints = FID.shape[-1]
+    originalAcqTime = dwelltime * (npoints - 1)
+    originalTAxis = np.linspace(0, originalAcqTime, npoints)
     if samples is None:
         newDT = dwelltime
     else:
         totalacqTime = originalAcqTime - shiftstart + shiftend
         newDT = totalacqTime / samples
     newTAxis = np.arange(originalTAxis[0] + shiftstart, originalTAxis[-1] + shiftend, newDT)
-    FID = np.interp(newTAxis, originalTAxis, FID, left=0.0 + 1j * 0.0, right=0.0 + 1j * 0.0)
+
+    # Linear interpolation (as np.interp) applied along the last axis of all FIDs at once
+    position = np.interp(newTAxis, originalTAxis, np.arange(npoints), left=np.nan, right=np.nan)
+    outside = np.isnan(position)
+    position[outside] = 0
+    lower = np.minimum(np.floor(position).astype(int), max(npoints - 2, 0))
+    upper = np.minimum(lower + 1, npoints - 1)
+    frac = position - lower
+    FID = FID[..., lower] * (1 - frac) + FID[..., upper] * frac
+    FID[..., outside] = 0
 
     return FID, newDT
 
@@ -41,15 +52,16 @@ def freqshift(FID, dwelltime, shift):
     """ Shift data on frequency axis
 
     Args:
-        FID (ndarray): Time domain data
+        FID (ndarray): Time domain data, time on the last axis
         dwelltime (float): dwelltime in seconds
-        shift (float): shift in Hz
+        shift (float or ndarray): shift in Hz, arrays broadcast against FID.shape[:-1]
 
     Returns:
         FID (ndarray): Shifted FID
     """
-    tAxis = np.linspace(0, dwelltime * FID.size, FID.size)
-    phaseRamp = 2 * np.pi * tAxis * shift
+    npoints = FID.shape[-1]
+    tAxis = np.linspace(0, dwelltime * npoints, npoints)
+    phaseRamp = 2 * np.pi * tAxis * np.asarray(shift)[..., None]
     FID = FID * np.exp(1j * phaseRamp)
     return FID
 
@@ -57,7 +69,7 @@ def freqshift(FID, dwelltime, shift):
 def shiftToRef(FID, target, bw, cf, nucleus='1H', ppmlim=(2.8, 3.2), shift=True):
     '''Find a maximum and shift that maximum to a reference position.
 
-    :param FID: FID
+    :param FID: FID, or array of FIDs with time on the last axis
     :param float target: reference position in ppm
     :param float bw: Bandwidth or spectral width in Hz.
     :param float cf: Central or spectrometer frequency (MHz)
@@ -70,19 +82,21 @@ def shiftToRef(FID, target, bw, cf, nucleus='1H', ppmlim=(2.8, 3.2), shift=True)
     '''
 
     # Find maximum of absolute spectrum in ppm limit
-    padFID = pad(FID, FID.size * 3)
-    MRSargs = {'FID': padFID,
+    npoints = FID.shape[-1]
+    padFID = pad(FID, npoints * 3)
+    MRSargs = {'FID': np.zeros(npoints * 4, dtype=complex),
                'bw': bw,
                'cf': cf,
                'nucleus': nucleus}
     mrs = MRS(**MRSargs)
-    spec = extract_spectrum(mrs, padFID, ppmlim=ppmlim, shift=shift)
+    first, last = mrs.ppmlim_to_range(ppmlim=ppmlim, shift=shift)
+    spec = FIDToSpec(padFID, axis=-1)[..., first:last]
     if shift:
         extractedAxis = mrs.getAxes(ppmlim=ppmlim)
     else:
         extractedAxis = mrs.getAxes(ppmlim=ppmlim, axis='ppm')
 
-    maxIndex = np.argmax(np.abs(spec))
+    maxIndex = np.argmax(np.abs(spec), axis=-1)
     shiftAmount = extractedAxis[maxIndex] - target
     shiftAmountHz = shiftAmount * mrs.centralFrequency / 1E6
 
@@ -106,9 +120,9 @@ def truncate(FID, k, first_or_last='last'):
     FID_trunc = FID.copy()
 
     if first_or_last == 'first':
-        return FID_trunc[k:]
+        return FID_trunc[..., k:]
     elif first_or_last == 'last':
-        return FID_trunc[:-k]
+        return FID_trunc[..., :-k]
     else:
         raise ValueError("Last parameter must either be 'first' or 'last'")
 
@@ -128,15 +142,17 @@ def pad(FID, k, first_or_last='last'):
     array-like
     """
     FID_pad = FID.copy()
+    lead = [(0, 0)] * (FID_pad.ndim - 1)
 
     if first_or_last == 'first':
-        return np.pad(FID_pad, (k, 0))
+        return np.pad(FID_pad, lead + [(k, 0)])
     elif first_or_last == 'last':
-        return np.pad(FID_pad, (0, k))
+        return np.pad(FID_pad, lead + [(0, k)])
     else:
         raise ValueError("Last parameter must either be 'first' or 'last'")
 
 
+@deferrable_report()
 def shift_report(inFID,
                  outFID,
                  inHdr,
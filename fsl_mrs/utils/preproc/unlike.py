@@ -8,7 +8,8 @@
 from fsl_mrs.core import MRS
 import numpy as np
 from fsl_mrs.utils.preproc.general import get_target_FID
-from fsl_mrs.utils.misc import extract_spectrum, FIDToSpec
+from fsl_mrs.utils.misc import FIDToSpec
+from fsl_mrs.utils.preproc.reporting import deferrable_report
 
 
 def identifyUnlikeFIDs(FIDList,
@@ -22,7 +23,7 @@ def identifyUnlikeFIDs(FIDList,
     """ Identify FIDs in a list that are unlike the others
 
     Args:
-        FIDList (list of ndarray): Time domain data
+        FIDList (list of ndarray or ndarray): Time domain data, or array of FIDs (transients x points)
         bandwidth (float)        : Bandwidth in Hz
         centralFrequency (float) : Central frequency in Hz
         sdlimit (float,optional) : Exclusion limit (number of standard deviations). Default = 3.
@@ -36,50 +37,36 @@ def identifyUnlikeFIDs(FIDList,
         rmIndicies (list of int): Indicies of those FIDs that have been removed
         metric (list of floats): Likeness metric of each FID
     """
+    FIDs = np.asarray(FIDList)
 
-    # Calculate the FID to compare to
-    target = get_target_FID(FIDList, target='median')
-
+    # Spectra of all FIDs in a single transform
     if ppmlim is not None:
-        MRSargs = {'FID': target,
-                   'bw': bandwidth,
-                   'cf': centralFrequency,
-                   'nucleus': nucleus}
-        mrs = MRS(**MRSargs)
-
-        target = extract_spectrum(mrs, target, ppmlim=ppmlim, shift=shift)
-        compareList = [extract_spectrum(mrs, f, ppmlim=ppmlim, shift=shift) for f in FIDList]
+        mrs = MRS(FID=FIDs[0], bw=bandwidth, cf=centralFrequency, nucleus=nucleus)
+        first, last = mrs.ppmlim_to_range(ppmlim=ppmlim, shift=shift)
     else:
-        compareList = [FIDToSpec(f) for f in FIDList]
-        target = FIDToSpec(target)
+        first, last = 0, FIDs.shape[1]
+    compare = FIDToSpec(FIDs, axis=1)[:, first:last]
 
-    # Do the comparison
+    # Do the comparison, to the median of the FIDs kept so far
+    keep = np.ones(FIDs.shape[0], dtype=bool)
     for idx in range(iterations):
-        metric = []
-        for data in compareList:
-            metric.append(np.linalg.norm(data - target))
-        metric = np.asarray(metric)
+        target = FIDToSpec(get_target_FID(FIDs[keep], target='median'))[first:last]
+        metric = np.linalg.norm(compare - target, axis=1)
         metric_avg = np.mean(metric)
         metric_std = np.std(metric)
 
-        goodFIDs, badFIDs, rmIndicies, keepIndicies = [], [], [], []
-        for iDx, (data, m) in enumerate(zip(FIDList, metric)):
-            if m > ((sdlimit * metric_std) + metric_avg) or m < (-(sdlimit * metric_std) + metric_avg):
-                badFIDs.append(data)
-                rmIndicies.append(iDx)
-            else:
-                goodFIDs.append(data)
-                keepIndicies.append(iDx)
-
-        target = get_target_FID(goodFIDs, target='median')
-        if ppmlim is not None:
-            target = extract_spectrum(mrs, target, ppmlim=ppmlim, shift=shift)
-        else:
-            target = FIDToSpec(target)
+        keep = ~((metric > ((sdlimit * metric_std) + metric_avg))
+                 | (metric < (-(sdlimit * metric_std) + metric_avg)))
+
+    keepIndicies = np.flatnonzero(keep).tolist()
+    rmIndicies = np.flatnonzero(~keep).tolist()
+    goodFIDs = list(FIDs[keep])
+    badFIDs = list(FIDs[~keep])
 
     return goodFIDs, badFIDs, keepIndicies, rmIndicies, metric.tolist()
 
 
+@deferrable_report()
 def identifyUnlikeFIDs_report(goodFIDs,
                               badFIDs,
                               keepIndicies,
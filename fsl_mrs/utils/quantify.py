@@ -12,7 +12,7 @@ import matplotlib.pyplot as plt
 from scipy.optimize import minimize
 import pandas as pd
 
-from fsl_mrs.utils.misc import FIDToSpec, checkCFUnits
+from fsl_mrs.utils.misc import FIDToSpec, SpecToFID, checkCFUnits
 from fsl_mrs.utils.constants import H2O_MOLALITY, TISSUE_WATER_DENSITY, \
     STANDARD_T1, STANDARD_T2, GYRO_MAG_RATIO, \
     H2O_PROTONS, WATER_SCALING_METAB, \
@@ -57,25 +57,40 @@ class FIDIntegrator:
             return np.trapz(np.abs(np.real(spec)), axis=0)
 
 
+def _water_fid(t, amp, gamma, sigma, omega, phi):
+    """Single voigt lineshape used to model the water reference"""
+    return amp\
+        * np.exp(-t * (gamma + t * sigma + 1j * omega))\
+        * np.exp(1j * phi)
+
+
 class WaterRef(FIDIntegrator):
-    def __init__(self, mrs_obj, limits=None):
+    def __init__(self, mrs_obj, limits=None, fit_params=None):
+        """Fit and integrate the water reference of an MRS object.
+
+        :param mrs_obj: MRS object with water reference
+        :type mrs_obj: fsl_mrs.core.mrs.MRS
+        :param limits: Integration limits (ppm), defaults to None
+        :type limits: tuple, optional
+        :param fit_params: Previously fitted (amp, gamma, sigma, omega, phi), e.g. from fit_water_refs.
+            Defaults to None, in which case the reference is fitted.
+        :type fit_params: array-like, optional
+        """
         super().__init__(mrs_obj, limits)
 
         self.original_fid = mrs_obj.H2O
 
-        self._fit_w_ref()
+        if fit_params is None:
+            self._fit_w_ref()
+        else:
+            self.fid = _water_fid(self.t_axis, *fit_params[:3], 0, 0)
 
     def _fit_w_ref(self):
         '''Fit unsuppressed water with single voigt lineshape.
         Fitted fid is then phase and frequency corrected.'''
-        def fid_func(t, amp, gamma, sigma, omega, phi):
-            return amp\
-                * np.exp(-t * (gamma + t * sigma + 1j * omega))\
-                * np.exp(1j * phi)
-
         def fit_func(p):
             amp, gamma, sigma, omega, phi = p
-            fid = fid_func(self.t_axis, amp, gamma, sigma, omega, phi)
+            fid = _water_fid(self.t_axis, amp, gamma, sigma, omega, phi)
             return np.mean(np.abs(fid - self.original_fid)**2)
 
         p0 = [np.mean(np.abs(self.original_fid[:5])), 10, 10, 0, 0]
@@ -85,7 +100,7 @@ class WaterRef(FIDIntegrator):
                   (None, None),
                   (None, None))
         pout = minimize(fit_func, p0, bounds=bounds)
-        self.fid = fid_func(self.t_axis, *pout.x[:3], 0, 0)
+        self.fid = _water_fid(self.t_axis, *pout.x[:3], 0, 0)
 
     def plot_fit(self):
         fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(10, 6))
@@ -108,6 +123,16 @@ class RefIntegral(FIDIntegrator):
             mrs_obj, mode=metab, noBaseline=True, no_phase=True)
 
 
+class BatchRefIntegral(FIDIntegrator):
+    """Integral of a (previously calculated) fitted reference metabolite FID.
+    Used in place of RefIntegral by quantifyWaterBatch, the prediction including baseline and phase
+    (original_fid) is not calculated."""
+    def __init__(self, mrs_obj, fid, limits):
+        super().__init__(mrs_obj, limits)
+        self.original_fid = None
+        self.fid = fid
+
+
 class QuantificationInfo(object):
     """ Class encapsulating the information required to run internal water quantification scaling.
         Requires (arguments to init):
@@ -705,6 +730,229 @@ def quantifyWater(mrs, results, quant_info, verbose=False):
     return conc_molal, conc_molar, {'metab_ref': mref, 'water_ref': wref}
 
 
+def fit_water_refs(t_axis, fids, max_iter=200, tol=1E-10):
+    """Fit a single voigt lineshape to each of a set of water reference FIDs.
+
+    All FIDs are fitted together by a vectorised (bounded) Levenberg-Marquardt least-squares fit,
+    minimising the same cost as the single voxel WaterRef fit from the same initialisation.
+    The Jacobian of every parameter is a power of t times the model FID, so the normal equations
+    are formed from time-moments of the model without storing the Jacobian.
+
+    :param t_axis: Time axis (s)
+    :type t_axis: numpy.ndarray
+    :param fids: Water reference FIDs, shape (N, points)
+    :type fids: numpy.ndarray
+    :param max_iter: Maximum number of iterations, defaults to 200
+    :type max_iter: int, optional
+    :param tol: Relative change in cost at which a fit is considered converged, defaults to 1E-10
+    :type tol: float, optional
+    :return: Fitted parameters (amp, gamma, sigma, omega, phi), shape (N, 5)
+    :rtype: numpy.ndarray
+    """
+    fids = np.atleast_2d(fids)
+    t = np.asarray(t_axis).ravel()
+    n_fids = fids.shape[0]
+
+    # Powers of t multiplying each derivative: d/damp = e, d/dgamma = -t f, d/dsigma = -t^2 f,
+    # d/domega = -1j t f, d/dphi = 1j f (f = amp * e)
+    t_pow = np.array([0, 1, 2, 1, 0])
+    t_moments = np.stack([t**n for n in range(5)])
+
+    def model(p):
+        return np.exp(-t * (p[:, 1:2] + t * p[:, 2:3] + 1j * p[:, 3:4]) + 1j * p[:, 4:5])
+
+    def cost(p, e):
+        return np.mean(np.abs(p[:, 0:1] * e - fids[idx])**2, axis=1)
+
+    params = np.zeros((n_fids, 5))
+    params[:, 0] = np.mean(np.abs(fids[:, :5]), axis=1)
+    params[:, 1:3] = 10
+
+    idx = np.arange(n_fids)
+    e = model(params)
+    current = cost(params, e)
+    lam = np.full(n_fids, 1E-3)
+    for _ in range(max_iter):
+        if idx.size == 0:
+            break
+        p = params[idx]
+        amp = p[:, 0]
+        coef = np.stack([np.ones_like(amp), -amp, -amp, -1j * amp, 1j * amp], axis=1)
+
+        abs_e2 = np.abs(e)**2
+        moments = abs_e2 @ t_moments.T
+        resid_proj = (np.conj(e) * (amp[:, None] * e - fids[idx])) @ t_moments[:3].T
+
+        # Normal equations (real parameters, complex residual)
+        jtj = np.real(np.conj(coef)[:, :, None] * coef[:, None, :]) * moments[:, t_pow[:, None] + t_pow[None, :]]
+        grad = np.real(np.conj(coef) * resid_proj[:, t_pow])
+
+        # Parameters held at their (zero) lower bound by the gradient are fixed for this step
+        fixed = np.zeros(p.shape, dtype=bool)
+        fixed[:, :3] = (p[:, :3] <= 0) & (grad[:, :3] > 0)
+        free = ~fixed
+        jtj = jtj * (free[:, :, None] & free[:, None, :]) + fixed[:, :, None] * np.eye(5)
+        grad = grad * free
+
+        diag = np.diagonal(jtj, axis1=1, axis2=2)
+        diag = np.maximum(diag, 1E-12 * np.max(diag, axis=1, keepdims=True))
+        damped = jtj + (lam[idx, None] * diag)[:, :, None] * np.eye(5)
+        step = -np.linalg.solve(damped, grad[:, :, None])[:, :, 0]
+
+        trial = p + step
+        trial[:, :3] = np.maximum(trial[:, :3], 0)
+        trial_e = model(trial)
+        trial_cost = cost(trial, trial_e)
+
+        accept = trial_cost < current[idx]
+        rel_change = (current[idx] - trial_cost) / np.maximum(current[idx], np.finfo(float).tiny)
+        params[idx[accept]] = trial[accept]
+        current[idx[accept]] = trial_cost[accept]
+        e[accept] = trial_e[accept]
+        lam[idx[accept]] /= 10
+        lam[idx[~accept]] *= 10
+
+        done = (accept & (rel_change < tol)) | (lam[idx] > 1E12)
+        idx = idx[~done]
+        e = e[~done]
+    return params
+
+
+def _ref_metab_spectra(mrs_list, results_list, metab):
+    """Predicted spectra of reference metabolite(s) without baseline and phase, for each MRS/result pair.
+
+    Equivalent to FitRes.predictedFID(mrs, mode=metab, noBaseline=True, no_phase=True),
+    but each forward model is evaluated using only the reference basis spectra,
+    and the formatted basis is reused across MRS objects.
+    """
+    from fsl_mrs import models
+    metab = metab if isinstance(metab, list) else [metab]
+    basis_cache = {}
+    spectra = []
+    for mrs, res in zip(mrs_list, results_list):
+        n_basis = len(mrs.names)
+        n_groups = max(res.metab_groups) + 1
+        sel = [list(res.metabs[:n_basis]).index(m) for m in metab]
+
+        key = mrs.conj_Basis
+        if key not in basis_cache:
+            basis_cache[key] = mrs.basis
+
+        # Parameters with one entry per basis spectrum (i.e. those which change in size with
+        # the number of basis spectra) are subset to the reference metabolite(s).
+        # Phase and baseline are set to zero.
+        _, sizes_0 = models.FSLModel_vars(res.model, n_basis, n_groups, 0)
+        n_baseline = (len(res.params) - sum(sizes_0)) // 2
+        names, sizes = models.FSLModel_vars(res.model, n_basis, n_groups, n_baseline)
+        _, sizes_p1 = models.FSLModel_vars(res.model, n_basis + 1, n_groups, n_baseline)
+        reduced = []
+        for name, values, size, size_p1 in zip(names,
+                                               np.split(np.asarray(res.params), np.cumsum(sizes)[:-1]),
+                                               sizes,
+                                               sizes_p1):
+            if size != size_p1:
+                values = values[sel]
+            elif name in ('Phi_0', 'Phi_1', 'baseline'):
+                values = np.zeros_like(values)
+            reduced.append(values)
+
+        forward = models.getModelForward(res.model)
+        spectra.append(
+            forward(np.concatenate(reduced),
+                    mrs.frequencyAxis,
+                    mrs.timeAxis,
+                    basis_cache[key][:, sel],
+                    np.zeros(res.base_poly.shape),
+                    [res.metab_groups[i] for i in sel],
+                    n_groups).ravel())
+    return np.stack(spectra, axis=1)
+
+
+def quantifyWaterBatch(mrs_list, results_list, quant_info_list, verbose=False):
+    """Vectorised equivalent of quantifyWater for many MRS objects (e.g. the voxels of MRSI data).
+
+    The water references are fitted simultaneously (fit_water_refs), reference metabolite integrals are
+    calculated from a single array of predictions, and relaxation terms are calculated once
+    and weighted by each voxel's tissue fractions.
+    All QuantificationInfo objects must share the same sequence, relaxation and reference metabolite settings,
+    they may differ in tissue fractions and additional correction.
+
+    :param mrs_list: MRS objects with unsuppressed water reference data.
+    :type mrs_list: list of fsl_mrs.core.mrs.MRS
+    :param results_list: FSL-MRS results objects, one per MRS object.
+    :type results_list: list of fsl_mrs.utils.results.FitRes
+    :param quant_info_list: QuantificationInfo objects, one per MRS object.
+    :type quant_info_list: list of fsl_mrs.utils.quantify.QuantificationInfo
+    :param verbose: Enable verbose output, defaults to False
+    :type verbose: bool, optional
+    :return: conc_molal, scaling parameters to convert raw fitted concentrations to molality units of mols/kg
+    :rtype: numpy.ndarray
+    :return: conc_molar, scaling parameters to convert raw fitted concentrations to molarity units of mols/dm^3
+    :rtype: numpy.ndarray
+    :return: List of dicts containing water and reference integration classes.
+    :rtype: list
+    """
+    q_ref = quant_info_list[0]
+    mrs_ref = mrs_list[0]
+
+    # Water reference areas
+    t_axis = mrs_ref.getAxes('time')
+    h2o = np.stack([mrs.H2O for mrs in mrs_list])
+    w_params = fit_water_refs(t_axis, h2o)
+    w_fids = _water_fid(t_axis[:, None], *w_params[:, :3].T, 0, 0)
+    w_int = FIDIntegrator(mrs_ref, q_ref.h2o_limits)
+    SH2OObs = w_int._calculate_area(w_fids)
+
+    # Reference metabolite areas
+    m_spec = _ref_metab_spectra(mrs_list, results_list, q_ref.ref_metab)
+    m_fids = SpecToFID(m_spec, axis=0)
+    m_int = FIDIntegrator(mrs_ref, q_ref.ref_limits)
+    SMObs = m_int._calculate_area(m_fids)
+
+    # Relaxation terms common to all voxels
+    r_gm, r_wm, r_csf = q_ref.R_H2O_GM, q_ref.R_H2O_WM, q_ref.R_H2O_CSF
+    r_h2o = q_ref.R_H2O
+    metab_corr = q_ref.relax_corr_metab
+    proton_corr = H2O_PROTONS / q_ref.ref_protons
+
+    with_frac = np.array([q._fractions is not None for q in quant_info_list])
+    frac = np.array([[q.f_GM, q.f_WM, q.f_CSF] if q._fractions is not None else [np.nan] * 3
+                     for q in quant_info_list], dtype=float)
+    dens = np.array([[q.d_GM, q.d_WM, q.d_CSF] for q in quant_info_list], dtype=float)
+    add_corr = np.array([q.add_corr for q in quant_info_list], dtype=float)
+
+    relax = np.array([r_gm, r_wm, r_csf])
+    vol_dens = frac * dens
+    mole_frac = vol_dens / np.sum(vol_dens, axis=1, keepdims=True)
+    water_molal = np.where(with_frac, H2O_MOLALITY * np.sum(mole_frac * relax, axis=1), r_h2o * H2O_MOLALITY)
+    water_molar = np.where(with_frac, H2O_MOLALITY * np.sum(vol_dens * relax, axis=1), r_h2o * H2O_MOLALITY)
+    csf_corr = np.where(with_frac, 1 / (1 - frac[:, 2]), 1.0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = SMObs / SH2OObs
+    conc_molal = ratio * proton_corr * water_molal * csf_corr * add_corr * metab_corr
+    conc_molar = ratio * proton_corr * water_molar * csf_corr * add_corr * metab_corr
+
+    # Other metabolites to reference scaling
+    metabtoRefScaling = np.array([quantifyInternal(q_ref.ref_metab, res.getConc(), res.metabs)
+                                  for res in results_list])
+    conc_molal = conc_molal * metabtoRefScaling
+    conc_molar = conc_molar * metabtoRefScaling
+
+    if verbose:
+        print(f'Batch water quantification of {len(mrs_list)} spectra.')
+        print(f'Metabolite area (median) = {np.median(SMObs):0.2e}')
+        print(f'Water area (median) = {np.median(SH2OObs):0.2e}')
+        print(f'Final molarity scaling (median) = {np.median(conc_molar):0.2e}')
+
+    ref_info = []
+    for mrs, w_p, m_fid in zip(mrs_list, w_params, m_fids.T):
+        ref_info.append({'metab_ref': BatchRefIntegral(mrs, m_fid, q_ref.ref_limits),
+                         'water_ref': WaterRef(mrs, q_ref.h2o_limits, fit_params=w_p)})
+
+    return conc_molal, conc_molar, ref_info
+
+
 def create_quant_info(header, mrs, tissueFractions=None, additional_scale=1.0):
     """ Create a QuantificationInfo object given NIFTI-MRS header and mrs."""
     q_info = QuantificationInfo(
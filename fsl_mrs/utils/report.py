@@ -11,6 +11,7 @@
 import pandas as pd
 import numpy as np
 import os
+import base64
 from pathlib import Path
 from typing import TYPE_CHECKING
 
@@ -20,20 +21,135 @@ import nibabel as nib
 
 from fsl_mrs.utils import plotting
 from fsl_mrs.utils import misc
+from fsl_mrs.utils import nifti_compression
+from fsl_mrs.utils.preproc.reporting import deferrable_report
 if TYPE_CHECKING:
     from fsl_mrs.dynamic import dyn_results
     from fsl_mrs.utils.results import FitRes
 
 
-def to_div(fig):
+# Optional (more expensive) report panels, omitted from light reports unless requested
+OPTIONAL_PANELS = ('uncertainty', 'basis', 'metabs', 'correlations')
+
+
+def to_div(fig, light=False):
     """
-    Turns Plotly Figure into HTML
+    Turns Plotly Figure into HTML.
+    Light divs store figure data compactly and rely on the report loading the plotly library.
     """
+    if light:
+        return plotly.offline.plot(compact_figure(fig),
+                                   output_type='div',
+                                   include_plotlyjs=False)
     return plotly.offline.plot(fig,
                                output_type='div',
                                include_plotlyjs='cdn')
 
 
+def compact_figure(fig):
+    """Store the numeric data of a plotly figure as single precision typed arrays.
+
+    Applies to trace data and to data held in update menu (button) arguments,
+    which would otherwise be written as text.
+
+    :param fig: Plotly figure, modified in place
+    :type fig: plotly.graph_objects.Figure
+    :return: Figure
+    :rtype: plotly.graph_objects.Figure
+    """
+    for trace in fig.data:
+        for key in ('x', 'y', 'z'):
+            val = getattr(trace, key, None)
+            if val is not None and not isinstance(val, str):
+                arr = np.asarray(val)
+                if arr.dtype == np.float64:
+                    trace[key] = arr.astype(np.float32)
+
+    def compact_args(arg):
+        if isinstance(arg, dict):
+            return {key: compact_args(val) for key, val in arg.items()}
+        elif isinstance(arg, (list, tuple, np.ndarray)):
+            arr = np.asarray(arg) if len(arg) > 16 else None
+            if arr is not None and arr.ndim == 1 and np.issubdtype(arr.dtype, np.floating):
+                return {'dtype': 'f4', 'bdata': base64.b64encode(arr.astype('<f4').tobytes()).decode('ascii')}
+            return [compact_args(val) for val in arg]
+        return arg
+
+    for menu in fig.layout.updatemenus:
+        for button in menu.buttons:
+            if button.args is not None:
+                button.args = compact_args(list(button.args))
+    return fig
+
+
+def include_panel(name, light, panels):
+    """Decide whether an optional report panel is included.
+
+    :param name: Panel name, one of OPTIONAL_PANELS
+    :type name: str
+    :param light: Light report
+    :type light: bool
+    :param panels: Optional panels to include, defaults (if None) to all for full reports and none for light reports
+    :type panels: list or None
+    :rtype: bool
+    """
+    if panels is None:
+        return not light
+    return name in panels
+
+
+def image_div(img, light=False, report_file=None, name='figure'):
+    """HTML for a static image (matplotlib figure or image file).
+
+    Full reports embed the image. Light reports link to the image file,
+    saving matplotlib figures as PNG files alongside the report.
+
+    :param img: Matplotlib figure or path to image file
+    :param light: Light report, defaults to False
+    :type light: bool, optional
+    :param report_file: Report path, required for light reports
+    :type report_file: str or pathlib.Path, optional
+    :param name: Name of saved image file (without extension), defaults to 'figure'
+    :type name: str, optional
+    :return: HTML string
+    :rtype: str
+    """
+    if not light:
+        return to_div(static_image(img))
+
+    report_dir = Path(report_file).parent
+    if isinstance(img, (str, Path)):
+        img_path = Path(img)
+    else:
+        img_path = report_dir / f'{Path(report_file).stem}_{name}.png'
+        img.savefig(img_path, bbox_inches='tight')
+    src = Path(os.path.relpath(Path(img_path).resolve(), report_dir.resolve())).as_posix()
+    return f'<img src="{src}" style="max-width:100%">'
+
+
+def write_plotly_bundle(directory):
+    """Write the plotly javascript library to a directory, if not already present.
+
+    The file name includes the library version so a single location can be shared between reports.
+
+    :param directory: Location of the bundle
+    :type directory: str or pathlib.Path
+    :return: Path to bundle
+    :rtype: pathlib.Path
+    """
+    from plotly.offline import get_plotlyjs, get_plotlyjs_version
+    directory = Path(directory)
+    bundle = directory / f'plotly-{get_plotlyjs_version()}.min.js'
+    if not bundle.is_file():
+        directory.mkdir(parents=True, exist_ok=True)
+        # Write via a temporary file in case of concurrent writers
+        tmp_path = bundle.with_name(f'{bundle.name}.{os.getpid()}.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as fp:
+            fp.write(get_plotlyjs())
+        os.replace(tmp_path, bundle)
+    return bundle
+
+
 '''Sections and layout for the single voxel report
 The following sections are currently produced:
 
@@ -46,71 +162,71 @@ The following sections are currently produced:
     table-quant           ; Table with quantification results'''
 
 
-def svs_summary_div(mrs, res):
+def svs_summary_div(mrs, res, light=False):
     """fitting summary - single spectrum fit"""
     fig = plotting.plotly_fit(mrs, res)
-    return to_div(fig)
+    return to_div(fig, light)
 
 
-def svs_table_lineshape_phase_div(res):
+def svs_table_lineshape_phase_div(res, light=False):
     """table of nuisance parameters (lineshape, phase, shift)."""
     fig = plotting.plot_table_lineshape_phase(res)
-    return to_div(fig)
+    return to_div(fig, light)
 
 
-def svs_table_qc(res):
+def svs_table_qc(res, light=False):
     """Table of qc parameters (SNR & FWHM)"""
     fig = plotting.plot_table_qc(res)
-    return to_div(fig)
+    return to_div(fig, light)
 
 
-def svs_correlations(res):
+def svs_correlations(res, light=False):
     """Metabolite concentration correlation figure"""
     if res.method == 'MH':
         fig = plotting.plot_corr(res, title='MCMC Correlations')
     else:
         fig = plotting.plot_corr(res, corr=res.corr, title='Laplace approx Correlations')
-    return to_div(fig)
+    return to_div(fig, light)
 
 
-def svs_posteriors(res):
+def svs_posteriors(res, light=False):
     """Concentration parameter posteriors"""
     if res.method == 'MH':
         fig = plotting.plot_dist_mcmc(res, refname=res.concScalings['internalRef'])
     else:
         fig = plotting.plot_dist_approx(res, refname=res.concScalings['internalRef'])
-    return to_div(fig)
+    return to_div(fig, light)
 
 
-def svs_real_imag_plot(mrs, res):
+def svs_real_imag_plot(mrs, res, light=False):
     """View of real and imaginary components with fit"""
     fig = plotting.plot_real_imag(mrs, res, ppmlim=res.ppmlim)
-    return to_div(fig)
+    return to_div(fig, light)
 
 
-def svs_basis_plot(mrs, res):
+def svs_basis_plot(mrs, res, light=False):
     """View of basis spectrum with data"""
     fig = plotting.plotly_basis(mrs, ppmlim=res.ppmlim)
-    return to_div(fig)
+    return to_div(fig, light)
 
 
-def svs_indiv_plot(mrs, res):
+def svs_indiv_plot(mrs, res, light=False):
     """View of each individual scaled metabolite basis spectrum."""
     fig = plotting.plot_indiv_stacked(mrs, res, ppmlim=res.ppmlim)
-    return to_div(fig)
+    return to_div(fig, light)
 
 
-def svs_table_tissue_quant(res):
+def svs_table_tissue_quant(res, light=False):
     """Quantification information table"""
     quant_df = res.concScalings['quant_info'].summary_table
     quant_df.reset_index(inplace=True)
     tab = plotting.create_table(quant_df)
     fig = go.Figure(data=[tab])
     fig.update_layout(height=100, margin=dict(l=0, r=0, t=0, b=0))
-    return to_div(fig)
+    return to_div(fig, light)
 
 
-def svs_table_quant(res):
+def svs_table_quant(res, light=False):
     """ Table containing Quantification information
     Table of CSF,GM,WM
     Fractions
@@ -129,7 +245,7 @@ def svs_table_quant(res):
     metabRelaxCorr = Q.relax_corr_metab
 
     if res.concScalings['quant_info'].f_GM is not None:
-        extra_div = svs_table_tissue_quant(res)
+        extra_div = svs_table_tissue_quant(res, light)
         table = f"""
         <div style="width:70%">{extra_div}</div>
         <table>
@@ -217,10 +333,10 @@ def svs_table_quant(res):
     return table
 
 
-def svs_plot_refs(mrs, res):
+def svs_plot_refs(mrs, res, light=False):
     """View of referencing integration areas"""
     fig = plotting.plot_references(mrs, res)
-    return to_div(fig)
+    return to_div(fig, light)
 
 
 def svs_methods_summary(res: "FitRes"):
@@ -258,27 +374,29 @@ def svs_methods_summary(res: "FitRes"):
 '''Layout for the svs report'''
 
 
-def create_svs_sections(mrs, res, location_fig):
+def create_svs_sections(mrs, res, location_fig, light=False, panels=None, report_file=None):
     """
     Create the HTML sections for svs report figures and tables
     includes section headings.
     Sections will appear in order added to list
     The output is a list
+
+    Light reports store figures compactly, link to images rather than embedding them,
+    and by default omit the optional panels (see OPTIONAL_PANELS).
     """
     sections = []
     sections.append(
         f"""
         <h1><a name="summary">Summary</a></h1>
-        <div id=fit>{svs_summary_div(mrs, res)}</div>
+        <div id=fit>{svs_summary_div(mrs, res, light)}</div>
         <hr>
         """)
 
     if location_fig is not None:
-        fig = static_image(location_fig)
         sections.append(
             f"""
             <h1>Voxel location</h1>
-            <div>{to_div(fig)}</div>
+            <div>{image_div(location_fig, light, report_file)}</div>
             <hr>
             """)
 
@@ -286,45 +404,56 @@ def create_svs_sections(mrs, res, location_fig):
     sections.append(
         f"""
         <h1><a name="nuisance">Nuisance parameters</a></h1>
-        <div style="width:70%">{svs_table_lineshape_phase_div(res)}</div>
+        <div style="width:70%">{svs_table_lineshape_phase_div(res, light)}</div>
 
         <hr>
         <h1><a name="qc">QC parameters</a></h1>
-        <div style="width:70%">{svs_table_qc(res)}</div>
+        <div style="width:70%">{svs_table_qc(res, light)}</div>
         <hr>
         """)
 
-    sections.append(
-        f"""
-        <h1><a name="uncertainty">Uncertainties</a></h1>
-        <table width=100%>
-        <tr>
-        <th style="vertical-align:top">{svs_correlations(res)}</th>
-        <th style="vertical-align:top">{svs_posteriors(res)}</th>
-        </tr>
-        </table>
-        <hr>
-        """)
+    sections_titles = {
+        'summary': 'Summary',
+        'nuisance': 'Nuisance',
+        'qc': 'QC'}
 
-    sections.append(
-        f"""
-        <h1><a name="basis">Basis spectra summary</a></h1>
-        {svs_basis_plot(mrs, res)}
-        <hr>
-        """)
+    if include_panel('uncertainty', light, panels):
+        sections.append(
+            f"""
+            <h1><a name="uncertainty">Uncertainties</a></h1>
+            <table width=100%>
+            <tr>
+            <th style="vertical-align:top">{svs_correlations(res, light)}</th>
+            <th style="vertical-align:top">{svs_posteriors(res, light)}</th>
+            </tr>
+            </table>
+            <hr>
+            """)
+        sections_titles['uncertainty'] = 'Uncertainty'
 
-    sections.append(
-        f"""
-        <h1><a name="metabs">Individual metabolite estimates</a></h1>
-        {svs_indiv_plot(mrs, res)}
-        <hr>
-        """)
+    if include_panel('basis', light, panels):
+        sections.append(
+            f"""
+            <h1><a name="basis">Basis spectra summary</a></h1>
+            {svs_basis_plot(mrs, res, light)}
+            <hr>
+            """)
+        sections_titles['basis'] = 'Basis Spectra'
+
+    if include_panel('metabs', light, panels):
+        sections.append(
+            f"""
+            <h1><a name="metabs">Individual metabolite estimates</a></h1>
+            {svs_indiv_plot(mrs, res, light)}
+            <hr>
+            """)
+        sections_titles['metabs'] = 'Metabs'
 
     if res.concScalings['molality'] is not None:
         sections.append(
             f"""
             <h1><a name="quantification">Quantification information</a></h1>
-            {svs_table_quant(res)}
+            {svs_table_quant(res, light)}
             <hr>
             """)
 
@@ -332,7 +461,7 @@ def create_svs_sections(mrs, res, location_fig):
         sections.append(
             f"""
             <h2><a name="refs">Water referencing</a></h2>
-            {svs_plot_refs(mrs, res)}
+            {svs_plot_refs(mrs, res, light)}
             <hr>
             """)
 
@@ -343,20 +472,25 @@ def create_svs_sections(mrs, res, location_fig):
         <hr>
         """)
 
-    sections_titles = {
-        'summary': 'Summary',
-        'nuisance': 'Nuisance',
-        'qc': 'QC',
-        'uncertainty': 'Uncertainty',
-        'basis': 'Basis Spectra',
-        'metabs': 'Metabs',
-        'quantification': 'Quantification',
-        'methods': 'Methods'}
+    sections_titles['quantification'] = 'Quantification'
+    sections_titles['methods'] = 'Methods'
 
     return sections, sections_titles
 
 
-def create_svs_report(mrs, res, filename, fidfile, basisfile, h2ofile, date, location_fig=None):
+@deferrable_report(output_arg='filename')
+def create_svs_report(mrs, res, filename, fidfile, basisfile, h2ofile, date, location_fig=None,
+                      light=False, assets=None, panels=None):
+    """Create an HTML report for a single voxel fit.
+
+    :param light: Create a light report, which loads a shared local copy of the plotly library,
+        stores figure data compactly and omits optional panels unless listed in panels. Defaults to False.
+    :type light: bool, optional
+    :param assets: Location of the shared plotly library for light reports, defaults to the report directory
+    :type assets: str or pathlib.Path, optional
+    :param panels: Optional panels (see OPTIONAL_PANELS) to include, defaults to all (full) or none (light)
+    :type panels: list, optional
+    """
 
     title = "FSL MRS Report"
 
@@ -369,31 +503,32 @@ def create_svs_report(mrs, res, filename, fidfile, basisfile, h2ofile, date, loc
         </pre>
         """
 
-    sections, section_titles = create_svs_sections(mrs, res, location_fig)
+    sections, section_titles = create_svs_sections(
+        mrs, res, location_fig, light=light, panels=panels, report_file=filename)
 
-    create_report(title, preamble, section_titles, sections, filename)
+    create_report(title, preamble, section_titles, sections, filename, plotly_src=_plotly_src(light, assets, filename))
 
 
 '''Sections and layout for the dynamic report'''
 
 
-def dyn_summary_div(dynres):
+def dyn_summary_div(dynres, light=False):
     """fitting summary - dynamic spectrum fit"""
     fig = plotting.plotly_dynMRS(
         dynres._dyn.mrs_list,
         dynres.reslist,
         dynres._dyn.time_var)
-    return to_div(fig)
+    return to_div(fig, light)
 
 
-def dyn_mapped_div(dynres):
+def dyn_mapped_div(dynres, light=False, report_file=None):
     """Models compared to independent fitting"""
     fig = dynres.plot_mapped(fit_to_init=True)
 
-    return to_div(static_image(fig))
+    return image_div(fig, light, report_file, 'mapped')
 
 
-def dyn_fit_q_div(dynres):
+def dyn_fit_q_div(dynres, light=False, report_file=None):
     """Generate output on dynamic fit quality"""
     fig = dynres.plot_residuals()
     info_str = '<pre>\n'
@@ -407,33 +542,33 @@ def dyn_fit_q_div(dynres):
     return f'''<h3>Fit quality parameters</h3>
                <div id=fit>{info_str}</div>
                <h3>Residuals</h3>
-               {to_div(static_image(fig))}
+               {image_div(fig, light, report_file, 'residuals')}
                '''
 
 
-def dyn_corr(dynres):
+def dyn_corr(dynres, light=False):
     """Generate a HTML div containing the free parameter correlations"""
-    return to_div(dynres.plot_corr())
+    return to_div(dynres.plot_corr(), light)
 
 
-def dyn_free_parameter_summaries(dynres, category):
+def dyn_free_parameter_summaries(dynres, category, light=False):
     """Summary table of mapped parameters"""
     collected_result = dynres.collected_results()[category]
     collected_result.reset_index(inplace=True)
     tab = plotting.create_table(collected_result)
     fig = go.Figure(data=[tab])
     fig.update_layout(height=100, margin=dict(l=0, r=0, t=0, b=0))
-    return to_div(fig)
+    return to_div(fig, light)
 
 
-def dyn_free_parameter_uncertainties(dynres):
+def dyn_free_parameter_uncertainties(dynres, light=False):
     """Summary table of free parameter SDs"""
     df = pd.concat((dynres.mean_free, dynres.std_free), axis=1, keys=['mean', 'sd'])
     df.reset_index(inplace=True)
     tab = plotting.create_table(df)
     fig = go.Figure(data=[tab])
     fig.update_layout(height=100, margin=dict(l=0, r=0, t=0, b=0))
-    return to_div(fig)
+    return to_div(fig, light)
 
 
 def dyn_methods_summary(res: "dyn_results.dynRes"):
@@ -458,33 +593,36 @@ def dyn_methods_summary(res: "dyn_results.dynRes"):
         return base_str
 
 
-def create_dyn_sections(dynres, location_fig):
+def create_dyn_sections(dynres, location_fig, light=False, panels=None, report_file=None):
     """
     Create the HTML sections for svs report figures and tables
     includes section headings.
     Sections will appear in order added to list
     The output is a list
+
+    Light reports store figures compactly, link to images rather than embedding them,
+    and by default omit the optional panels (see OPTIONAL_PANELS).
     """
     sections = []
 
     sections.append(
         f"""
         <h1><a name="summary">Summary</a></h1>
-        <div id=fit>{dyn_summary_div(dynres)}</div>
+        <div id=fit>{dyn_summary_div(dynres, light)}</div>
         <hr>
         """)
 
     sections.append(
         f"""
         <h1><a name="model_vis">Model Visualisation</a></h1>
-        <div id=fit>{dyn_mapped_div(dynres)}</div>
+        <div id=fit>{dyn_mapped_div(dynres, light, report_file)}</div>
         <hr>
         """)
 
     sections.append(
         f"""
         <h1><a name="fit_quality">Fit Quality</a></h1>
-        <div id=fit>{dyn_fit_q_div(dynres)}</div>
+        <div id=fit>{dyn_fit_q_div(dynres, light, report_file)}</div>
         <hr>
         """)
 
@@ -492,14 +630,18 @@ def create_dyn_sections(dynres, location_fig):
     for cat in dynres._dyn.vm.mapped_categories:
         mapped_divs.append(
             f'''<h3>{cat}</h3>
-            <div id=fit>{dyn_free_parameter_summaries(dynres, cat)}</div>
+            <div id=fit>{dyn_free_parameter_summaries(dynres, cat, light)}</div>
             ''')
     mapped_divs_str = '\n'.join(mapped_divs)
+    if include_panel('correlations', light, panels):
+        corr_str = f'''<h3>Parameter Correlations</h3>
+        {dyn_corr(dynres, light)}'''
+    else:
+        corr_str = ''
     sections.append(
         f"""
         <h1><a name="free_params">Free Parameter Summary</a></h1>
-        <h3>Parameter Correlations</h3>
-        {dyn_corr(dynres)}
+        {corr_str}
         {mapped_divs_str}
         <hr>
         """)
@@ -507,7 +649,7 @@ def create_dyn_sections(dynres, location_fig):
     sections.append(
         f"""
         <h1><a name="uncertainty">Free Parameter Uncertianty</a></h1>
-        <div id=fit>{dyn_free_parameter_uncertainties(dynres)}</div>
+        <div id=fit>{dyn_free_parameter_uncertainties(dynres, light)}</div>
         <hr>
         """)
 
@@ -536,7 +678,10 @@ def create_dynmrs_report(
         configfile: Path,
         tvarfiles: str,
         date: str,
-        location_fig: Path | None = None):
+        location_fig: Path | None = None,
+        light: bool = False,
+        assets: Path | None = None,
+        panels: list | None = None):
     """Create an HTML report for a first level (single subject) dynamic fit.
 
     :param dynres: Dynamic fitting results object
@@ -555,6 +700,13 @@ def create_dynmrs_report(
     :type date: str
     :param location_fig: Path to voxel location figure, defaults to None
     :type location_fig: Path | None, optional
+    :param light: Create a light report, which loads a shared local copy of the plotly library,
+        stores figure data compactly and omits optional panels unless listed in panels. Defaults to False.
+    :type light: bool, optional
+    :param assets: Location of the shared plotly library for light reports, defaults to the report directory
+    :type assets: Path | None, optional
+    :param panels: Optional panels (see OPTIONAL_PANELS) to include, defaults to all (full) or none (light)
+    :type panels: list | None, optional
     """
 
     title = "FSL-MRS Dynamic Fitting Report"
@@ -569,14 +721,30 @@ def create_dynmrs_report(
         </pre>
         """
 
-    sections, section_titles = create_dyn_sections(dynres, location_fig)
+    sections, section_titles = create_dyn_sections(
+        dynres, location_fig, light=light, panels=panels, report_file=filename)
 
-    create_report(title, preamble, section_titles, sections, filename)
+    create_report(title, preamble, section_titles, sections, filename, plotly_src=_plotly_src(light, assets, filename))
 
 
 # -------- Report creation tools ---------
 
-def create_report(title: str, preamble: str, section_titles: dict, sections: list[str], filename: Path):
+def _plotly_src(light, assets, filename):
+    """Source of the plotly library loaded by a report: a shared local bundle (light reports) or None (CDN)."""
+    if not light:
+        return None
+    report_dir = Path(filename).parent
+    bundle = write_plotly_bundle(report_dir if assets is None else assets)
+    return Path(os.path.relpath(bundle.resolve(), report_dir.resolve())).as_posix()
+
+
+def create_report(
+        title: str,
+        preamble: str,
+        section_titles: dict,
+        sections: list[str],
+        filename: Path,
+        plotly_src: str | None = None):
     """Create a HTML report out of sections of HTML formatted data.
 
     :param title: Report title
@@ -589,7 +757,11 @@ def create_report(title: str, preamble: str, section_titles: dict, sections: lis
     :type sections: list[str]
     :param filename: Report output path.
     :type filename: Path
+    :param plotly_src: Location of plotly library, defaults to None (latest version from CDN)
+    :type plotly_src: str | None, optional
     """
+    if plotly_src is None:
+        plotly_src = 'https://cdn.plot.ly/plotly-latest.min.js'
 
     sectiont_text = '\n'.join([f'<a href="#{key}">{section_titles[key]}</a> -' for key in section_titles])
 
@@ -612,7 +784,7 @@ def create_report(title: str, preamble: str, section_titles: dict, sections: lis
         }}
 
         </style>
-        <script src="https://cdn.plot.ly/plotly-latest.min.js"></script>
+        <script src="{plotly_src}"></script>
         </head>
         <body style="background-color:white">
         <div class="header">
@@ -650,7 +822,8 @@ def fitting_summary_fig(mrs, res, filename):
 # --------- MRSI reporting
 def save_params(params, names, data_hdr, mask, folder, cleanup=True):
     """
-    Save MRSI results into NIFTI image files
+    Save MRSI results into NIFTI image files.
+    Files are compressed according to the current fsl_mrs.utils.nifti_compression setting.
     """
     for i, p in enumerate(names):
         x = misc.list_to_volume(list(params[:, i]), mask)
@@ -662,7 +835,7 @@ def save_params(params, names, data_hdr, mask, folder, cleanup=True):
 
         img = nib.Nifti1Image(x, data_hdr.affine)
         filename = os.path.join(folder, p + '.nii.gz')
-        nib.save(img, filename)
+        nifti_compression.save_nifti(img, filename)
 
 
 # --------Utility functions --------
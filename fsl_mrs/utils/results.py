@@ -205,7 +205,8 @@ class FitRes(object):
                              mrs,
                              quant_info=None,
                              internal_reference=['Cr', 'PCr'],
-                             verbose=False):
+                             verbose=False,
+                             water_scaling=None):
         """Run calculation of internal and (if possible) water concentration scaling.
 
         :param mrs: MRS object
@@ -216,6 +217,9 @@ class FitRes(object):
         :type internal_reference: list, optional
         :param verbose: Enable for verbose output, defaults to False
         :type verbose: bool, optional
+        :param water_scaling: Precalculated (molality scaling, molarity scaling, ref_info) for this result,
+            e.g. from quantify.quantifyWaterBatch. Defaults to None, calculating with quantify.quantifyWater.
+        :type water_scaling: tuple, optional
         """
 
         self.intrefstr = '+'.join(internal_reference)
@@ -224,10 +228,12 @@ class FitRes(object):
         internalRefScaling = quant.quantifyInternal(internal_reference, self.getConc(), self.metabs)
 
         if mrs.H2O is not None and quant_info is not None:
-            molalityScaling, molarityScaling, ref_info = quant.quantifyWater(mrs,
-                                                                             self,
-                                                                             quant_info,
-                                                                             verbose=verbose)
+            if water_scaling is None:
+                water_scaling = quant.quantifyWater(mrs,
+                                                    self,
+                                                    quant_info,
+                                                    verbose=verbose)
+            molalityScaling, molarityScaling, ref_info = water_scaling
             if ref_info['metab_ref'].integral == 0.0:
                 raise self.QuantificationError(
                     f'Metabolite reference {quant_info.ref_metab} has not been fit (conc=0). '
@@ -0,0 +1,405 @@
+# results_index.py - Incremental index of fsl_mrs and fsl_dynmrs results
+#
+# Author: FSL-MRS contributors
+#
+# Copyright (C) 2026 University of Oxford
+# SHBASECOPYRIGHT
+
+"""A results index is a single SQLite database holding the tabular outputs of many
+fsl_mrs (SVS) and fsl_dynmrs (dynamic) results folders.
+
+Each folder's CSV outputs and fitting options are stored once, with the size and modification
+time of the source files. On update only new or changed folders are re-read.
+
+Tables (all keyed on ``folder``, the id of the row in ``folders``):
+
+- ``folders``: path, kind ('svs' or 'dynamic'), source fingerprint and options (JSON)
+- ``concentrations``: metabolite, measure (mean/std), scaling (raw/internal/molality/...), value
+- ``qc``: metabolite, measure (SNR/FWHM), value
+- ``parameters``: parameter, measure, value. all_parameters.csv (SVS) or free_parameters.csv (dynamic)
+- ``dyn_results``: sample, parameter, value
+- ``dyn_cov``: parameter, parameter2, value
+- ``mapped_parameters``: parameter, time, measure, value
+
+Example::
+
+    with ResultsIndex('cohort.sqlite') as index:
+        index.update(find_results('study_dir'))
+        conc_df = index.concentrations()
+        naa = index.query(
+            "SELECT f.path, c.value FROM concentrations c JOIN folders f ON c.folder = f.id "
+            "WHERE c.metabolite = 'NAA' AND c.measure = 'mean' AND c.scaling = 'internal'")
+"""
+
+import json
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+INDEX_VERSION = 1
+
+# Table name: (file name, pandas.read_csv options, label column names)
+_SVS_TABLES = {
+    'concentrations': ('concentrations.csv', {'index_col': 0, 'header': [0, 1]}, ('metabolite', 'measure', 'scaling')),
+    'qc': ('qc.csv', {'index_col': 0}, ('metabolite', 'measure')),
+    'parameters': ('all_parameters.csv', {'index_col': 0}, ('parameter', 'measure'))}
+
+_DYN_TABLES = {
+    'dyn_results': ('dyn_results.csv', {'index_col': 0}, ('sample', 'parameter')),
+    'dyn_cov': ('dyn_cov.csv', {'index_col': 0}, ('parameter', 'parameter2')),
+    'parameters': ('free_parameters.csv', {'index_col': 0}, ('parameter', 'measure')),
+    'mapped_parameters': (
+        'mapped_parameters.csv', {'index_col': 0, 'header': [0, 1]}, ('parameter', 'time', 'measure'))}
+
+_KINDS = {'svs': _SVS_TABLES, 'dynamic': _DYN_TABLES}
+
+_LABELS = {name: labels for tables in _KINDS.values() for name, (_, _, labels) in tables.items()}
+
+
+class ResultsIndexError(Exception):
+    pass
+
+
+def result_kind(folder):
+    """Identify the type of results folder.
+
+    :param folder: Results folder
+    :type folder: str or pathlib.Path
+    :return: 'svs' for fsl_mrs results, 'dynamic' for fsl_dynmrs results, None otherwise
+    :rtype: str or None
+    """
+    folder = Path(folder)
+    if (folder / 'dyn_results.csv').is_file():
+        return 'dynamic'
+    elif (folder / 'concentrations.csv').is_file():
+        return 'svs'
+    return None
+
+
+def find_results(root, kind=None):
+    """Find all results folders below a directory.
+
+    :param root: Directory to search
+    :type root: str or pathlib.Path
+    :param kind: Only return 'svs' or 'dynamic' results, defaults to None (both)
+    :type kind: str, optional
+    :return: Sorted list of results folders
+    :rtype: list of pathlib.Path
+    """
+    root = Path(root)
+    found = {fp.parent for fp in root.rglob('concentrations.csv')}\
+        | {fp.parent for fp in root.rglob('dyn_results.csv')}
+    return sorted(fp for fp in found if kind is None or result_kind(fp) == kind)
+
+
+def _fingerprint(folder, kind):
+    """Size and modification time of each indexed file in a results folder."""
+    fingerprint = []
+    for fname in sorted({tab[0] for tab in _KINDS[kind].values()} | {'options.txt'}):
+        try:
+            stat = (folder / fname).stat()
+        except FileNotFoundError:
+            continue
+        fingerprint.append([fname, stat.st_size, stat.st_mtime_ns])
+    return json.dumps(fingerprint)
+
+
+def _read_options(folder):
+    """Return the JSON encoded options from the first line of options.txt, or None."""
+    try:
+        with open(folder / 'options.txt') as fp:
+            line = fp.readline().strip()
+    except FileNotFoundError:
+        return None
+    try:
+        json.loads(line)
+    except json.JSONDecodeError:
+        return None
+    return line
+
+
+def _to_long(df):
+    """Flatten a dataframe to a list of (row label, column label(s)..., value) tuples in row-major order."""
+    n_rows, n_cols = df.shape
+    rows = np.repeat(np.asarray(df.index.tolist(), dtype=object), n_cols)
+    if isinstance(df.columns, pd.MultiIndex):
+        cols = [np.tile(np.asarray(df.columns.get_level_values(lvl).tolist(), dtype=object), n_rows)
+                for lvl in range(df.columns.nlevels)]
+    else:
+        cols = [np.tile(np.asarray(df.columns.tolist(), dtype=object), n_rows)]
+    values = pd.to_numeric(df.to_numpy().ravel(), errors='coerce').astype(float)
+    values = np.where(np.isnan(values), None, values).tolist()
+    return list(zip(rows.tolist(), *[col.tolist() for col in cols], values))
+
+
+def _to_wide(long_df, labels):
+    """Pivot a long format table back to a dataframe, preserving the stored row and column order."""
+    row, cols = labels[0], list(labels[1:])
+    row_order = pd.unique(long_df[row])
+    if len(cols) == 1:
+        col_order = pd.unique(long_df[cols[0]])
+        wide = long_df.pivot(index=row, columns=cols[0], values='value')
+        wide = wide.reindex(index=row_order, columns=col_order)
+    else:
+        col_order = pd.MultiIndex.from_frame(long_df[cols].drop_duplicates())
+        wide = long_df.pivot(index=row, columns=cols, values='value')
+        wide = wide.reindex(index=row_order, columns=col_order)
+    wide.index.name = None
+    wide.columns.names = [None] * len(cols)
+    return wide
+
+
+class ResultsIndex:
+    """SQLite index of fsl_mrs and fsl_dynmrs results folders.
+
+    Folders are identified by their resolved path.
+    The index may be created in memory by passing ':memory:' as the path.
+    """
+
+    def __init__(self, path=':memory:'):
+        """Open (creating if necessary) a results index
+
+        :param path: Index file location, defaults to ':memory:'
+        :type path: str or pathlib.Path, optional
+        """
+        self.path = path
+        self._conn = sqlite3.connect(str(path))
+        self._conn.execute('PRAGMA foreign_keys = ON')
+        version = self._conn.execute('PRAGMA user_version').fetchone()[0]
+        if version not in (0, INDEX_VERSION):
+            self._conn.close()
+            raise ResultsIndexError(
+                f'{path} has results index version {version}, expected {INDEX_VERSION}. '
+                'Please delete and recreate the index.')
+        self._create_tables()
+
+    def _create_tables(self):
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS folders ('
+                'id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, kind TEXT NOT NULL, '
+                'fingerprint TEXT NOT NULL, options TEXT)')
+            for name, labels in _LABELS.items():
+                # Label columns are untyped to preserve numeric labels (e.g. sample index)
+                self._conn.execute(
+                    f'CREATE TABLE IF NOT EXISTS {name} ('
+                    'folder INTEGER NOT NULL REFERENCES folders(id) ON DELETE CASCADE, '
+                    + ', '.join(labels) + ', value REAL)')
+                self._conn.execute(
+                    f'CREATE INDEX IF NOT EXISTS {name}_folder ON {name} (folder)')
+            self._conn.execute(f'PRAGMA user_version = {INDEX_VERSION}')
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM folders').fetchone()[0]
+
+    def __contains__(self, folder):
+        return self._folder_id(folder) is not None
+
+    def _folder_id(self, folder):
+        row = self._conn.execute(
+            'SELECT id FROM folders WHERE path = ?',
+            (str(Path(folder).resolve()),)).fetchone()
+        return None if row is None else row[0]
+
+    def _require_id(self, folder):
+        folder_id = self._folder_id(folder)
+        if folder_id is None:
+            raise ResultsIndexError(f'{folder} is not in the results index.')
+        return folder_id
+
+    def update(self, folders, verbose=False):
+        """Add results folders to the index, re-reading only new or modified folders.
+
+        :param folders: Results folders
+        :type folders: list of str or pathlib.Path
+        :param verbose: Print each folder as it is (re)indexed, defaults to False
+        :type verbose: bool, optional
+        :return: Folders which were (re)indexed
+        :rtype: list of pathlib.Path
+        """
+        updated = []
+        for folder in folders:
+            folder = Path(folder).resolve()
+            kind = result_kind(folder)
+            if kind is None:
+                raise ResultsIndexError(f'{folder} is not a fsl_mrs or fsl_dynmrs results folder.')
+            fingerprint = _fingerprint(folder, kind)
+            row = self._conn.execute(
+                'SELECT id, fingerprint FROM folders WHERE path = ?', (str(folder),)).fetchone()
+            if row is not None and row[1] == fingerprint:
+                continue
+
+            if verbose:
+                print(f'Indexing {folder}.')
+            tables = {}
+            for name, (fname, read_opts, _) in _KINDS[kind].items():
+                if (folder / fname).is_file():
+                    tables[name] = _to_long(pd.read_csv(folder / fname, **read_opts))
+
+            with self._conn:
+                if row is None:
+                    folder_id = self._conn.execute(
+                        'INSERT INTO folders (path, kind, fingerprint, options) VALUES (?, ?, ?, ?)',
+                        (str(folder), kind, fingerprint, _read_options(folder))).lastrowid
+                else:
+                    # Keep the folder id (and so the folder order), replacing all stored tables
+                    folder_id = row[0]
+                    self._conn.execute(
+                        'UPDATE folders SET kind = ?, fingerprint = ?, options = ? WHERE id = ?',
+                        (kind, fingerprint, _read_options(folder), folder_id))
+                    for name in _LABELS:
+                        self._conn.execute(f'DELETE FROM {name} WHERE folder = ?', (folder_id,))
+                for name, rows in tables.items():
+                    n_labels = len(_LABELS[name])
+                    self._conn.executemany(
+                        f'INSERT INTO {name} VALUES (?, ' + ', '.join('?' * (n_labels + 1)) + ')',
+                        [(folder_id, *row) for row in rows])
+            updated.append(folder)
+        return updated
+
+    def refresh(self, verbose=False):
+        """Update all indexed folders, removing those which no longer exist.
+
+        :param verbose: Print each folder as it is (re)indexed, defaults to False
+        :type verbose: bool, optional
+        :return: Folders which were (re)indexed
+        :rtype: list of pathlib.Path
+        """
+        existing = []
+        for folder in self.folders():
+            if result_kind(folder) is None:
+                self.remove(folder)
+            else:
+                existing.append(folder)
+        return self.update(existing, verbose=verbose)
+
+    def remove(self, folder):
+        """Remove a folder from the index.
+
+        :param folder: Results folder
+        :type folder: str or pathlib.Path
+        """
+        with self._conn:
+            self._conn.execute('DELETE FROM folders WHERE path = ?', (str(Path(folder).resolve()),))
+
+    def folders(self, kind=None):
+        """List indexed folders in order of indexing.
+
+        :param kind: Only return 'svs' or 'dynamic' results, defaults to None (both)
+        :type kind: str, optional
+        :return: Results folders
+        :rtype: list of pathlib.Path
+        """
+        if kind is None:
+            rows = self._conn.execute('SELECT path FROM folders ORDER BY id')
+        else:
+            rows = self._conn.execute('SELECT path FROM folders WHERE kind = ? ORDER BY id', (kind,))
+        return [Path(row[0]) for row in rows]
+
+    def options(self, folder):
+        """Fitting options recorded in a folder's options.txt
+
+        :param folder: Results folder
+        :type folder: str or pathlib.Path
+        :return: Options, or None if not recorded
+        :rtype: dict or None
+        """
+        folder_id = self._require_id(folder)
+        row = self._conn.execute('SELECT options FROM folders WHERE id = ?', (folder_id,)).fetchone()
+        return None if row[0] is None else json.loads(row[0])
+
+    def table(self, name, folder):
+        """Return a single folder's table in the format of the original CSV file.
+
+        :param name: Table name, e.g. 'concentrations', 'qc', 'parameters', 'dyn_cov'
+        :type name: str
+        :param folder: Results folder
+        :type folder: str or pathlib.Path
+        :return: Table
+        :rtype: pandas.DataFrame
+        """
+        if name not in _LABELS:
+            raise ResultsIndexError(f'{name} is not an indexed table. Choose from: {", ".join(_LABELS)}.')
+        labels = _LABELS[name]
+        long_df = pd.read_sql_query(
+            f'SELECT {", ".join(labels)}, value FROM {name} WHERE folder = ? ORDER BY rowid',
+            self._conn,
+            params=(self._require_id(folder),))
+        if long_df.empty:
+            raise ResultsIndexError(f'No {name} table recorded for {folder}.')
+        return _to_wide(long_df, labels)
+
+    def _combined(self, name, folders, names):
+        """Concatenate a table across folders, keyed by dataset name."""
+        if folders is None:
+            folders = self.folders(kind='svs')
+        if names is None:
+            names = [str(Path(fp).resolve()) for fp in folders]
+        return pd.concat(
+            [self.table(name, fp) for fp in folders],
+            keys=names,
+            names=['dataset', 'Metabolite'])
+
+    def concentrations(self, folders=None, names=None):
+        """Concentrations of multiple SVS results, indexed by metabolite and dataset.
+
+        :param folders: Results folders, defaults to None (all indexed SVS results)
+        :type folders: list, optional
+        :param names: Dataset names, defaults to None (resolved folder paths)
+        :type names: list of str, optional
+        :return: Concentrations, columns are (mean/std, scaling)
+        :rtype: pandas.DataFrame
+        """
+        return self._combined('concentrations', folders, names)\
+            .reorder_levels(['Metabolite', 'dataset'], axis=0)\
+            .sort_index()
+
+    def qc(self, folders=None, names=None):
+        """QC (SNR and FWHM) of multiple SVS results, indexed by metabolite and dataset.
+
+        :param folders: Results folders, defaults to None (all indexed SVS results)
+        :type folders: list, optional
+        :param names: Dataset names, defaults to None (resolved folder paths)
+        :type names: list of str, optional
+        :return: QC measures
+        :rtype: pandas.DataFrame
+        """
+        return self._combined('qc', folders, names)\
+            .reorder_levels(['Metabolite', 'dataset'], axis=0)\
+            .sort_index()
+
+    def dynamic_results(self, folder):
+        """Free parameter values, covariance and mapped parameter names of a fsl_dynmrs result.
+
+        :param folder: Results folder
+        :type folder: str or pathlib.Path
+        :return: Free parameter dataframe, covariance dataframe and mapped parameter names
+        :rtype: tuple
+        """
+        value_df = self.table('dyn_results', folder)
+        cov_df = self.table('dyn_cov', folder)
+        mapped_names = self.table('mapped_parameters', folder).index
+        return value_df, cov_df, mapped_names
+
+    def query(self, sql, params=()):
+        """Run an SQL query on the index.
+
+        :param sql: SQL query
+        :type sql: str
+        :param params: Query parameters, defaults to ()
+        :type params: tuple, optional
+        :return: Query result
+        :rtype: pandas.DataFrame
+        """
+        return pd.read_sql_query(sql, self._conn, params=params)